@@ -10,6 +10,8 @@ from pydantic import BaseModel
 from passlib.context import CryptContext
 
 from database import stc_db
+from directory import employee_directory
+from auth import bearer_claims, load_principal, principal_cache, revoke_sessions_update
 from models import (
     PasswordChangeRequest,
     get_user_info_with_collection,
@@ -22,45 +24,16 @@ async def get_current_admin_user(authorization: Optional[str] = Header(None, ali
     """
     Dependency to get and validate the current admin user from a token.
     This checks if the user associated with the token is an admin.
-    If no token is provided, it returns None. If a token is provided but invalid, it raises an error.
     """
     if not authorization:
         raise HTTPException(status_code=401, detail="Authorization header missing")
 
-    if not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token_str = authorization.split(" ")[1]
-    logging.info(f"Admin auth attempt with token: {token_str[:100]}...") # Log token safely
-
-    user_email_from_token = None
-    try:
-        # The token is a Base64-encoded JSON string of the user object.
-        # First, decode from Base64, then parse the JSON.
-        decoded_token = base64.b64decode(token_str).decode('utf-8')
-        user_data_from_token = json.loads(decoded_token)
-        user_email_from_token = user_data_from_token.get("email") if isinstance(user_data_from_token, dict) else None
-    except (json.JSONDecodeError, base64.binascii.Error, AttributeError, TypeError) as e:
-        logging.warning(f"Admin auth failed: Could not decode or parse token. Error: {e}. Token: {token_str[:100]}...")
-        raise HTTPException(status_code=401, detail="Invalid token format.")
-
-    if not user_email_from_token:
-        logging.warning("Admin auth failed: Could not extract email from token.")
-        raise HTTPException(status_code=401, detail="Invalid token: email missing.")
-
-    user, _ = await get_user_info_with_collection(stc_db, user_email_from_token)
-
-    if not user:
-        logging.warning(f"Admin auth failed: User '{user_email_from_token}' not found in database")
-        raise HTTPException(status_code=401, detail="User not found or token is invalid")
-
-    # Check if the user exists and has an admin designation.
-    # Also check the 'isAdmin' flag for robustness.
-    designation = user.get("designation", "").lower().strip()
-    if user.get("isAdmin") or "admin" in designation or "director" in designation:
-        logging.info(f"Admin access granted for user: {user_email_from_token}")
+    claims = bearer_claims(authorization)
+    user, is_admin = await load_principal(claims)
+    if is_admin:
         return user
 
+    logging.warning(f"Admin auth failed: '{claims.get('sub')}' is not an administrator")
     raise HTTPException(status_code=403, detail="User is not an administrator")
 
 
@@ -121,6 +94,9 @@ async def admin_update_user_details(
         {"$set": update_payload}
     )
 
+    await employee_directory.refresh(new_email or decoded_email, collection, previous_key=decoded_email)
+    principal_cache.invalidate(decoded_email)
+
     logging.info(f"Admin '{admin_user.get('email')}' updated details for user '{decoded_email}'.")
     return {"message": f"User {decoded_email} updated successfully."}
 
@@ -138,6 +114,8 @@ async def admin_delete_user(email: str, admin_user: dict = Depends(get_current_a
     result = await collection.delete_one({"email": re.compile(f"^{re.escape(decoded_email)}$", re.IGNORECASE)})
 
     if result.deleted_count > 0:
+        employee_directory.discard(decoded_email)
+        principal_cache.invalidate(decoded_email)
         logging.info(f"Admin '{admin_user.get('email')}' permanently deleted user '{decoded_email}'.")
         return {"message": f"User {decoded_email} has been permanently deleted."}
     
@@ -167,10 +145,11 @@ async def admin_reset_password(
         # Update the password in the database
         result = await collection.update_one(
             {"email": re.compile(f"^{re.escape(decoded_email)}$", re.IGNORECASE)},
-            {"$set": {"password_hash": new_password_hash}}
+            {"$set": {"password_hash": new_password_hash, **revoke_sessions_update()}}
         )
 
         if result.modified_count > 0:
+            principal_cache.invalidate(decoded_email)
             logging.info(f"Admin '{admin_user.get('email')}' reset password for user '{decoded_email}'.")
             return {"message": "Password updated successfully"}
         
@@ -123,7 +123,7 @@ async def create_announcement(
 
             # --- Create notifications for offline users ---
             all_employee_emails = await get_all_employees_emails(stc_db)
-            offline_users = [email for email in all_employee_emails if email not in manager.active_connections and email != admin_user.get("email")]
+            offline_users = [email for email in all_employee_emails if not manager.is_online(email) and email != admin_user.get("email")]
 
             if offline_users:
                 notifications_to_create = [
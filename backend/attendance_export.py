@@ -0,0 +1,79 @@
+"""
+attendance_export.py
+--------------------
+Spreadsheet export of the biometric day-wise attendance: one row per
+employee-day, written as employees arrive from an async iterator of
+biometric._employee_attendance dicts, so a 92-day company export never holds
+more than one batch in memory.
+
+    stream_csv(employees)   yields CSV text chunks, one per employee
+    stream_xlsx(employees)  yields the bytes of an .xlsx workbook
+
+CSV bytes go out as soon as the first employee is computed. XLSX uses
+openpyxl's write-only mode, which spools rows to a temporary file instead of
+building the sheet in memory; the workbook can only be sent once it is
+closed, so its bytes follow the last row.
+"""
+import asyncio
+import csv
+import io
+import logging
+import tempfile
+
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+logger = logging.getLogger(__name__)
+
+XLSX_AVAILABLE = Workbook is not None
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CHUNK_SIZE = 64 * 1024
+
+COLUMNS = ["Emp Code", "Name", "Date", "Weekday", "Status", "First In", "First In Device",
+           "Late", "Late By", "Last Out", "Last Out Device", "Breaks", "Break Time",
+           "Working Hours", "Punch Count"]
+
+
+def day_rows(emp: dict):
+    """Spreadsheet rows for one employee's days."""
+    for d in emp["days"]:
+        breaks = ", ".join(f"{b['time']} ({b['device']})" if b.get("device") else b["time"]
+                           for b in d.get("breaks") or [])
+        yield [emp["emp_code"], emp["emp_name"], d["date"], d["weekday"], d["status"],
+               d["first_in"], d["first_in_device"], "Yes" if d["late"] else "", d["late_by"],
+               d["last_out"], d["last_out_device"], breaks, d["break_time"],
+               d["working_hours"], d["punch_count"]]
+
+
+async def stream_csv(employees):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write("\ufeff")  # BOM so Excel opens UTF-8 names correctly
+    writer.writerow(COLUMNS)
+    async for emp in employees:
+        writer.writerows(day_rows(emp))
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+async def stream_xlsx(employees):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Attendance")
+    ws.append(COLUMNS)
+    rows = 0
+    async for emp in employees:
+        for row in day_rows(emp):
+            ws.append(row)
+            rows += 1
+    with tempfile.TemporaryFile() as fh:
+        await asyncio.to_thread(wb.save, fh)
+        fh.seek(0)
+        while True:
+            chunk = await asyncio.to_thread(fh.read, CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    logger.info("Attendance XLSX export: %d rows", rows)
@@ -0,0 +1,143 @@
+"""
+attendance_rollup.py
+--------------------
+Per-employee, per-month attendance summaries (AttendanceMonthly).
+
+    {empCode, year, month, empName, P, A, H, L, dailyRecords: [...]}
+
+One document per (empCode, year, month), with the month's day records
+(deduplicated by date, latest write wins) and the P / A / H / L counts the
+month reports show. Month and manager reports become indexed point reads on
+(year, month[, empCode]) instead of unwinding every employee's history.
+
+Rollups are refreshed for exactly the (empCode, month) pairs a write touched
+(`save_attendance_report`, `biometric.sync`). A month that has never been
+rolled up (e.g. data written before this existed) is built in full on its
+first read and marked in AttendanceRollupState, so no manual backfill is
+needed; `rebuild_month` is also exposed to admins.
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from attendance_store import find_days, group_by_employee, migrate_legacy
+from database import attendance_db
+
+logger = logging.getLogger(__name__)
+
+MONTHLY = attendance_db["AttendanceMonthly"]
+ROLLUP_STATE = attendance_db["AttendanceRollupState"]
+
+_NOT_LATE = {None, "", "00:00", "00:00:00"}
+
+
+def month_bounds(year: int, month: int) -> Tuple[datetime, datetime]:
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    end = datetime(year + 1, 1, 1, tzinfo=timezone.utc) if month == 12 else datetime(year, month + 1, 1, tzinfo=timezone.utc)
+    return start, end
+
+
+def month_of(date: datetime) -> Tuple[int, int]:
+    return date.year, date.month
+
+
+def summarize(records: List[dict]) -> Dict[str, int]:
+    """P / A / H / L counts for a month's day records. L counts present days with a non-zero lateBy."""
+    counts = {"P": 0, "A": 0, "H": 0, "L": 0}
+    for record in records:
+        status = record.get("status")
+        if status == "P":
+            counts["P"] += 1
+            if record.get("lateBy") not in _NOT_LATE:
+                counts["L"] += 1
+        elif status == "A":
+            counts["A"] += 1
+        elif status in ("H", "Holiday"):
+            counts["H"] += 1
+    return counts
+
+
+def manager_late_count(records: List[dict]) -> int:
+    """Late days as the manager month report has always counted them: any record
+    whose lateBy sorts after "00:00", whatever its status. `summarize`'s L, used
+    by the month views, counts present days with a non-zero lateBy only."""
+    return sum(1 for record in records if isinstance(record.get("lateBy"), str) and record["lateBy"] > "00:00")
+
+
+async def ensure_indexes():
+    await MONTHLY.create_index([("year", 1), ("month", 1), ("empCode", 1)], unique=True)
+    await MONTHLY.create_index([("empCode", 1), ("year", 1), ("month", 1)])
+
+
+async def _source_month(year: int, month: int, emp_codes: Optional[List[str]] = None) -> Dict[str, Tuple[str, List[dict]]]:
+    """{empCode: (empName, records)} for one month from AttendanceDaily."""
+    start, end = month_bounds(year, month)
+    employees = group_by_employee(await find_days(start, end, emp_codes))
+    return {emp["empCode"]: (emp.get("empName") or emp["empCode"], emp["dailyRecords"]) for emp in employees}
+
+
+def _rollup_doc(emp_code: str, emp_name: str, year: int, month: int, records: List[dict]) -> dict:
+    by_date = {}
+    for record in records:
+        by_date[record.get("date")] = record  # later records win
+    day_records = sorted(by_date.values(), key=lambda r: r.get("date") or datetime.min)
+    return {"empCode": emp_code, "empName": emp_name, "year": year, "month": month,
+            **summarize(day_records), "dailyRecords": day_records,
+            "updatedAt": datetime.now(timezone.utc)}
+
+
+async def refresh(pairs: Iterable[Tuple[str, int, int]]):
+    """Recompute the rollups for the given (empCode, year, month) pairs."""
+    by_month: Dict[Tuple[int, int], Set[str]] = {}
+    for emp_code, year, month in pairs:
+        by_month.setdefault((year, month), set()).add(emp_code)
+    for (year, month), codes in by_month.items():
+        source = await _source_month(year, month, sorted(codes))
+        for emp_code in codes:
+            if emp_code in source:
+                emp_name, records = source[emp_code]
+                await MONTHLY.replace_one({"year": year, "month": month, "empCode": emp_code},
+                                          _rollup_doc(emp_code, emp_name, year, month, records), upsert=True)
+            else:
+                await MONTHLY.delete_one({"year": year, "month": month, "empCode": emp_code})
+
+
+async def rebuild_month(year: int, month: int) -> int:
+    """Rebuild every employee's rollup for a month from the source records."""
+    source = await _source_month(year, month)
+    for emp_code, (emp_name, records) in source.items():
+        await MONTHLY.replace_one({"year": year, "month": month, "empCode": emp_code},
+                                  _rollup_doc(emp_code, emp_name, year, month, records), upsert=True)
+    await MONTHLY.delete_many({"year": year, "month": month, "empCode": {"$nin": list(source)}})
+    await ROLLUP_STATE.update_one({"year": year, "month": month},
+                                  {"$set": {"builtAt": datetime.now(timezone.utc)}}, upsert=True)
+    logger.info("Rebuilt attendance rollups for %04d-%02d: %d employees", year, month, len(source))
+    return len(source)
+
+
+async def _ensure_built(year: int, month: int):
+    if not await ROLLUP_STATE.find_one({"year": year, "month": month}, {"_id": 1}):
+        await rebuild_month(year, month)
+
+
+async def migrate_legacy_attendance() -> int:
+    """Migrate legacy Attendance documents and, if any moved, let every month rebuild on its next read."""
+    migrated = await migrate_legacy()
+    if migrated:
+        await ROLLUP_STATE.delete_many({})
+    return migrated
+
+
+async def month_report(year: int, month: int, emp_codes: Optional[List[str]] = None) -> List[dict]:
+    """Rollup documents for a month, optionally limited to some employees."""
+    await _ensure_built(year, month)
+    query = {"year": year, "month": month}
+    if emp_codes is not None:
+        query["empCode"] = {"$in": emp_codes}
+    return await MONTHLY.find(query, {"_id": 0, "year": 0, "month": 0, "updatedAt": 0}).to_list(length=None)
+
+
+async def employee_month(emp_code: str, year: int, month: int) -> Optional[dict]:
+    await _ensure_built(year, month)
+    return await MONTHLY.find_one({"empCode": emp_code, "year": year, "month": month},
+                                  {"_id": 0, "year": 0, "month": 0, "updatedAt": 0})
@@ -0,0 +1,166 @@
+"""
+attendance_store.py
+-------------------
+Day-level attendance storage (AttendanceDaily).
+
+    {empCode, date, empName, status, inTime, outTime, lateBy, totalWorkingHours, ingestedAt}
+
+One document per (empCode, date) under a unique index, replacing the
+per-employee Attendance documents whose `dailyRecords` array grew without
+bound (and duplicated days whenever a month was uploaded twice). Every report
+reads an index range instead of whole arrays.
+
+All writes go through `ingest_days`: UpdateOne(upsert=True) keyed on
+(empCode, date), flushed in unordered bulk_write batches of
+ATTENDANCE_INGEST_BATCH_SIZE, reporting how many days were inserted, updated
+and skipped (unchanged). Re-ingesting the same file is a no-op.
+
+`migrate_legacy` copies the old Attendance documents over (never replacing
+a day already written in the new layout) and flags each one `migratedToDaily`,
+so it is safe to re-run; it runs at startup and as
+`python migrate_attendance_daily.py`.
+
+Config (.env):
+    ATTENDANCE_INGEST_BATCH_SIZE=1000
+"""
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from database import attendance_db
+
+logger = logging.getLogger(__name__)
+
+DAILY = attendance_db["AttendanceDaily"]
+LEGACY = attendance_db["Attendance"]
+
+RECORD_FIELDS = ("status", "inTime", "outTime", "lateBy", "totalWorkingHours")
+INGEST_BATCH_SIZE = int(os.environ.get("ATTENDANCE_INGEST_BATCH_SIZE", "1000"))
+
+
+async def ensure_indexes():
+    await DAILY.create_index([("empCode", 1), ("date", 1)], unique=True)
+    await DAILY.create_index([("date", 1), ("empCode", 1)])
+
+
+def _day_update(emp_code: str, emp_name: Optional[str], record: dict, overwrite: bool = True) -> UpdateOne:
+    # No write timestamp in $set: an identical re-ingest must leave the
+    # document unmodified so it is reported as skipped.
+    fields = {k: record.get(k) for k in RECORD_FIELDS}
+    on_insert = {"empCode": emp_code, "date": record["date"], "ingestedAt": datetime.now(timezone.utc)}
+    if overwrite:
+        if emp_name:
+            fields["empName"] = emp_name
+        else:
+            on_insert["empName"] = emp_code
+        update = {"$set": fields, "$setOnInsert": on_insert}
+    else:
+        update = {"$setOnInsert": {**on_insert, **fields, "empName": emp_name or emp_code}}
+    return UpdateOne({"empCode": emp_code, "date": record["date"]}, update, upsert=True)
+
+
+async def _bulk_upsert(ops: List[UpdateOne]) -> Dict[str, int]:
+    """Flush upserts in unordered batches of INGEST_BATCH_SIZE.
+    Returns {"inserted", "updated", "skipped"}; matched-but-unchanged days and
+    failed writes count as skipped."""
+    counts = {"inserted": 0, "updated": 0, "skipped": 0}
+    for i in range(0, len(ops), INGEST_BATCH_SIZE):
+        batch = ops[i:i + INGEST_BATCH_SIZE]
+        try:
+            result = await DAILY.bulk_write(batch, ordered=False)
+            upserted, modified = result.upserted_count, result.modified_count
+        except BulkWriteError as e:
+            # ordered=False: the rest of the batch was still applied
+            details = e.details
+            upserted, modified = details.get("nUpserted", 0), details.get("nModified", 0)
+            logger.warning("Attendance ingest: %d of %d writes failed, first: %s",
+                           len(details.get("writeErrors", [])), len(batch), (details.get("writeErrors") or [{}])[0].get("errmsg"))
+        counts["inserted"] += upserted
+        counts["updated"] += modified
+        counts["skipped"] += len(batch) - upserted - modified
+    return counts
+
+
+async def ingest_days(employees: Iterable[dict]) -> Dict[str, int]:
+    """Write each employee's day records ({empCode, empName, dailyRecords}),
+    replacing any record already stored for the same day.
+
+    Idempotent: re-ingesting the same data matches every day and modifies
+    none, so it comes back as all skipped. Within one call a day given twice
+    is written once (last wins); records without an empCode or date are skipped.
+    """
+    latest: Dict[tuple, UpdateOne] = {}
+    invalid = 0
+    for emp in employees:
+        for record in emp.get("dailyRecords") or []:
+            if not emp.get("empCode") or not isinstance(record.get("date"), datetime):
+                invalid += 1
+                continue
+            latest[(emp["empCode"], record["date"])] = _day_update(emp["empCode"], emp.get("empName"), record)
+    counts = await _bulk_upsert(list(latest.values()))
+    counts["skipped"] += invalid
+    return counts
+
+
+def _record(doc: dict) -> dict:
+    record = {"date": doc["date"]}
+    record.update({k: doc.get(k) for k in RECORD_FIELDS})
+    return record
+
+
+def group_by_employee(docs: Iterable[dict]) -> List[dict]:
+    """[{empCode, empName, dailyRecords}] from day documents, in first-seen order."""
+    employees: Dict[str, dict] = {}
+    for doc in docs:
+        emp = employees.setdefault(doc["empCode"], {"empCode": doc["empCode"], "empName": doc.get("empName"), "dailyRecords": []})
+        emp["dailyRecords"].append(_record(doc))
+    return list(employees.values())
+
+
+async def find_days(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                    emp_codes: Optional[List[str]] = None, end_inclusive: bool = False) -> List[dict]:
+    """Day documents in [start, end) (or [start, end]), optionally for some employees."""
+    query: dict = {}
+    if emp_codes is not None:
+        query["empCode"] = emp_codes[0] if len(emp_codes) == 1 else {"$in": emp_codes}
+    date_range = {}
+    if start is not None:
+        date_range["$gte"] = start
+    if end is not None:
+        date_range["$lte" if end_inclusive else "$lt"] = end
+    if date_range:
+        query["date"] = date_range
+    return await DAILY.find(query, {"_id": 0, "ingestedAt": 0}).sort([("empCode", 1), ("date", 1)]).to_list(length=None)
+
+
+async def employee_codes() -> List[str]:
+    """Every empCode with a stored day, sorted (one entry per employee, not per day)."""
+    return sorted(str(code) for code in await DAILY.distinct("empCode") if code)
+
+
+async def has_employee(emp_code: str) -> bool:
+    return await DAILY.find_one({"empCode": emp_code}, {"_id": 1}) is not None
+
+
+async def migrate_legacy() -> int:
+    """Copy unmigrated Attendance documents into AttendanceDaily. Returns the number of employees migrated."""
+    migrated = 0
+    async for doc in LEGACY.find({"migratedToDaily": {"$ne": True}}):
+        emp_code = doc.get("empCode")
+        if not emp_code:
+            continue
+        by_date = {}
+        for record in doc.get("dailyRecords") or []:
+            if isinstance(record.get("date"), datetime):
+                by_date[record["date"]] = record  # later duplicates win, as the reports showed them last
+        await _bulk_upsert([_day_update(emp_code, doc.get("empName"), record, overwrite=False)
+                            for record in by_date.values()])
+        await LEGACY.update_one({"_id": doc["_id"]}, {"$set": {"migratedToDaily": True}})
+        migrated += 1
+    if migrated:
+        logger.info("Migrated %d Attendance documents to AttendanceDaily", migrated)
+    return migrated
@@ -0,0 +1,232 @@
+"""
+auth.py
+-------
+Signed session tokens and the verified-principal cache.
+
+`profile.login` issues an HMAC-SHA256 signed token carrying the user's email,
+empCode, team and admin flag plus an expiry. Authenticated requests verify the
+signature locally and then take the user document from a short-TTL principal
+cache, so the common case does no database reads at all.
+
+The frontend builds its Authorization header as base64(JSON.stringify(user)),
+and the login response (including `access_token`) is what it stores as the
+user, so the signed token normally arrives embedded in that JSON. Bare signed
+tokens are accepted too.
+
+Legacy email-only tokens (base64 of {"email": ...}, unsigned, so anyone can
+forge one) are rejected unless ALLOW_LEGACY_TOKENS is turned on, and then
+only until LEGACY_TOKENS_UNTIL (YYYY-MM-DD, UTC) if that is set. Even then
+they never pass an admin check, and any `tokens_valid_after` stamp (password
+reset, deactivation) rejects them since they carry no issue time.
+
+Config (.env):
+    SECRET_KEY=<long random string, identical on every worker>
+    SESSION_TOKEN_TTL_SECONDS=604800
+    PRINCIPAL_CACHE_TTL_SECONDS=60
+    ALLOW_LEGACY_TOKENS=false
+    LEGACY_TOKENS_UNTIL=
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+from directory import employee_directory
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PREFIX = "stc1"
+TOKEN_TTL_SECONDS = int(os.environ.get("SESSION_TOKEN_TTL_SECONDS", str(7 * 24 * 3600)))
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.environ.get("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+ALLOW_LEGACY_TOKENS = os.environ.get("ALLOW_LEGACY_TOKENS", "false").lower() in ("1", "true", "yes")
+
+
+def _legacy_deadline(value: str) -> Optional[float]:
+    if not value.strip():
+        return None
+    try:
+        return datetime.strptime(value.strip(), "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        logger.warning("LEGACY_TOKENS_UNTIL=%r is not YYYY-MM-DD; legacy tokens stay disabled", value)
+        return 0.0
+
+
+LEGACY_TOKENS_UNTIL = _legacy_deadline(os.environ.get("LEGACY_TOKENS_UNTIL", ""))
+
+_secret = os.environ.get("SECRET_KEY")
+if not _secret:
+    logger.warning("SECRET_KEY not set; using a per-process key. Tokens will not survive a restart "
+                   "and will not validate across workers.")
+    _secret = secrets.token_urlsafe(48)
+SECRET_KEY = _secret.encode("utf-8")
+
+
+class TokenError(ValueError): pass
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(signing_input: str) -> str:
+    return _b64encode(hmac.new(SECRET_KEY, signing_input.encode("ascii"), hashlib.sha256).digest())
+
+
+def is_admin_user(user: dict) -> bool:
+    designation = (user.get("designation") or user.get("Designation") or "").lower().strip()
+    return bool(user.get("isAdmin")) or "admin" in designation or "director" in designation
+
+
+def issue_token(user: dict, ttl: int = TOKEN_TTL_SECONDS) -> str:
+    now = int(time.time())
+    claims = {
+        "sub": user.get("email") or user.get("id"),
+        "emp": str(user.get("empCode") or user.get("Emp code") or ""),
+        "team": user.get("team") or "",
+        "adm": is_admin_user(user),
+        "iat": now,
+        "exp": now + ttl,
+    }
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    signing_input = f"{TOKEN_PREFIX}.{payload}"
+    return f"{signing_input}.{_sign(signing_input)}"
+
+
+def verify_token(token: str) -> dict:
+    """Return the claims of a signed token, or raise TokenError."""
+    try:
+        prefix, payload, signature = token.split(".")
+    except ValueError:
+        raise TokenError("Malformed token")
+    if prefix != TOKEN_PREFIX:
+        raise TokenError("Unknown token type")
+    if not hmac.compare_digest(signature, _sign(f"{prefix}.{payload}")):
+        raise TokenError("Bad signature")
+    try:
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, TypeError):
+        raise TokenError("Malformed payload")
+    if not claims.get("sub"):
+        raise TokenError("Token has no subject")
+    if claims.get("exp", 0) < time.time():
+        raise TokenError("Token expired")
+    return claims
+
+
+def legacy_tokens_allowed() -> bool:
+    if not ALLOW_LEGACY_TOKENS:
+        return False
+    return LEGACY_TOKENS_UNTIL is None or time.time() < LEGACY_TOKENS_UNTIL
+
+
+def bearer_claims(authorization: Optional[str]) -> dict:
+    """Decode an `Authorization: Bearer ...` header into claims.
+
+    Raises HTTPException(401) for anything that is not a valid signed token,
+    a base64 user object embedding one, or (if allowed) a legacy token."""
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    token_str = authorization.split(" ", 1)[1].strip()
+    try:
+        if token_str.startswith(TOKEN_PREFIX + "."):
+            return verify_token(token_str)
+        try:
+            user_data = json.loads(base64.b64decode(token_str).decode("utf-8"))
+        except Exception:
+            raise HTTPException(status_code=401, detail="Invalid token format.")
+        if not isinstance(user_data, dict):
+            raise HTTPException(status_code=401, detail="Invalid token format.")
+        if user_data.get("access_token"):
+            return verify_token(user_data["access_token"])
+        if legacy_tokens_allowed() and user_data.get("email"):
+            return {"sub": user_data["email"], "legacy": True}
+        raise HTTPException(status_code=401, detail="Invalid token: email missing.")
+    except TokenError as e:
+        raise HTTPException(status_code=401, detail=f"Invalid token: {e}")
+
+
+class PrincipalCache:
+    """email -> (expiry, user document, admin flag) for recently verified users."""
+
+    def __init__(self, ttl: int = PRINCIPAL_CACHE_TTL_SECONDS, max_size: int = 5000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: Dict[str, Tuple[float, dict, bool]] = {}
+
+    def get(self, email: str) -> Optional[Tuple[dict, bool]]:
+        hit = self._entries.get(email.lower())
+        if not hit:
+            return None
+        expires_at, user, admin = hit
+        if expires_at < time.monotonic():
+            self._entries.pop(email.lower(), None)
+            return None
+        return user, admin
+
+    def put(self, email: str, user: dict):
+        if len(self._entries) >= self.max_size:
+            now = time.monotonic()
+            self._entries = {k: v for k, v in self._entries.items() if v[0] >= now}
+            if len(self._entries) >= self.max_size:
+                self._entries.clear()
+        self._entries[email.lower()] = (time.monotonic() + self.ttl, user, is_admin_user(user))
+
+    def invalidate(self, email: Optional[str]):
+        if email:
+            self._entries.pop(email.lower(), None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+principal_cache = PrincipalCache()
+
+
+def _issued_before(claims: dict, user: dict) -> bool:
+    """True if the token predates the user's last password reset / deactivation.
+    Legacy claims have no issue time, so any stamp rejects them."""
+    valid_after = user.get("tokens_valid_after")
+    if not valid_after:
+        return False
+    if isinstance(valid_after, datetime):
+        if valid_after.tzinfo is None:
+            valid_after = valid_after.replace(tzinfo=timezone.utc)
+        valid_after = valid_after.timestamp()
+    return claims.get("iat", 0) < int(valid_after)
+
+
+async def load_principal(claims: dict) -> Tuple[dict, bool]:
+    """Return (user document, is_admin) for verified claims, cache first."""
+    email = claims["sub"]
+    cached = principal_cache.get(email)
+    if cached is None:
+        user, _ = await employee_directory.fetch(email, fields=("email", "id"))
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found or token is invalid")
+        principal_cache.put(email, user)
+        cached = principal_cache.get(email)
+    user, admin = cached
+    if user.get("active") is False:
+        raise HTTPException(status_code=401, detail="Account is deactivated.")
+    if _issued_before(claims, user):
+        raise HTTPException(status_code=401, detail="Session expired. Please log in again.")
+    if claims.get("legacy"):
+        admin = False   # unsigned tokens never carry admin rights
+    return dict(user), admin
+
+
+def revoke_sessions_update() -> dict:
+    """$set fragment that invalidates every token issued before now."""
+    return {"tokens_valid_after": datetime.now(timezone.utc)}
@@ -0,0 +1,125 @@
+"""
+backplane.py
+------------
+Pub/sub between API workers for the chat websocket tier.
+
+Each worker only holds its own sockets. Anything that must reach a user,
+a channel or everyone (messages, reactions, read receipts, unread-count
+changes, presence) is published to the backplane as a small JSON event; every
+worker - including the publisher - receives it and delivers it to the sockets
+it holds (`ConnectionManager.handle_event`).
+
+    LocalBackplane  - in-process, delivers synchronously to the one handler.
+                      The default; also what tests use.
+    RedisBackplane  - Redis pub/sub on one channel, for several uvicorn
+                      workers or nodes.
+
+Config (.env):
+    CHAT_BACKPLANE=local          # or redis
+    REDIS_URL=redis://localhost:6379/0
+    CHAT_BACKPLANE_CHANNEL=stc:chat
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+BACKPLANE = os.environ.get("CHAT_BACKPLANE", "local").lower()
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+BACKPLANE_CHANNEL = os.environ.get("CHAT_BACKPLANE_CHANNEL", "stc:chat")
+
+# Identifies this worker in published events (presence is tracked per worker).
+WORKER_ID = uuid.uuid4().hex[:12]
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+class Backplane:
+    def __init__(self):
+        self._handler: Optional[Handler] = None
+
+    def bind(self, handler: Handler):
+        self._handler = handler
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, event: dict):
+        raise NotImplementedError
+
+
+class LocalBackplane(Backplane):
+    """Single-process backplane: publishing is a direct call to the handler."""
+
+    async def publish(self, event: dict):
+        if self._handler is not None:
+            await self._handler(event)
+
+
+class RedisBackplane(Backplane):
+    def __init__(self, url: str = REDIS_URL, channel: str = BACKPLANE_CHANNEL):
+        super().__init__()
+        self.url = url
+        self.channel = channel
+        self._redis = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self):
+        import redis.asyncio as aioredis
+
+        self._redis = aioredis.from_url(self.url, decode_responses=True)
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(self.channel)
+        self._listener = asyncio.create_task(self._listen(pubsub))
+        logger.info("Chat backplane subscribed to %s on %s (worker %s)", self.channel, self.url, WORKER_ID)
+
+    async def _listen(self, pubsub):
+        while True:
+            try:
+                async for item in pubsub.listen():
+                    if item.get("type") != "message" or self._handler is None:
+                        continue
+                    try:
+                        await self._handler(json.loads(item["data"]))
+                    except Exception as e:
+                        logger.error("Backplane event handling failed: %s", e)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Backplane subscription lost, resubscribing: %s", e)
+                await asyncio.sleep(1)
+                try:
+                    await pubsub.subscribe(self.channel)
+                except Exception:
+                    pass
+
+    async def publish(self, event: dict):
+        if self._redis is None:
+            # Not started (e.g. startup failed): keep this worker functional.
+            if self._handler is not None:
+                await self._handler(event)
+            return
+        await self._redis.publish(self.channel, json.dumps(event))
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
+
+
+def create_backplane() -> Backplane:
+    if BACKPLANE == "redis":
+        return RedisBackplane()
+    if BACKPLANE != "local":
+        logger.warning("Unknown CHAT_BACKPLANE %r; using the in-process backplane", BACKPLANE)
+    return LocalBackplane()
@@ -0,0 +1,81 @@
+"""
+bench_biometric_summary.py
+--------------------------
+Times the plain-Python and the columnar NumPy paths of
+biometric_summary.summarize_punches on synthetic punches, and checks that
+both produce the same summaries.
+
+    python bench_biometric_summary.py [--employees 500] [--days 92] [--repeat 3]
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from biometric_summary import Directions, np, summarize_punches_columnar, summarize_punches_python
+
+DEVICES = [("IN-SERIAL", "Main Door In"), ("OUT-SERIAL", "Main Door Out"), ("GATE", "Gate")]
+
+
+def synthetic_punches(employees, days, seed=7):
+    """A working day per employee-day: arrival, 0-3 Out/In round trips, departure."""
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1, 3, 30, tzinfo=timezone.utc)  # 09:00 IST
+    rows = []
+    for e in range(employees):
+        code = f"EMP{e:04d}"
+        for d in range(days):
+            t = start + timedelta(days=d, minutes=rng.randint(-30, 60), seconds=rng.randint(0, 59))
+            stamps = [(t, DEVICES[0])]
+            for _ in range(rng.randint(0, 3)):
+                t += timedelta(minutes=rng.randint(60, 150))
+                stamps.append((t, DEVICES[1]))
+                t += timedelta(minutes=rng.randint(5, 45))
+                stamps.append((t, rng.choice((DEVICES[0], DEVICES[2]))))
+            t += timedelta(minutes=rng.randint(120, 300))
+            stamps.append((t, DEVICES[1]))
+            rows.extend({"user_id": code, "punch_time": pt.replace(tzinfo=None), "serial": serial, "device": name}
+                        for pt, (serial, name) in stamps)
+    rng.shuffle(rows)
+    return rows
+
+
+def _timed(fn, rows, directions, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        began = time.perf_counter()
+        result = fn(rows, directions)
+        elapsed = time.perf_counter() - began
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _comparable(summaries):
+    return {key: {k: v for k, v in doc.items() if k != "updated_at"} for key, doc in summaries.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[-1])
+    parser.add_argument("--employees", type=int, default=500)
+    parser.add_argument("--days", type=int, default=92)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    directions = Directions(in_serials={"IN-SERIAL"}, out_serials={"OUT-SERIAL"})
+    rows = synthetic_punches(args.employees, args.days)
+    print(f"{len(rows)} punches, {args.employees} employees x {args.days} days")
+
+    python_time, expected = _timed(summarize_punches_python, rows, directions, args.repeat)
+    print(f"python:   {python_time:.3f}s")
+    if np is None:
+        print("numpy is not installed; columnar path skipped")
+        return
+    columnar_time, actual = _timed(summarize_punches_columnar, rows, directions, args.repeat)
+    print(f"columnar: {columnar_time:.3f}s ({python_time / columnar_time:.1f}x)")
+    if _comparable(actual) != _comparable(expected):
+        raise SystemExit("columnar summaries differ from the python path")
+    print(f"{len(expected)} employee-days identical")
+
+
+if __name__ == "__main__":
+    main()
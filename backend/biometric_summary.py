@@ -0,0 +1,304 @@
+"""
+biometric_summary.py
+--------------------
+Per-(empCode, day) summaries of biometric punches, shared by the portal and
+essl_office_agent.py. No database or web imports: callers hand in punch rows
+and store what comes back.
+
+A summary document (collection `biometric_daily`) looks like
+
+    {emp_code, day: "YYYY-MM-DD" (IST), first_in_at, first_in, first_in_device,
+     last_out, last_out_device, breaks, break_time, working_hours,
+     punch_count, signature, updated_at}
+
+`signature` identifies the punch set the summary was built from. Punches are
+only ever inserted (never edited or deleted), so the count plus the first and
+last punch time changes exactly when the set does; readers compare it with
+the same figures aggregated from the raw punches and rebuild only the days
+that differ. Lateness depends on the employee's shift, which can change, so
+it is not stored: `day_record` works it out from `first_in_at` at read time.
+
+Large batches (rebuilding a 92-day range for the whole company) go through a
+columnar NumPy path: punches become arrays of (code index, day index, epoch
+ms, direction), sorted once and split into employee-days with searchsorted,
+and first-in, last-out, break time and working hours come out of one
+vectorized pass. Without NumPy (e.g. on the office agent box), or for small
+batches, the plain-Python path is used; both produce identical documents
+(see bench_biometric_summary.py).
+"""
+import os
+from datetime import date, datetime, timedelta, timezone
+
+from essl_service import IST
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Below this many punches the per-call NumPy overhead outweighs the win.
+COLUMNAR_MIN_ROWS = 2000
+
+
+class Directions:
+    """'In' / 'Out' for a punch. Direction is pinned to the device SERIAL
+    (ESSL_IN_SERIALS / ESSL_OUT_SERIALS); otherwise inferred from the name."""
+
+    def __init__(self, in_serials=(), out_serials=()):
+        self.in_serials = set(in_serials)
+        self.out_serials = set(out_serials)
+
+    @classmethod
+    def from_env(cls):
+        def serials(key):
+            return {s.strip() for s in os.environ.get(key, "").split(",") if s.strip()}
+        return cls(serials("ESSL_IN_SERIALS"), serials("ESSL_OUT_SERIALS"))
+
+    def __call__(self, serial, name=""):
+        if serial in self.in_serials:
+            return "In"
+        if serial in self.out_serials:
+            return "Out"
+        n = (name or "").lower()
+        if "out" in n:
+            return "Out"
+        if "in" in n:
+            return "In"
+        return name or ""
+
+
+def fmt_hm(delta):
+    mins = int(delta.total_seconds() // 60)
+    return f"{mins // 60:02d}:{mins % 60:02d}"
+
+
+def is_late(dt_ist, shift_start):
+    return (dt_ist.hour, dt_ist.minute) > shift_start
+
+
+def late_by(dt_ist, shift_start):
+    """How long after the employee's shift start their first punch was (HH:MM:SS)."""
+    shift = dt_ist.replace(hour=shift_start[0], minute=shift_start[1], second=0, microsecond=0)
+    if dt_ist <= shift:
+        return "00:00:00"
+    secs = int((dt_ist - shift).total_seconds())
+    return f"{secs // 3600:02d}:{(secs % 3600) // 60:02d}:{secs % 60:02d}"
+
+
+def break_delta(items):
+    """Time spent OUT of office across the day (Out->In round trips).
+    items = sorted [{t, dir}]. Starts 'inside', so the first-in punch and the
+    final unmatched last-out are naturally excluded."""
+    state = "in"
+    outside_since = None
+    total = timedelta(0)
+    for it in items[1:]:  # leave out the 1st (arrival) punch
+        d = it.get("dir")
+        if d == "Out" and state == "in":
+            state = "out"
+            outside_since = it["t"]
+        elif d == "In" and state == "out":
+            total += it["t"] - outside_since
+            state = "in"
+            outside_since = None
+    return total
+
+
+def total_break_time(items):
+    return fmt_hm(break_delta(items))
+
+
+def working_hours(items):
+    """Actual worked time = (last punch - first punch) - break time."""
+    if len(items) < 2:
+        return ""
+    work = items[-1]["t"] - items[0]["t"] - break_delta(items)
+    if work.total_seconds() < 0:
+        work = timedelta(0)
+    return fmt_hm(work)
+
+
+def _utc(dt):
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt  # Mongo returns naive UTC
+
+
+def day_key(punch_time):
+    """IST calendar day of a punch as 'YYYY-MM-DD'."""
+    return _utc(punch_time).astimezone(IST).strftime("%Y-%m-%d")
+
+
+def punch_signature(count, first, last):
+    return f"{count}:{int(_utc(first).timestamp() * 1000)}:{int(_utc(last).timestamp() * 1000)}"
+
+
+def summarize_day(emp_code, day, items):
+    """Summary document for one employee-day; items = [{t, dir}]."""
+    items = sorted(items, key=lambda x: x["t"])
+    first, last = items[0], items[-1]
+    multi = len(items) > 1
+    middle = items[1:-1] if len(items) > 2 else []
+    return {
+        "emp_code": emp_code,
+        "day": day,
+        "first_in_at": first["t"],
+        "first_in": first["t"].astimezone(IST).strftime("%H:%M"),
+        "first_in_device": first["dir"],
+        "last_out": last["t"].astimezone(IST).strftime("%H:%M") if multi else "",
+        "last_out_device": last["dir"] if multi else "",
+        "breaks": [{"time": m["t"].astimezone(IST).strftime("%H:%M"), "device": m["dir"]} for m in middle],
+        "break_time": total_break_time(items),
+        "working_hours": working_hours(items),
+        "punch_count": len(items),
+        "signature": punch_signature(len(items), first["t"], last["t"]),
+        "updated_at": datetime.now(timezone.utc),
+    }
+
+
+def group_punches(rows, directions):
+    """{(emp_code, day): [{t, dir}]} from punch rows {user_id, punch_time, serial, device}."""
+    grouped = {}
+    for p in rows:
+        pt = p["punch_time"]
+        if not isinstance(pt, datetime):
+            pt = datetime.fromisoformat(pt)
+        pt = _utc(pt)
+        grouped.setdefault((str(p["user_id"]), day_key(pt)), []).append(
+            {"t": pt, "dir": directions(p.get("serial", ""), p.get("device", ""))})
+    return grouped
+
+
+def summarize_punches(rows, directions):
+    """{(emp_code, day): summary} for every employee-day in `rows`. Rows must
+    hold ALL punches of each day they touch."""
+    if np is not None and len(rows) >= COLUMNAR_MIN_ROWS:
+        return summarize_punches_columnar(rows, directions)
+    return summarize_punches_python(rows, directions)
+
+
+def summarize_punches_python(rows, directions):
+    return {key: summarize_day(key[0], key[1], items) for key, items in group_punches(rows, directions).items()}
+
+
+_IST_OFFSET_MS = int(IST.utcoffset(None).total_seconds() * 1000)
+_DAY_MS = 86_400_000
+_HHMM = [f"{m // 60:02d}:{m % 60:02d}" for m in range(1440)]
+_EPOCH_DATE = date(1970, 1, 1)
+_DIR_IN, _DIR_OUT, _DIR_OTHER = 0, 1, -1
+
+
+def _fmt_ms(ms):
+    mins = int(ms) // 60000
+    return f"{mins // 60:02d}:{mins % 60:02d}"
+
+
+def summarize_punches_columnar(rows, directions):
+    """Vectorized `summarize_punches_python` (same output)."""
+    n = len(rows)
+    if not n:
+        return {}
+    times, codes, labels = [], [], []
+    label_of = {}
+    for p in rows:
+        pt = p["punch_time"]
+        if not isinstance(pt, datetime):
+            pt = datetime.fromisoformat(pt)
+        times.append(_utc(pt))
+        codes.append(str(p["user_id"]))
+        key = (p.get("serial", ""), p.get("device", ""))
+        if key not in label_of:
+            label_of[key] = directions(*key)
+        labels.append(label_of[key])
+
+    ms = np.fromiter((int(t.timestamp() * 1000) for t in times), dtype=np.int64, count=n)
+    code_names, code_idx = np.unique(np.array(codes), return_inverse=True)
+    label_names, label_idx = np.unique(np.array(labels), return_inverse=True)
+    label_dir = np.array([_DIR_IN if lbl == "In" else _DIR_OUT if lbl == "Out" else _DIR_OTHER
+                          for lbl in label_names], dtype=np.int8)
+    local_ms = ms + _IST_OFFSET_MS
+    day_idx = local_ms // _DAY_MS
+
+    # One stable sort by (employee, day, time); ties keep input order like sorted() does.
+    order = np.lexsort((ms, day_idx, code_idx))
+    ms, code_idx, day_idx, label_idx = ms[order], code_idx[order], day_idx[order], label_idx[order]
+    minute_of_day = (local_ms[order] % _DAY_MS) // 60000
+    dirs = label_dir[label_idx]
+
+    # Employee-day groups: starts of runs of equal (code, day); map rows to groups.
+    boundary = np.empty(n, dtype=bool)
+    boundary[0] = True
+    boundary[1:] = (code_idx[1:] != code_idx[:-1]) | (day_idx[1:] != day_idx[:-1])
+    starts = np.flatnonzero(boundary)
+    ends = np.append(starts[1:], n)            # exclusive
+    group = np.searchsorted(starts, np.arange(n), side="right") - 1
+    counts = ends - starts
+
+    # Breaks: after the arrival punch, walk In/Out punches starting "inside".
+    # Only direction changes matter; they alternate Out, In, Out, ... so every
+    # In change closes the Out change just before it.
+    considered = np.flatnonzero((np.arange(n) != starts[group]) & (dirs != _DIR_OTHER))
+    cg, cd = group[considered], dirs[considered]
+    prev = np.empty_like(cd)
+    if len(cd):
+        prev[0] = _DIR_IN
+        prev[1:] = cd[:-1]
+        prev[np.flatnonzero(np.append(True, cg[1:] != cg[:-1]))] = _DIR_IN
+    changes = considered[cd != prev]
+    closes = np.flatnonzero(dirs[changes] == _DIR_IN)
+    break_ms = np.bincount(group[changes[closes]],
+                           weights=(ms[changes[closes]] - ms[changes[closes - 1]]).astype(np.float64),
+                           minlength=len(starts)).astype(np.int64)
+    work_ms = np.maximum(ms[ends - 1] - ms[starts] - break_ms, 0)
+
+    sorted_times = [times[i] for i in order]
+    now = datetime.now(timezone.utc)
+    summaries = {}
+    for g, (s, e) in enumerate(zip(starts.tolist(), ends.tolist())):
+        code = str(code_names[code_idx[s]])
+        day = (_EPOCH_DATE + timedelta(days=int(day_idx[s]))).isoformat()
+        multi = e - s > 1
+        first_t, last_t = sorted_times[s], sorted_times[e - 1]
+        summaries[(code, day)] = {
+            "emp_code": code,
+            "day": day,
+            "first_in_at": first_t,
+            "first_in": _HHMM[minute_of_day[s]],
+            "first_in_device": str(label_names[label_idx[s]]),
+            "last_out": _HHMM[minute_of_day[e - 1]] if multi else "",
+            "last_out_device": str(label_names[label_idx[e - 1]]) if multi else "",
+            "breaks": [{"time": _HHMM[minute_of_day[i]], "device": str(label_names[label_idx[i]])}
+                       for i in range(s + 1, e - 1)] if e - s > 2 else [],
+            "break_time": _fmt_ms(break_ms[g]),
+            "working_hours": _fmt_ms(work_ms[g]) if multi else "",
+            "punch_count": int(counts[g]),
+            "signature": punch_signature(int(counts[g]), first_t, last_t),
+            "updated_at": now,
+        }
+    return summaries
+
+
+def day_record(summary, shift_start):
+    """The API's per-day record from a stored summary, with lateness for `shift_start`."""
+    first_in_ist = _utc(summary["first_in_at"]).astimezone(IST)
+    day = datetime.strptime(summary["day"], "%Y-%m-%d").date()
+    return {
+        "date": summary["day"],
+        "weekday": day.strftime("%a"),
+        "status": "Present",
+        "first_in": summary["first_in"],
+        "first_in_device": summary["first_in_device"],
+        "late": is_late(first_in_ist, shift_start),
+        "late_by": late_by(first_in_ist, shift_start),
+        "last_out": summary["last_out"],
+        "last_out_device": summary["last_out_device"],
+        "breaks": summary["breaks"],
+        "break_time": summary["break_time"],
+        "working_hours": summary["working_hours"],
+        "punch_count": summary["punch_count"],
+    }
+
+
+def day_bounds_utc(day):
+    """[start, end] of an IST day 'YYYY-MM-DD' as timezone-aware datetimes."""
+    d = datetime.strptime(day, "%Y-%m-%d")
+    start = datetime(d.year, d.month, d.day, tzinfo=IST)
+    return start, start + timedelta(days=1) - timedelta(microseconds=1)
@@ -7,7 +7,7 @@ import urllib.parse
 from datetime import datetime, timezone, timedelta, date
 from typing import List, Dict, Union, Optional
 
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Depends, Query, Request, File, UploadFile, Body
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Depends, Query, Request, Response, File, UploadFile, Body
 from bson import ObjectId
 
 from database import chat_db, stc_db, get_all_employees_emails, get_employees_by_department, sanitize_team, get_grid_fs, grid_fs
@@ -16,28 +16,63 @@ from models import (
     get_user_info, get_user_info_with_collection, get_current_admin_user, serialize_document, ist_tz,
     TEAMS, DEPARTMENT_TEAMS, get_department_from_team
 ) 
+from directory import employee_directory
+from membership import channel_membership, channel_ids_for
 from notifications import send_push_notification
+from unread import UnreadCounters
+from connections import OutboundConnection, outbound_stats
+from history import fetch_page, set_page_headers
+from hidden import visibility_filter, dm_conversation_id, clear_conversation, hide_message
+from delivery import INBOX, advance_watermarks, stream_missed_messages
+from presence import HEARTBEAT_INTERVAL, PresenceService
+from backplane import WORKER_ID, create_backplane
+from file_store import store_upload
+from renditions import schedule_renditions
+from read_state import (
+    ReadBatcher, advance_read_watermark, count_unread_in_channel, load_read_watermarks,
+    now_utc, unread_channel_match,
+)
 
 router = APIRouter()
 ist_tz = timezone(timedelta(hours=5, minutes=30))
 
 class ConnectionManager:
     def __init__(self):
-        # Change active_connections to map user_id to a set of WebSocket connections
-        self.active_connections: Dict[str, set[WebSocket]] = {}
-        self.user_status: Dict[str, str] = {}
+        # Map user_id to a set of connections, each with its own bounded send queue
+        self.active_connections: Dict[str, set[OutboundConnection]] = {}
+        self._outbound: Dict[WebSocket, OutboundConnection] = {}
+        # Statuses are published as coalesced presence_diff frames
+        self.presence = PresenceService(self.broadcast_frame, epoch=WORKER_ID)
+        # Users with a connection that lost frames since their last sync; their
+        # delivery watermarks are left behind so the next connect resends.
+        self._lossy_users: set[str] = set()
+        # Deliveries go through the backplane so users on other workers get them too
+        self.backplane = create_backplane()
+        self.backplane.bind(self.handle_event)
+        self._heartbeat_task: Optional[asyncio.Task] = None
 
     async def connect(self, websocket: WebSocket, user_id: str):
         await websocket.accept()
+        # Sockets already open (here or on another worker) got everything live.
+        already_live = self.is_online(user_id)
+        connection = OutboundConnection(websocket, user_id)
+        connection.start()
+        self._outbound[websocket] = connection
         if user_id not in self.active_connections:
             self.active_connections[user_id] = set()
-        self.active_connections[user_id].add(websocket)
-        self.user_status[user_id] = "online"
+            self._lossy_users.discard(user_id)  # the sync below starts from the watermarks
+        self.active_connections[user_id].add(connection)
         logging.info(f"User {user_id} connected. Total connections for user: {len(self.active_connections[user_id])}")
         await self.broadcast_status(user_id, "online")
         
-        # Send missed messages and notifications BEFORE updating the last_online timestamp.
-        await self.send_missed_messages(user_id, stc_db, chat_db)
+        # Send missed messages and notifications BEFORE updating the last_online timestamp,
+        # and only to this socket: a user with another live socket has missed nothing.
+        if not already_live:
+            await self.send_missed_messages(user_id, connection, stc_db, chat_db)
+        try:
+            await unread_counters.load(user_id)
+        except Exception as e:
+            logging.error(f"Failed to load unread counters for {user_id}: {e}")
 
         try:
             now = datetime.now(ist_tz)
@@ -54,171 +89,231 @@ class ConnectionManager:
             logging.error(f"Failed to update last_online for user {user_id}: {e}")
 
     async def disconnect(self, websocket: WebSocket, user_id: str):
+        connection = self._outbound.pop(websocket, None)
+        if connection is not None:
+            if connection.lossy:
+                self._lossy_users.add(user_id)
+            connection.stop()
         if user_id in self.active_connections:
-            self.active_connections[user_id].discard(websocket)
+            self.active_connections[user_id].discard(connection)
             if not self.active_connections[user_id]:
                 del self.active_connections[user_id]
-                self.user_status[user_id] = "offline"
+                unread_counters.evict(user_id)
+                await self.advance_delivery(user_id)
                 logging.info(f"User {user_id} disconnected. No more active connections.")
                 # Broadcast offline status only when the last connection is gone
                 await self.broadcast_status(user_id, "offline")
             else:
                 logging.info(f"User {user_id} disconnected one connection. Remaining connections: {len(self.active_connections.get(user_id, []))}")
 
-    async def send_personal_message(self, message_json: str, user_id: str):
+    async def send_personal_message(self, message_json: str, user_id: str, unread: Optional[str] = None):
         """
-        Send a personal message to a user if connected.
-        If the user is offline, trigger a push notification.
+        Send a personal message to a user on whichever worker holds their connections.
+        Pass `unread` (the conversation id) to also bump the recipient's unread count.
+        Always published: this worker's presence view may not know about sockets
+        on other workers, and only the worker holding them can tell. A user with
+        no socket anywhere gets it from the DB on reconnect.
         """
-        message_data = json.loads(message_json)
-
-        if user_id in self.active_connections:
-            logging.info(f"User {user_id} is ONLINE. Sending message via WebSocket.")
-            for connection in self.active_connections[user_id]:
-                await connection.send_text(message_json)
+        await self.backplane.publish({"op": "user", "users": [user_id], "frame": message_json, "unread": unread})
+
+    def is_online(self, user_id: str) -> bool:
+        """Connected on any worker."""
+        return user_id in self.active_connections or self.presence.get(user_id) != "offline"
+
+    def _deliver_local(self, message: str, user_id: str):
+        for connection in self.active_connections.get(user_id, ()):
+            connection.send(message)
+
+    async def push_local(self, message: str, user_id: str):
+        """Send to this worker's sockets for the user only (per-worker state such as unread counts)."""
+        self._deliver_local(message, user_id)
+
+    async def handle_event(self, event: dict):
+        """Deliver a backplane event to the sockets held by this worker."""
+        op = event.get("op")
+        if op == "user":
+            for user_id in event["users"]:
+                if user_id in self.active_connections:
+                    self._deliver_local(event["frame"], user_id)
+                    if event.get("unread"):
+                        unread_counters.bump([user_id], event["unread"])
+        elif op == "channel":
+            sender_id = event.get("sender")
+            for user_id in self.online_channel_members(event["channel"]):
+                if sender_id and user_id == sender_id:
+                    continue  # Don't send the message back to the sender
+                self._deliver_local(event["frame"], user_id)
+                if event.get("unread"):
+                    unread_counters.bump([user_id], event["channel"])
+        elif op == "all":
+            sender_id = event.get("sender")
+            for user_id in list(self.active_connections):
+                if not (sender_id and user_id == sender_id):
+                    self._deliver_local(event["frame"], user_id)
+        elif op == "presence":
+            self.presence.set(event["user"], event["status"], source=event["worker"])
+        elif op == "presence_override":
+            self.presence.set_override(event["user"], event.get("status"))
+        elif op == "presence_sync":
+            self.presence.sync_source(event["worker"], event["users"], event.get("overrides"))
+        elif op == "unread_lower":
+            if event["user"] in self.active_connections:
+                unread_counters.lower(event["user"], event["conversation"], event.get("n"))
+        elif op == "unread_set":
+            if event["user"] in self.active_connections:
+                unread_counters.set(event["user"], event["conversation"], event["count"])
+        elif op == "unread_rebuild":
+            if event["user"] in self.active_connections:
+                await unread_counters.rebuild([event["user"]])
         else:
-            logging.info(f"User {user_id} is OFFLINE. Triggering push notification.")
-            # The message is already stored in the DB by the websocket handler.
-            # It will be delivered when the user reconnects via `send_missed_messages`.
-            logging.info(f"User {user_id} is offline. Message will be delivered upon reconnection.")
-
-    async def send_missed_messages(self, user_id: str, stc_db, chat_db):
-        """Fetch undelivered messages (based on delivered_to) and send them once when the user connects."""
-        # This function is now more robust and handles both direct and channel messages.
-        try:
-            # 1. Find all direct messages sent to the user that are not yet in their `delivered_to` list.
-            undelivered_direct_cursor = chat_db.Direct_chat.find({
-                "recipient_id": user_id,
-                "delivered_to": {"$ne": user_id}
-            })
-
-            # 2. Find all channel messages for the user's channels that are not yet in their `delivered_to` list.
-            user_channels = await self.get_user_channels(user_id, stc_db)
-            undelivered_channel_cursor = chat_db.Channel_chat.find({
-                "channel_id": {"$in": user_channels},
-                "delivered_to": {"$ne": user_id}
-            })
-
-            undelivered_messages = await undelivered_direct_cursor.to_list(length=None) + await undelivered_channel_cursor.to_list(length=None)
+            logging.warning(f"Unknown backplane event: {op}")
 
-            if not undelivered_messages:
-                logging.info(f"No missed messages for user {user_id}")
-                return
+    async def lower_unread(self, user_id: str, conversation: str, n: Optional[int] = None):
+        await self.backplane.publish({"op": "unread_lower", "user": user_id, "conversation": conversation, "n": n})
 
-            # Sort all messages by timestamp
-            undelivered_messages.sort(key=lambda m: m.get("timestamp", datetime.min.replace(tzinfo=ist_tz)))
+    async def set_unread(self, user_id: str, conversation: str, count: int):
+        await self.backplane.publish({"op": "unread_set", "user": user_id, "conversation": conversation, "count": count})
 
-            # Prepare and send the bulk message payload
-            payload = json.dumps({
-                "type": "missed_messages",
-                "messages": serialize_document(undelivered_messages)
-            }, default=str)
+    async def rebuild_unread(self, user_id: str):
+        await self.backplane.publish({"op": "unread_rebuild", "user": user_id})
 
-            for connection in self.active_connections.get(user_id, []):
-                await connection.send_text(payload)
+    async def send_missed_messages(self, user_id: str, connection: OutboundConnection, stc_db, chat_db):
+        """Stream messages newer than the user's delivery watermarks, in chunks, to
+        the socket that just connected."""
+        try:
+            user_channels = await self.get_user_channels(user_id, stc_db)
 
-            # Mark these messages as delivered for the user
-            message_ids = [msg["id"] for msg in undelivered_messages]
-            if message_ids:
-                await chat_db.Direct_chat.update_many({"id": {"$in": message_ids}}, {"$addToSet": {"delivered_to": user_id}})
-                await chat_db.Channel_chat.update_many({"id": {"$in": message_ids}}, {"$addToSet": {"delivered_to": user_id}})
+            async def send(payload: str) -> bool:
+                # Confirmed once the writer has put it on the socket.
+                if await connection.send_and_wait(payload):
+                    return True
+                self._lossy_users.add(user_id)   # keep the disconnect from advancing past it
+                return False
 
-            logging.info(f"Sent {len(undelivered_messages)} missed messages to user {user_id}.")
+            sent = await stream_missed_messages(chat_db, user_id, user_channels, send, serialize_document)
+            if sent:
+                logging.info(f"Sent {sent} missed messages to user {user_id}.")
+            else:
+                logging.info(f"No missed messages for user {user_id}")
 
         except Exception as e:
             logging.error(f"Failed to send missed messages to user {user_id}: {e}", exc_info=True)
 
+    async def advance_delivery(self, user_id: str):
+        """Everything up to now reached the user live; move their watermarks."""
+        if user_id in self._lossy_users:
+            self._lossy_users.discard(user_id)
+            logging.info(f"Not advancing delivery watermarks for {user_id}: frames were dropped")
+            return
+        try:
+            channels = await self.get_user_channels(user_id, stc_db)
+            await advance_watermarks(chat_db, user_id, [INBOX, *channels], datetime.now(timezone.utc))
+        except Exception as e:
+            logging.error(f"Failed to advance delivery watermarks for {user_id}: {e}")
+
     async def get_user_channels(self, user_id: str, stc_db) -> List[str]:
         """Get list of channel IDs the user is a member of"""
-        channels = ["general"]
         try:
-            user = await get_user_info(stc_db, user_id)
-            if user and user.get("team"):
-                dept = get_department_from_team(user["team"])
-                if dept:
-                    dept_slug = dept.lower().replace(' ', '-').replace('/', '-')
-                    channels.append(f"dept-{dept_slug}")
-                # Add team channel, ensuring slashes are preserved if they are part of the name
-                team_slug = user["team"].lower().replace(' ', '-')
-                channels.append(f"team-{team_slug}")
+            user = await employee_directory.resolve(user_id, fields=("email", "id"))
+            return channel_ids_for(user)
         except Exception as e:
             logging.error(f"Failed to get channels for user {user_id}: {e}")
-        return channels
+        return ["general"]
 
     async def broadcast(self, message: str, sender_id: str = None):
         logging.info(f"Broadcasting message from {sender_id}: {message}")
-        for user_id, connections in self.active_connections.items():
-            if sender_id and user_id == sender_id:
-                continue
+        await self.backplane.publish({"op": "all", "frame": message, "sender": sender_id})
+
+    @property
+    def user_status(self) -> Dict[str, str]:
+        return self.presence.statuses
+
+    def broadcast_frame(self, message: str):
+        """Queue a pre-serialized frame on every open socket."""
+        for connections in self.active_connections.values():
             for connection in connections:
-                try:
-                    await connection.send_text(message)
-                except Exception as e:
-                    logging.warning(f"Failed to send message to {user_id} (connection may be closed): {e}")
+                connection.send(message)
 
     async def broadcast_status(self, user_id: str, status: str):
-        self.user_status[user_id] = status
-        message = json.dumps({"type": "status_update", "user_id": user_id, "status": status})
-        logging.info(f"Broadcasting status update: {message}")
-        for connection_user_id, connections in self.active_connections.items():
-            for connection in connections:
-                try:
-                    await connection.send_text(message)
-                except Exception as e:
-                    logging.warning(f"Failed to broadcast status to {connection_user_id} (connection may be closed): {e}")
+        """Connection lifecycle: this worker now has ("online") or no longer has
+        ("offline") sockets for the user."""
+        if user_id in self.active_connections:
+            status = "online"
+        logging.info(f"Status change queued: {user_id} -> {status}")
+        await self.backplane.publish({"op": "presence", "user": user_id, "status": status, "worker": WORKER_ID})
+
+    async def set_user_status(self, user_id: str, status: str):
+        """The user's own choice. "busy" sticks to the user (whichever worker
+        handles the request) until they pick another status or disconnect."""
+        override = "busy" if status == "busy" else None
+        logging.info(f"Status override queued: {user_id} -> {override or 'cleared'}")
+        await self.backplane.publish({"op": "presence_override", "user": user_id, "status": override})
+
+    async def _publish_presence_sync(self, user_ids: List[str]):
+        await self.backplane.publish({"op": "presence_sync", "worker": WORKER_ID, "users": user_ids,
+                                      "overrides": self.presence.overrides_for(user_ids)})
+
+    async def _heartbeat(self):
+        while True:
+            try:
+                await self._publish_presence_sync(list(self.active_connections))
+                self.presence.expire()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Presence heartbeat failed: {e}")
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    def start_heartbeat(self):
+        """Announce this worker's connected users periodically (see presence.py)."""
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop_heartbeat(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        try:
+            await self._publish_presence_sync([])   # let the other workers drop us now
+        except Exception as e:
+            logging.error(f"Failed to withdraw presence on shutdown: {e}")
 
     async def get_channel_members(self, channel_id: str, stc_db) -> List[str]:
         """Get list of user emails (user_ids) who are members of the channel"""
-        if channel_id == 'general':
-            # All employees
-            members = await get_all_employees_emails(stc_db)
-            return members
-        elif channel_id.startswith('dept-'):
-            # Department channel, e.g., 'dept-data'
-            dept_name_raw = channel_id.replace('dept-', '').replace('-', ' ')
-            # Find the original department name from DEPARTMENT_TEAMS keys
-            # This is more reliable than trying to reconstruct it.
-            dept_name_found = None
-            for dept in DEPARTMENT_TEAMS.keys():
-                if dept.lower().replace(' ', '-') == dept_name_raw:
-                    dept_name_found = dept
-                    break
-            
-            members = await get_employees_by_department(stc_db, dept_name_found) if dept_name_found else []
-            return members
-        elif channel_id.startswith('team-'):
-            # Team channel, e.g., 'team-research'
-            team_slug = channel_id.replace('team-', '')
-            team_name = None
-            for team in TEAMS:
-                if team.lower().replace(' ', '-').replace('/', '-') == team_slug:
-                    team_name = team
-                    break
-            if team_name:
-                collection = stc_db[sanitize_team(team_name)]
-                users = await collection.find({}, {"email": 1, "_id": 0}).to_list(None)
-                members = [u['email'] for u in users]
-                return members
-            else:
-                logging.warning(f"Unknown team slug: {team_slug}")
-                return []
-        else:
-            # For sub-department or unknown, return empty (can extend if needed)
-            logging.warning(f"Unknown channel_id: {channel_id}")
-            return []
-
-    async def broadcast_to_channel(self, message: str, channel_id: str, stc_db, sender_id: str = None):
-        """Broadcast message to all members of the channel who are connected"""
-        channel_members = await self.get_channel_members(channel_id, stc_db)
-        for user_id in channel_members:
-            if sender_id and user_id == sender_id:
-                continue  # Don't send the message back to the sender
-            if user_id in self.active_connections:
-                for connection in self.active_connections[user_id]:
-                    try:
-                        await connection.send_text(message)
-                    except Exception as e:
-                        logging.warning(f"Failed to send message to {user_id} on connection {connection} (may be closed): {e}")
+        members = channel_membership.members(channel_id)
+        if not members and channel_id != 'general':
+            logging.warning(f"Unknown or empty channel_id: {channel_id}")
+        return list(members)
+
+    def online_channel_members(self, channel_id: str) -> List[str]:
+        """Members of the channel that currently have an open connection."""
+        members = channel_membership.members(channel_id)
+        if len(self.active_connections) < len(members):
+            return [user_id for user_id in self.active_connections if user_id in members]
+        return [user_id for user_id in members if user_id in self.active_connections]
+
+    async def broadcast_to_channel(self, message: str, channel_id: str, stc_db, sender_id: str = None, unread: bool = False):
+        """Broadcast message to all members of the channel who are connected (on any worker).
+        With `unread`, also bump each recipient's unread count for the channel."""
+        await self.backplane.publish({"op": "channel", "channel": channel_id, "frame": message,
+                                      "sender": sender_id, "unread": unread})
+
+    def send_to_socket(self, message: str, websocket: WebSocket):
+        """Queue a frame for one specific socket (e.g. a confirmation to the sender's tab)."""
+        connection = self._outbound.get(websocket)
+        if connection is not None:
+            connection.send(message)
+
+    def outbound_stats(self) -> dict:
+        connections = list(self._outbound.values())
+        depths = [c.depth for c in connections]
+        return {
+            **outbound_stats.as_dict(),
+            "connections": len(connections),
+            "users": len(self.active_connections),
+            "queued_frames": sum(depths),
+            "deepest_queue": max(depths, default=0),
+        }
 
 manager = ConnectionManager()
 
@@ -227,28 +322,40 @@ class StatusCheckCreate(Message):
     status: str
 
 @router.get("/users/status", response_model=List[Dict])
-async def get_all_user_statuses():
+async def get_all_user_statuses(response: Response):
+    """Published status of every employee. The presence version is returned in
+    X-Presence-Version for use with /users/presence?since=."""
     try:
-        all_employee_emails = await get_all_employees_emails(stc_db)
-        statuses = []
-        for user_id in all_employee_emails:
-            # Default to offline
-            current_status = "offline"
-
-            # Check real-time status from the ConnectionManager
-            if user_id in manager.user_status:
-                current_status = manager.user_status[user_id]
-
-            # An active connection overrides status to 'online' unless 'busy'
-            if user_id in manager.active_connections and current_status != "busy":
-                current_status = "online"
-            
-            statuses.append({"user_id": user_id, "status": current_status})
+        await employee_directory.ensure_fresh()
+        emails = (entry["email"] for entry in employee_directory.entries())
+        version, statuses = manager.presence.snapshot(emails, cache_key=employee_directory.version)
+        response.headers["X-Presence-Version"] = version
+        response.headers["Access-Control-Expose-Headers"] = "X-Presence-Version"
         return statuses
     except Exception as e:
         logging.error(f"Error fetching all user statuses: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch user statuses")
 
+@router.get("/users/presence")
+async def get_presence_changes(since: str = Query("")):
+    """
+    Status changes published after presence version `since` ("<epoch>:<n>").
+    If `since` is from another worker or process, or the diff log no longer
+    reaches that far back, returns the full snapshot instead.
+    """
+    changes = manager.presence.changes_since(since)
+    if changes is None:
+        emails = (entry["email"] for entry in employee_directory.entries())
+        version, statuses = manager.presence.snapshot(emails, cache_key=employee_directory.version)
+        return {"version": version, "snapshot": True,
+                "statuses": {item["user_id"]: item["status"] for item in statuses}}
+    return {"version": manager.presence.version_tag, "snapshot": False, "changes": changes}
+
+@router.get("/chat/connections/stats")
+async def get_connection_stats(admin_user: dict = Depends(get_current_admin_user)):
+    """(Admin Only) Websocket send-queue depth and slow-consumer counters."""
+    return manager.outbound_stats()
+
 @router.post("/users/{user_id}/status", response_model=Dict)
 async def set_user_status_api(user_id: str, status_update: StatusCheckCreate):
     if status_update.client_name != user_id:
@@ -258,68 +365,132 @@ async def set_user_status_api(user_id: str, status_update: StatusCheckCreate):
     if new_status not in ["online", "offline", "busy"]:
         raise HTTPException(status_code=400, detail="Invalid status. Must be 'online', 'offline', or 'busy'.")
 
-    manager.user_status[user_id] = new_status
-    await manager.broadcast_status(user_id, new_status)
+    await manager.set_user_status(user_id, new_status)
     return {"user_id": user_id, "status": new_status}
+
+async def compute_unread_counts(user_id: str) -> Dict[str, int]:
+    """
+    Calculates the number of unread messages for a user from the database,
+    grouped by sender (for direct messages) and channel (for channel messages).
+    This is the rebuild path for the in-memory unread counters.
+    """
+    # 1. Unread Direct Messages
+    dm_pipeline = [
+        # Match messages sent to the user that they haven't read
+        {"$match": {
+            "recipient_id": user_id,
+            "read_by": {"$nin": [user_id]}
+        }},
+        # Group by sender and count
+        {"$group": {
+            "_id": "$sender_id",
+            "unreadCount": {"$sum": 1}
+        }}
+    ]
+    unread_dms = await chat_db.Direct_chat.aggregate(dm_pipeline).to_list(length=None)
+
+    # 2. Unread Channel Messages
+    user_channels = await manager.get_user_channels(user_id, stc_db)
+    read_watermarks = await load_read_watermarks(chat_db, user_id, user_channels)
+    channel_pipeline = [
+        # Match messages in user's channels, not sent by them, newer than their read watermark
+        {"$match": unread_channel_match(user_id, user_channels, read_watermarks)},
+        # Group by channel and count
+        {"$group": {
+            "_id": "$channel_id",
+            "unreadCount": {"$sum": 1}
+        }}
+    ]
+    unread_channels = await chat_db.Channel_chat.aggregate(channel_pipeline).to_list(length=None)
+
+    # 3. Combine results into a single dictionary
+    counts = {}
+    for item in unread_dms:
+        counts[item['_id']] = item['unreadCount']
+    for item in unread_channels:
+        counts[item['_id']] = item['unreadCount']
+
+    return counts
+
+unread_counters = UnreadCounters(
+    compute=compute_unread_counts,
+    push=manager.push_local,
+    is_online=lambda user_id: user_id in manager.active_connections,
+)
+
+async def apply_read_batch(user_id: str, kind: str, conversation_id: str, message_ids: List[str], whole_conversation: bool):
+    """Persist one merged batch of mark_messages_read events."""
+    if kind == "channel":
+        # Channel read state is a single watermark, however long the history is.
+        until = None
+        if message_ids and not whole_conversation:
+            newest = await chat_db.Channel_chat.find(
+                {"id": {"$in": message_ids}, "channel_id": conversation_id}, {"timestamp": 1, "_id": 0}
+            ).sort("timestamp", -1).limit(1).to_list(length=1)
+            if newest and newest[0].get("timestamp"):
+                until = newest[0]["timestamp"]
+        if until is None:
+            if not whole_conversation:
+                return
+            until = now_utc()
+        await advance_read_watermark(chat_db, user_id, conversation_id, until)
+        remaining = await count_unread_in_channel(chat_db, user_id, conversation_id)
+        await manager.set_unread(user_id, conversation_id, remaining)
+        logging.info(f"Channel {conversation_id} read up to {until} by {user_id}; {remaining} unread left.")
+        return
+
+    update_operation = {"$addToSet": {"read_by": user_id}}
+    if kind == "dm":
+        direct_result = await chat_db.Direct_chat.update_many({"id": {"$in": message_ids}}, update_operation)
+        logging.info(f"Marked as read: {direct_result.modified_count} DMs for user {user_id}.")
+        if direct_result.modified_count:
+            await manager.lower_unread(user_id, conversation_id, direct_result.modified_count)
+
+        # Also, send a read receipt to the chat partner in a DM so they can see the double-tick
+        read_receipt = {
+            "type": "read_receipt",
+            "message_ids": message_ids,
+            "read_by": user_id
+        }
+        await manager.send_personal_message(json.dumps(read_receipt), conversation_id) # This will only send if user is online
+        logging.info(f"Sent read receipt for {len(message_ids)} messages to {conversation_id} from {user_id}")
+        return
+
+    # Ids without a conversation: they may be in either collection.
+    await chat_db.Direct_chat.update_many({"id": {"$in": message_ids}}, update_operation)
+    await chat_db.Channel_chat.update_many({"id": {"$in": message_ids}}, update_operation)
+    await manager.rebuild_unread(user_id)
+
+read_batcher = ReadBatcher(apply_read_batch)
+
 @router.get("/messages")
 
 @router.get("/messages/unread-count")
 async def get_unread_message_counts(user_id: str = Query(...)):
     """
-    Calculates the number of unread messages for a user, grouped by
+    Returns the number of unread messages for a user, grouped by
     sender (for direct messages) and channel (for channel messages).
     """
     if not user_id:
         raise HTTPException(status_code=400, detail="user_id is required")
 
     try:
-        # 1. Unread Direct Messages
-        dm_pipeline = [
-            # Match messages sent to the user that they haven't read
-            {"$match": {
-                "recipient_id": user_id,
-                "read_by": {"$nin": [user_id]}
-            }},
-            # Group by sender and count
-            {"$group": {
-                "_id": "$sender_id",
-                "unreadCount": {"$sum": 1}
-            }}
-        ]
-        unread_dms = await chat_db.Direct_chat.aggregate(dm_pipeline).to_list(length=None)
-
-        # 2. Unread Channel Messages
-        user_channels = await manager.get_user_channels(user_id, stc_db)
-        channel_pipeline = [
-            # Match messages in user's channels, not sent by them, and not read by them
-            {"$match": {
-                "channel_id": {"$in": user_channels},
-                "sender_id": {"$ne": user_id},
-                "read_by": {"$nin": [user_id]}
-            }},
-            # Group by channel and count
-            {"$group": {
-                "_id": "$channel_id",
-                "unreadCount": {"$sum": 1}
-            }}
-        ]
-        unread_channels = await chat_db.Channel_chat.aggregate(channel_pipeline).to_list(length=None)
-
-        # 3. Combine results into a single dictionary
-        counts = {}
-        for item in unread_dms:
-            counts[item['_id']] = item['unreadCount']
-        for item in unread_channels:
-            counts[item['_id']] = item['unreadCount']
-
-        return counts
+        return await unread_counters.counts(user_id)
     except Exception as e:
         logging.error(f"Error calculating unread counts for {user_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to calculate unread counts.")
 
-async def get_messages(channel_id: str = None, recipient_id: str = None, sender_id: str = None, user_id: str = None, limit: int = 50):
+@router.post("/messages/unread-count/rebuild")
+async def rebuild_unread_counts(user_id: Optional[str] = None, admin_user: dict = Depends(get_current_admin_user)):
+    """(Admin Only) Recompute in-memory unread counters from the database."""
+    rebuilt = await unread_counters.rebuild([user_id] if user_id else None)
+    return {"message": f"Rebuilt unread counters for {rebuilt} users"}
+
+async def get_messages(response: Response = None, channel_id: str = None, recipient_id: str = None, sender_id: str = None,
+                       user_id: str = None, limit: int = 50, before: Optional[str] = None, after: Optional[str] = None):
     query = {}
     collection = None
+    conversation_id = None
     if channel_id:
         if user_id:
             # Check if user is member of the channel
@@ -327,6 +498,7 @@ async def get_messages(channel_id: str = None, recipient_id: str = None, sender_
             if channel_id not in channels:
                 raise HTTPException(status_code=403, detail="Unauthorized to view this channel")
         query["channel_id"] = channel_id
+        conversation_id = channel_id
         collection = chat_db.Channel_chat
     elif recipient_id:
         if recipient_id == 'general' or recipient_id.startswith('dept-') or recipient_id.startswith('team-'):
@@ -337,6 +509,7 @@ async def get_messages(channel_id: str = None, recipient_id: str = None, sender_
                 if recipient_id not in channels:
                     raise HTTPException(status_code=403, detail="Unauthorized to view this channel")
             query["channel_id"] = recipient_id
+            conversation_id = recipient_id
             collection = chat_db.Channel_chat
         elif sender_id:
             # Direct messages: conversation between sender and recipient
@@ -348,6 +521,7 @@ async def get_messages(channel_id: str = None, recipient_id: str = None, sender_
                     {"sender_id": recipient_id, "recipient_id": {"$in": [sender_id]}}
                 ]
             }
+            conversation_id = dm_conversation_id(sender_id, recipient_id)
             collection = chat_db.Direct_chat
         else:
             # Messages to the recipient (could be direct or group)
@@ -359,50 +533,34 @@ async def get_messages(channel_id: str = None, recipient_id: str = None, sender_
     if collection is None:
         collection = chat_db.Channel_chat  # Default to channel chat
 
-    if user_id:
-        # Use aggregation to exclude deleted messages for the user
-        pipeline = [
-            {"$match": query},
-            {"$lookup": {
-                "from": "DeletedMessages",
-                "let": {"message_id": "$id"},
-                "pipeline": [
-                    {"$match": {
-                        "$and": [
-                            {"message_id": "$$message_id"},
-                            {"user_id": user_id}
-                        ]
-                    }}
-                ],
-                "as": "deleted"
-            }},
-            {"$match": {"deleted": {"$size": 0}}},
-            {"$sort": {"timestamp": -1}},
-            {"$limit": limit},
-            {"$sort": {"timestamp": 1}}
-        ]
-        messages = await collection.aggregate(pipeline).to_list(length=None)
-    else:
-        messages = await collection.find(query, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(length=limit)
-        messages.reverse()
+    visible = await visibility_filter(chat_db, user_id, conversation_id)
+    if visible:
+        query = {"$and": [query, visible]}
+    messages, has_more = await fetch_page(collection, query, limit, before, after)
+    if response is not None:
+        set_page_headers(response, messages, has_more, newer_page=bool(after))
+    return serialize_document(localize_timestamps(messages))
 
-    # Ensure all messages have a timestamp and convert to IST
+def localize_timestamps(messages: List[dict]) -> List[dict]:
+    """Ensure all messages have a timestamp and convert it to an IST ISO string."""
     for msg in messages:
         if not msg.get('timestamp'):
             msg['timestamp'] = datetime.now(ist_tz).isoformat()
         else:
-            # Convert existing timestamp to IST
-            ts=msg['timestamp']
+            ts = msg['timestamp']
             if ts.tzinfo is None:
-              ts = ts.replace(tzinfo=timezone.utc)
+                ts = ts.replace(tzinfo=timezone.utc)
             msg['timestamp'] = ts.astimezone(ist_tz).isoformat()
-    # Convert ObjectId to string for JSON serialization
-    messages = serialize_document(messages)
     return messages
 
 @router.get("/channel-messages")
-async def get_channel_messages(channel_id: str, user_id: str = None, limit: int = 50):
-    """Get messages for a specific channel"""
+async def get_channel_messages(response: Response, channel_id: str, user_id: str = None, limit: int = 50,
+                               before: Optional[str] = None, after: Optional[str] = None):
+    """
+    Get one page of messages for a specific channel, oldest first.
+    Pass the X-Next-Before / X-Next-After response headers back as `before` /
+    `after` to page through history.
+    """
     if user_id:
         # Check if user is member of the channel
         channels = await manager.get_user_channels(user_id, stc_db)
@@ -410,46 +568,17 @@ async def get_channel_messages(channel_id: str, user_id: str = None, limit: int
             raise HTTPException(status_code=403, detail="Unauthorized to view this channel")
     query = {"channel_id": channel_id}
 
-    if user_id:
-        try:
-            # Get list of deleted message IDs for this user
-            deleted_messages = await chat_db.DeletedMessages.find(
-                {"user_id": user_id},
-                {"message_id": 1, "_id": 0}
-            ).to_list(length=None)
-            deleted_message_ids = {msg["message_id"] for msg in deleted_messages}
-
-            # Get all messages first
-            all_messages = await chat_db.Channel_chat.find(query, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(length=limit)
-            all_messages.reverse()
-
-            # Filter out deleted messages
-            messages = [msg for msg in all_messages if msg.get("id") not in deleted_message_ids]
-        except Exception as e:
-            logging.error(f"Error filtering deleted messages for user {user_id} in channel {channel_id}: {e}")
-            # If there's an error, return all messages rather than failing completely
-            messages = await chat_db.Channel_chat.find(query, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(length=limit)
-            messages.reverse()
-    else:
-        messages = await chat_db.Channel_chat.find(query, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(length=limit)
-        messages.reverse()
-
-    # Ensure all messages have a timestamp and convert to IST
-    for msg in messages:
-        if not msg.get('timestamp'):
-            msg['timestamp'] = datetime.now(ist_tz).isoformat()
-        else:
-            ts = msg['timestamp']
-            if ts.tzinfo is None:
-               ts = ts.replace(tzinfo=timezone.utc)
-            msg['timestamp'] = ts.astimezone(ist_tz).isoformat()
-    # Convert ObjectId to string for JSON serialization
-    messages = serialize_document(messages)
-    return messages
+    visible = await visibility_filter(chat_db, user_id, channel_id)
+    if visible:
+        query = {"$and": [query, visible]}
+    messages, has_more = await fetch_page(chat_db.Channel_chat, query, limit, before, after)
+    set_page_headers(response, messages, has_more, newer_page=bool(after))
+    return serialize_document(localize_timestamps(messages))
 
 @router.get("/direct-messages")
-async def get_direct_messages(sender_id: str, recipient_id: str, user_id: str = None, limit: int = 50):
-    """Get direct messages between two users"""
+async def get_direct_messages(response: Response, sender_id: str, recipient_id: str, user_id: str = None, limit: int = 50,
+                              before: Optional[str] = None, after: Optional[str] = None):
+    """Get one page of direct messages between two users (see get_channel_messages for paging)."""
     if user_id and user_id not in [sender_id, recipient_id]:
         raise HTTPException(status_code=403, detail="Unauthorized to view this conversation")
     query = {
@@ -459,39 +588,12 @@ async def get_direct_messages(sender_id: str, recipient_id: str, user_id: str =
         ]
     }
 
-    # Get all messages first
-    messages = await chat_db.Direct_chat.find(query, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(length=limit)
-    messages.reverse()
-
-    # If user_id is provided, filter out deleted messages for this user
-    if user_id:
-        try:
-            # Get list of deleted message IDs for this user
-            deleted_messages = await chat_db.DeletedMessages.find(
-                {"user_id": user_id},
-                {"message_id": 1, "_id": 0}
-            ).to_list(length=None)
-            deleted_message_ids = {msg["message_id"] for msg in deleted_messages}
-
-            # Filter out deleted messages
-            messages = [msg for msg in messages if msg.get("id") not in deleted_message_ids]
-        except Exception as e:
-            logging.error(f"Error filtering deleted messages for user {user_id}: {e}")
-            # If there's an error, return all messages rather than failing completely
-            pass
-    # Ensure all messages have a timestamp and convert to IST
-    for msg in messages:
-        if not msg.get('timestamp'):
-            msg['timestamp'] = datetime.now(ist_tz).isoformat()
-        else:
-            ts = msg['timestamp']
-            if ts.tzinfo is None:
-               ts = ts.replace(tzinfo=timezone.utc)
-            msg['timestamp'] = ts.astimezone(ist_tz).isoformat()
-    # Convert ObjectId to string for JSON serialization
-    # Convert ObjectId to string for JSON serialization
-    messages = serialize_document(messages)
-    return messages
+    visible = await visibility_filter(chat_db, user_id, dm_conversation_id(sender_id, recipient_id))
+    if visible:
+        query = {"$and": [query, visible]}
+    messages, has_more = await fetch_page(chat_db.Direct_chat, query, limit, before, after)
+    set_page_headers(response, messages, has_more, newer_page=bool(after))
+    return serialize_document(localize_timestamps(messages))
 
 @router.delete("/messages")
 async def delete_all_messages():
@@ -521,20 +623,12 @@ async def clear_direct_messages_for_user(
 ):
     """
     Soft-clear all direct messages between two users for the requesting user
-    by inserting into DeletedMessages.
+    by moving their cleared-before watermark for the conversation to now.
     """
+    if user_id not in [sender_id, recipient_id]:
+        raise HTTPException(status_code=403, detail="Unauthorized to clear this conversation")
     try:
-        msgs = await chat_db.Direct_chat.find({
-            "$or": [
-                {"sender_id": sender_id, "recipient_id": recipient_id},
-                {"sender_id": recipient_id, "recipient_id": sender_id}
-            ]
-        }, {"id": 1}).to_list(length=None)
-
-        if msgs:
-            to_insert = [{"user_id": user_id, "message_id": msg["id"], "created_at": datetime.now(ist_tz)} for msg in msgs]
-            if to_insert:
-                await chat_db.DeletedMessages.insert_many(to_insert)
+        await clear_conversation(chat_db, user_id, dm_conversation_id(sender_id, recipient_id))
         return {"message": "Direct chat cleared for user"}
     except Exception as e:
         logging.error(f"Error clearing direct chat for user {user_id}: {e}")
@@ -547,15 +641,11 @@ async def clear_channel_messages_for_user(
     user_id: str = Query(...)
 ):
     """
-    Soft-clear all channel messages for a user by marking them in DeletedMessages.
+    Soft-clear all channel messages for a user by moving their cleared-before
+    watermark for the channel to now.
     """
     try:
-        msgs = await chat_db.Channel_chat.find({"channel_id": channel_id}, {"id": 1}).to_list(length=None)
-
-        if msgs:
-            to_insert = [{"user_id": user_id, "message_id": msg["id"], "created_at": datetime.now(ist_tz)} for msg in msgs]
-            if to_insert:
-                await chat_db.DeletedMessages.insert_many(to_insert)
+        await clear_conversation(chat_db, user_id, channel_id)
         return {"message": "Channel chat cleared for user"}
     except Exception as e:
         logging.error(f"Error clearing channel {channel_id} for user {user_id}: {e}")
@@ -576,8 +666,8 @@ async def mark_message_deleted_for_user(
     Mark a message as deleted only for the requesting user.
     """
     try:
-        deleted_message = DeletedMessage(user_id=user_id, message_id=message_id, created_at=datetime.now(ist_tz))
-        await chat_db.DeletedMessages.insert_one(deleted_message.model_dump())
+        if not await hide_message(chat_db, user_id, message_id):
+            raise HTTPException(status_code=404, detail="Message not found")
 
         # Optionally notify just this user
         hidden_json = json.dumps({
@@ -588,6 +678,8 @@ async def mark_message_deleted_for_user(
         await manager.send_personal_message(hidden_json, user_id) # This will only send if user is online
 
         return {"message": "Message marked as deleted for user"}
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error marking message {message_id} as deleted for user {user_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to mark message as deleted")
@@ -699,21 +791,17 @@ async def upload_file(request: Request, file: UploadFile = File(...)):
         if not file:
             raise HTTPException(status_code=400, detail="No file provided")
 
-        # Read file content into memory to get size and for uploading
-        content = await file.read()
-        file_size = len(content)
-
-        # Upload file to GridFS
-        file_id = await grid_fs.upload_from_stream(
-            file.filename,
-            content,
-            metadata={"contentType": file.content_type}
-        )
+        # Store the upload in GridFS (hashing and dedupe in file_store; the body
+        # size limit is enforced while it is received, by UploadLimitMiddleware)
+        file_id, file_size, _ = await store_upload(file, grid_fs, chat_db)
+        # Thumbnail / preview renditions are generated in the background for images
+        schedule_renditions(grid_fs, chat_db, file_id, file.filename, file.content_type)
 
         # Dynamically create the file URL
         base_url = str(request.base_url)
-        # The URL now points to the new download endpoint with the GridFS file ID
-        file_url = f"{base_url}api/files/download/{str(file_id)}"
+        # The URL now points to the new download endpoint with the GridFS file ID.
+        # Deduplicated uploads share a GridFS file, so the URL carries this upload's name.
+        file_url = f"{base_url}api/files/download/{str(file_id)}?name={urllib.parse.quote(file.filename or 'download')}"
 
         # Return file metadata
         return {
@@ -723,6 +811,8 @@ async def upload_file(request: Request, file: UploadFile = File(...)):
             "file_size": file_size,
             "file_url": file_url
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"File upload failed: {e}")
         raise HTTPException(status_code=500, detail="File upload failed")
@@ -912,8 +1002,7 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                 user_id = message_data.get("user_id")
                 status = message_data.get("status")
                 if user_id and status:
-                    manager.user_status[user_id] = status
-                    await manager.broadcast_status(user_id, status)
+                    await manager.set_user_status(user_id, status)
                     logging.info(f"User {user_id} status updated to {status}")
                 continue
             
@@ -924,51 +1013,15 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                 chat_partner_id = message_data.get("chat_partner_id") # For DMs
                 channel_id_being_read = message_data.get("channel_id") # For Channels
 
-                if not message_ids:
-                    # If message_ids is empty but a channel_id is provided,
-                    # we mark all messages in that channel as read for the user.
-                    if not channel_id_being_read:
-                        continue
-                    update_query = {"channel_id": channel_id_being_read}
-                else:
-                    update_query = {"id": {"$in": message_ids}}
-
-                update_operation = {"$addToSet": {"read_by": user_id_reading}}
-
-                try:
-                    # Attempt to update both collections. A given message ID will only exist in one of them.
-                    # This is safer than relying on the presence of chat_partner_id or channel_id,
-                    # as the message_ids list is the source of truth.
-                    direct_result = await chat_db.Direct_chat.update_many(update_query, update_operation) if message_ids else 0
-                    channel_result = await chat_db.Channel_chat.update_many(update_query, update_operation)
-                    
-                    dm_count = direct_result.modified_count if direct_result else 0
-                    logging.info(f"Marked as read: {dm_count} DMs, {channel_result.modified_count} channel messages for user {user_id_reading}.")
-
-                    # After updating, recalculate and push new counts to the user who just read the messages.
-                    # This is more efficient than the client re-fetching.
-                    new_counts = await get_unread_message_counts(user_id=user_id_reading)
-                    unread_count_payload = json.dumps({
-                        "type": "unread_count_update",
-                        "counts": new_counts
-                    })
-                    await manager.send_personal_message(unread_count_payload, user_id_reading)
-                    logging.info(f"Pushed updated unread counts to {user_id_reading}: {new_counts}")
-
-                    # Also, send a read receipt to the chat partner in a DM so they can see the double-tick
-                    if chat_partner_id:
-                        # Notify the original sender that the messages were read
-                        read_receipt = {
-                            "type": "read_receipt",
-                            "message_ids": message_ids,
-                            "read_by": user_id_reading
-                        }
-                        await manager.send_personal_message(json.dumps(read_receipt), chat_partner_id) # This will only send if user is online
-                        logging.info(f"Sent read receipt for {len(message_ids)} messages to {chat_partner_id} from {user_id_reading}")
-
-                except Exception as e:
-                    logging.error(f"Error processing read receipts for user {user_id_reading}: {e}")
-                
+                # Queued and merged with other read events for the same conversation;
+                # the writes, count update and read receipt happen in apply_read_batch.
+                if channel_id_being_read:
+                    # No message_ids means the whole channel has been read.
+                    read_batcher.add(user_id_reading, "channel", channel_id_being_read, message_ids, not message_ids)
+                elif chat_partner_id and message_ids:
+                    read_batcher.add(user_id_reading, "dm", chat_partner_id, message_ids)
+                elif message_ids:
+                    read_batcher.add(user_id_reading, "ids", "", message_ids)
                 continue
 
             # Convert recipient_id and channel_id to string if present
@@ -1058,27 +1111,17 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                     message_json, 
                     message.channel_id, 
                     stc_db, 
-                    sender_id=client_id # Exclude the sender from the broadcast
+                    sender_id=client_id, # Exclude the sender from the broadcast
+                    unread=True # Bump unread counters for the other online members; pushed once per user.
                 )
-                # PUSH UPDATED UNREAD COUNTS TO ALL CHANNEL MEMBERS
-                channel_members = await manager.get_channel_members(message.channel_id, stc_db)
-                for member in channel_members:
-                    if member != client_id:  # don't update sender
-                        new_counts = await get_unread_message_counts(user_id=member)
-                        payload = json.dumps({
-                            "type": "unread_count_update",
-                            "counts": new_counts
-                        })
-                        await manager.send_personal_message(payload, member)
-
 
             elif isinstance(message.recipient_id, list):
                 # Group message: send to all recipients in the list
                 delivered_now = []
                 for recipient in message.recipient_id:
-                    await manager.send_personal_message(message_json, recipient)
-                    if recipient in manager.active_connections:
+                    if manager.is_online(recipient):
                         delivered_now.append(recipient)
+                    await manager.send_personal_message(message_json, recipient, unread=message.sender_id)
                 # Also send back to the sender
                 await manager.send_personal_message(message_json, message.sender_id) # Echo to sender
                 # Update delivered_to for online recipients
@@ -1089,7 +1132,7 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                     )
             elif message.type == "personal_message" and message.recipient_id:
                 # Send to the recipient. The manager will create a notification if offline.
-                await manager.send_personal_message(message_json, message.recipient_id)
+                await manager.send_personal_message(message_json, message.recipient_id, unread=message.sender_id)
                 
 
                 # Send a confirmation back to the sender with the final message ID and timestamp.
@@ -1100,9 +1143,9 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                     "final_id": message.id,
                     "timestamp": message.timestamp.isoformat()
                 }
-                await websocket.send_text(json.dumps(confirmation_data))
+                manager.send_to_socket(json.dumps(confirmation_data), websocket)
                 # If recipient is online, mark as delivered immediately
-                if message.recipient_id in manager.active_connections:
+                if manager.is_online(message.recipient_id):
                     update_result = await chat_db.Direct_chat.update_one(
                         {"id": message.id},
                         {"$addToSet": {"delivered_to": message.recipient_id}}
@@ -1116,14 +1159,7 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                         }
                         # Send receipt back to the original sender
                         await manager.send_personal_message(json.dumps(delivery_receipt), message.sender_id)
-                
-                # Update unread count instantly for receiver
-                new_counts = await get_unread_message_counts(user_id=message.recipient_id)
-                payload = json.dumps({
-                    "type": "unread_count_update",
-                    "counts": new_counts
-                })
-                await manager.send_personal_message(payload, message.recipient_id)
+
 
             else:
                 logging.warning(f"Message from {client_id} could not be routed: {message_json}")
@@ -0,0 +1,190 @@
+"""
+connections.py
+--------------
+Per-socket outbound queues for the chat websocket.
+
+Every accepted websocket gets an `OutboundConnection`: a bounded queue of
+pre-serialized frames drained by its own writer task. Broadcasts enqueue the
+frame once per socket and return immediately, so a stalled client only backs
+up its own queue instead of delaying everyone after it (and the receive loop
+that triggered the broadcast).
+
+`send_and_wait` queues a frame and resolves once the writer has actually
+written it (False if it was dropped, the socket failed or closed first, or
+the timeout passed); the missed-message sync uses it so delivery watermarks
+only move past frames that reached the socket.
+
+When a queue is full the slow-consumer policy applies:
+    drop        - discard the new frame and count it
+    disconnect  - close the socket; the client reconnects and catches up
+                  through the missed-messages path
+
+Config (.env):
+    WS_SEND_QUEUE_SIZE=256
+    WS_SLOW_CONSUMER_POLICY=disconnect   # or drop
+    WS_SEND_CONFIRM_TIMEOUT_SECONDS=30
+"""
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE", "256"))
+SLOW_CONSUMER_POLICY = os.environ.get("WS_SLOW_CONSUMER_POLICY", "disconnect").lower()
+if SLOW_CONSUMER_POLICY not in ("drop", "disconnect"):
+    logger.warning("Unknown WS_SLOW_CONSUMER_POLICY %r; using 'disconnect'", SLOW_CONSUMER_POLICY)
+    SLOW_CONSUMER_POLICY = "disconnect"
+
+SEND_CONFIRM_TIMEOUT = float(os.environ.get("WS_SEND_CONFIRM_TIMEOUT_SECONDS", "30"))
+
+# Close code sent to clients evicted for not keeping up (1008 = policy violation).
+SLOW_CONSUMER_CLOSE_CODE = 1008
+
+
+class OutboundStats:
+    """Process-wide counters, reported by /chat/connections/stats."""
+
+    def __init__(self):
+        self.enqueued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.evicted = 0
+        self.send_errors = 0
+        self.max_depth = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "send_errors": self.send_errors,
+            "max_depth": self.max_depth,
+        }
+
+
+outbound_stats = OutboundStats()
+
+
+def _resolve(done: Optional[asyncio.Future], sent: bool):
+    if done is not None and not done.done():
+        done.set_result(sent)
+
+
+class OutboundConnection:
+    """A websocket plus its bounded send queue and writer task."""
+
+    def __init__(self, websocket: WebSocket, user_id: str,
+                 queue_size: int = SEND_QUEUE_SIZE, policy: str = SLOW_CONSUMER_POLICY):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+        self.failed = False
+        self.unsent = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._drain())
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def send(self, frame: str) -> bool:
+        """Queue a frame without waiting. Returns False if it was not queued."""
+        return self._enqueue(frame, None)
+
+    async def send_and_wait(self, frame: str, timeout: float = SEND_CONFIRM_TIMEOUT) -> bool:
+        """Queue a frame and wait until the writer has sent it. False if it never was."""
+        done = asyncio.get_running_loop().create_future()
+        if not self._enqueue(frame, done):
+            return False
+        try:
+            return await asyncio.wait_for(asyncio.shield(done), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Send to %s not confirmed within %.0fs", self.user_id, timeout)
+            return False
+
+    def _enqueue(self, frame: str, done: Optional[asyncio.Future]) -> bool:
+        if self.closed:
+            return False
+        try:
+            self._queue.put_nowait((frame, done))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            outbound_stats.dropped += 1
+            if self.policy == "disconnect":
+                logger.warning("Evicting slow consumer %s (queue full at %d frames)", self.user_id, self._queue.maxsize)
+                outbound_stats.evicted += 1
+                self.closed = True
+                asyncio.create_task(self.close(SLOW_CONSUMER_CLOSE_CODE))
+            else:
+                logger.warning("Dropped frame for slow consumer %s (%d dropped)", self.user_id, self.dropped)
+            return False
+        outbound_stats.enqueued += 1
+        if self._queue.qsize() > outbound_stats.max_depth:
+            outbound_stats.max_depth = self._queue.qsize()
+        return True
+
+    async def _drain(self):
+        done = None
+        try:
+            while True:
+                frame, done = await self._queue.get()
+                try:
+                    await self.websocket.send_text(frame)
+                    outbound_stats.sent += 1
+                except Exception as e:
+                    outbound_stats.send_errors += 1
+                    logger.warning("Send to %s failed (connection may be closed): %s", self.user_id, e)
+                    self.closed = True
+                    self.failed = True
+                    return
+                _resolve(done, True)
+        finally:
+            _resolve(done, False)   # no-op unless it stopped mid-send
+            self._fail_pending()
+
+    def _fail_pending(self):
+        """Frames still queued when the writer stops will never be sent."""
+        pending = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        self.unsent += len(pending)
+        for frame, done in pending:
+            _resolve(done, False)
+
+    @property
+    def lossy(self) -> bool:
+        """True if any frame queued for this socket was never sent."""
+        return self.dropped > 0 or self.failed or self.unsent > 0 or self._queue.qsize() > 0
+
+    def stop(self):
+        """Stop the writer after the client went away; the socket is already closed."""
+        self.closed = True
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.cancel()
+        else:
+            self._fail_pending()
+
+    async def close(self, code: int = 1000):
+        """Stop the writer and close the socket. Safe to call more than once."""
+        if self._writer is None:
+            return
+        self.closed = True
+        writer, self._writer = self._writer, None
+        if writer is not None and writer is not asyncio.current_task():
+            writer.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass  # already closed by the client
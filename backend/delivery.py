@@ -0,0 +1,133 @@
+"""
+delivery.py
+-----------
+Per-user delivery watermarks for missed-message sync.
+
+Instead of asking "which messages does `delivered_to` not contain yet" (which
+no index can answer), each user has a "delivered up to" timestamp per
+conversation in DeliveryWatermarks:
+
+    {user_id, conversation_id: "inbox" | <channel_id>, delivered_until}
+
+"inbox" covers every direct message addressed to the user. On connect the
+user is sent everything newer than each watermark, read as an indexed range
+on (recipient_id, timestamp) / (channel_id, timestamp, id) and streamed in
+`missed_messages` frames of at most MISSED_CHUNK_SIZE messages. A
+conversation's watermark moves only once the socket writer has confirmed
+every one of its chunks was written; if one is not (dropped, socket gone),
+that conversation keeps its watermark and is resent on the next connect.
+While the user stays connected messages are delivered live, so the
+watermarks otherwise only move when the last connection closes cleanly.
+
+A user with no watermark yet (first connect after this shipped) falls back to
+the legacy `delivered_to` check, bounded to the last MISSED_LOOKBACK_DAYS.
+
+Config (.env):
+    CHAT_MISSED_CHUNK_SIZE=200
+    CHAT_MISSED_LOOKBACK_DAYS=7
+"""
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MISSED_CHUNK_SIZE = int(os.environ.get("CHAT_MISSED_CHUNK_SIZE", "200"))
+MISSED_LOOKBACK_DAYS = int(os.environ.get("CHAT_MISSED_LOOKBACK_DAYS", "7"))
+
+INBOX = "inbox"
+
+
+def _aware(ts: datetime) -> datetime:
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts
+
+
+async def load_watermarks(chat_db, user_id: str) -> Dict[str, datetime]:
+    rows = await chat_db.DeliveryWatermarks.find(
+        {"user_id": user_id}, {"conversation_id": 1, "delivered_until": 1, "_id": 0}
+    ).to_list(length=None)
+    return {row["conversation_id"]: _aware(row["delivered_until"]) for row in rows if row.get("delivered_until")}
+
+
+async def advance_watermarks(chat_db, user_id: str, conversation_ids: Iterable[str], until: datetime):
+    """Move the watermarks forward (never backwards) to `until`."""
+    for conversation_id in conversation_ids:
+        await chat_db.DeliveryWatermarks.update_one(
+            {"user_id": user_id, "conversation_id": conversation_id},
+            {"$max": {"delivered_until": until}},
+            upsert=True
+        )
+
+
+async def ensure_indexes(chat_db):
+    await chat_db.DeliveryWatermarks.create_index([("user_id", 1), ("conversation_id", 1)], unique=True)
+    await chat_db.Direct_chat.create_index([("recipient_id", 1), ("timestamp", 1)])
+
+
+def _range(watermark: Optional[datetime], until: datetime, user_id: str) -> dict:
+    if watermark:
+        return {"timestamp": {"$gt": watermark, "$lte": until}}
+    since = until - timedelta(days=MISSED_LOOKBACK_DAYS)
+    return {"timestamp": {"$gt": since, "$lte": until}, "delivered_to": {"$ne": user_id}}
+
+
+async def stream_missed_messages(chat_db, user_id: str, channel_ids: List[str],
+                                 send: Callable[[str], Awaitable[bool]],
+                                 serialize: Callable[[list], list],
+                                 until: Optional[datetime] = None) -> int:
+    """Send every message newer than the user's watermarks in bounded chunks.
+
+    `send` returns True once the frame was written to a socket. Returns the
+    number of messages confirmed. Each conversation's watermark is advanced
+    to `until` only if all of its chunks were confirmed; streaming stops at
+    the first unconfirmed chunk."""
+    until = until or datetime.now(timezone.utc)
+    watermarks = await load_watermarks(chat_db, user_id)
+
+    sources = [(chat_db.Direct_chat, INBOX, {"recipient_id": user_id})]
+    sources += [(chat_db.Channel_chat, cid, {"channel_id": cid, "sender_id": {"$ne": user_id}}) for cid in channel_ids]
+
+    sent = 0
+    for collection, conversation_id, query in sources:
+        query = {**query, **_range(watermarks.get(conversation_id), until, user_id)}
+        cursor = collection.find(query, {"_id": 0}).sort([("timestamp", 1), ("id", 1)]).batch_size(MISSED_CHUNK_SIZE)
+        chunk: List[dict] = []
+        complete = True
+        async for message in cursor:
+            chunk.append(message)
+            if len(chunk) >= MISSED_CHUNK_SIZE:
+                n = await _send_chunk(chat_db, user_id, chunk, conversation_id, send, serialize)
+                chunk = []
+                if not n:
+                    complete = False
+                    break
+                sent += n
+        if complete and chunk:
+            n = await _send_chunk(chat_db, user_id, chunk, conversation_id, send, serialize)
+            complete = n > 0
+            sent += n
+        if not complete:
+            logger.warning("Missed-message sync for %s stopped at %s: a chunk was not written; "
+                           "watermarks left in place", user_id, conversation_id)
+            return sent
+        await advance_watermarks(chat_db, user_id, [conversation_id], until)
+    return sent
+
+
+async def _send_chunk(chat_db, user_id: str, chunk: List[dict], conversation_id: str,
+                      send: Callable[[str], Awaitable[bool]], serialize: Callable[[list], list]) -> int:
+    """Send one chunk; returns how many messages were confirmed written (0 or all)."""
+    payload = json.dumps({
+        "type": "missed_messages",
+        "conversation_id": conversation_id,
+        "messages": serialize(chunk)
+    }, default=str)
+    if not await send(payload):
+        return 0
+    if conversation_id == INBOX:
+        # Senders still show a "delivered" tick from delivered_to on direct messages.
+        ids = [m["id"] for m in chunk if m.get("id")]
+        await chat_db.Direct_chat.update_many({"id": {"$in": ids}}, {"$addToSet": {"delivered_to": user_id}})
+    return len(chunk)
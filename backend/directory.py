@@ -0,0 +1,293 @@
+"""
+directory.py
+------------
+In-process index over every STC_Employees team collection.
+
+Employees live in one collection per team, so finding a user used to mean
+listing the collections and running a regex find_one against each of them.
+The directory loads every employee once (at startup, then again every
+DIRECTORY_TTL_SECONDS) and keeps a map from lowercased email, id and empCode
+to a small entry that records which collection owns the user plus the fields
+other modules route on (name, team, department, designation, shift, reviewer,
+active).
+
+Lookups are answered from memory; fetching the full document is then a single
+exact-match find_one against the owning collection. Writers (signup, profile,
+admin, sheet sync) call `put` / `refresh` / `discard` so the map stays current
+without waiting for the TTL.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+import urllib.parse
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from database import stc_db
+
+logger = logging.getLogger(__name__)
+
+# Collections in STC_Employees that are not team rosters.
+NON_TEAM_COLLECTIONS = {"facebook_posts", "ap_mapping"}
+
+DIRECTORY_TTL_SECONDS = int(os.environ.get("DIRECTORY_TTL_SECONDS", "600"))
+
+_ENTRY_PROJECTION = {
+    "_id": 0, "id": 1, "email": 1, "Email ID": 1, "empCode": 1, "Emp code": 1,
+    "name": 1, "Name": 1, "team": 1, "department": 1, "designation": 1,
+    "Designation": 1, "shift": 1, "active": 1, "isAdmin": 1, "reviewer": 1, "Reviewer": 1,
+}
+
+
+def is_team_collection(name: str) -> bool:
+    return not name.startswith("system.") and name not in NON_TEAM_COLLECTIONS
+
+
+def _key(value) -> str:
+    return str(value or "").strip().lower()
+
+
+def make_entry(doc: dict, collection_name: str) -> dict:
+    """Normalise a user document (new or legacy field names) into a directory entry."""
+    return {
+        "email": doc.get("email") or doc.get("Email ID") or "",
+        "id": str(doc.get("id") or ""),
+        "empCode": str(doc.get("empCode") or doc.get("Emp code") or "").strip(),
+        "name": doc.get("name") or doc.get("Name") or "",
+        "team": doc.get("team") or "",
+        "department": doc.get("department") or "",
+        "designation": doc.get("designation") or doc.get("Designation") or "",
+        "shift": str(doc.get("shift") or "").strip(),
+        "reviewer": doc.get("reviewer") or doc.get("Reviewer") or "",
+        "active": doc.get("active") is not False,
+        "isAdmin": bool(doc.get("isAdmin")),
+        "collection": collection_name,
+    }
+
+
+class EmployeeDirectory:
+    def __init__(self, db, ttl: int = DIRECTORY_TTL_SECONDS):
+        self.db = db
+        self.ttl = ttl
+        self._by_email: Dict[str, dict] = {}
+        self._by_id: Dict[str, dict] = {}
+        self._by_code: Dict[str, dict] = {}
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self._listeners: List[Callable[[Optional[dict], Optional[dict]], None]] = []
+        # Bumped on every change so caches built on top of the directory can
+        # tell whether they are stale.
+        self.version = 0
+
+    # --- loading ---
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at > 0
+
+    async def load(self):
+        """Rebuild the whole index from the team collections."""
+        async with self._lock:
+            by_email, by_id, by_code = {}, {}, {}
+            collection_names = await self.db.list_collection_names()
+            for cname in collection_names:
+                if not is_team_collection(cname):
+                    continue
+                try:
+                    async for doc in self.db[cname].find({}, _ENTRY_PROJECTION):
+                        entry = make_entry(doc, cname)
+                        if entry["email"]:
+                            by_email.setdefault(_key(entry["email"]), entry)
+                        if entry["id"]:
+                            by_id.setdefault(_key(entry["id"]), entry)
+                        if entry["empCode"]:
+                            by_code.setdefault(_key(entry["empCode"]), entry)
+                except Exception as e:
+                    logger.warning("Directory load skipped collection %s: %s", cname, e)
+            self._by_email, self._by_id, self._by_code = by_email, by_id, by_code
+            self._loaded_at = time.monotonic()
+            self.version += 1
+            logger.info("Employee directory loaded: %d employees", len(by_email))
+        for listener in self._listeners:
+            try:
+                listener(None, None)
+            except Exception as e:
+                logger.error("Directory listener failed: %s", e)
+
+    async def ensure_fresh(self):
+        if self.loaded and self._lock.locked():
+            return  # a reload is already running; serve the current map meanwhile
+        if not self.loaded or time.monotonic() - self._loaded_at > self.ttl:
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error("Employee directory refresh failed: %s", e)
+
+    async def ensure_indexes(self):
+        """Index the email field of every team collection so that fetches by
+        the canonical email are index point reads."""
+        for cname in await self.db.list_collection_names():
+            if not is_team_collection(cname):
+                continue
+            try:
+                await self.db[cname].create_index("email")
+            except Exception as e:
+                logger.warning("Could not index email on %s: %s", cname, e)
+
+    # --- change notification ---
+
+    def subscribe(self, listener: Callable[[Optional[dict], Optional[dict]], None]):
+        """Register `listener(old_entry, new_entry)`. Called with (None, None)
+        after a full reload."""
+        self._listeners.append(listener)
+
+    def _notify(self, old: Optional[dict], new: Optional[dict]):
+        self.version += 1
+        for listener in self._listeners:
+            try:
+                listener(old, new)
+            except Exception as e:
+                logger.error("Directory listener failed: %s", e)
+
+    # --- reads ---
+
+    def entry(self, key: str, fields: Iterable[str] = ("email", "id", "empCode")) -> Optional[dict]:
+        """Return the cached entry for an email / id / empCode, without I/O."""
+        k = _key(urllib.parse.unquote(key or ""))
+        if not k:
+            return None
+        maps = {"email": self._by_email, "id": self._by_id, "empCode": self._by_code}
+        for field in fields:
+            hit = maps[field].get(k)
+            if hit:
+                return hit
+        return None
+
+    def entries(self) -> List[dict]:
+        return list(self._by_email.values())
+
+    def entries_by_code(self) -> List[dict]:
+        """Every entry with an empCode (including users without an email)."""
+        return list(self._by_code.values())
+
+    async def resolve(self, key: str, fields: Iterable[str] = ("email", "id", "empCode")) -> Optional[dict]:
+        """Cached entry, loading the directory or scanning for unknown keys
+        (e.g. users created by another process) on a miss."""
+        await self.ensure_fresh()
+        found = self.entry(key, fields)
+        if found:
+            return found
+        doc, cname = await self._scan(key, fields)
+        if doc is None:
+            return None
+        return self.put(doc, cname)
+
+    async def fetch(self, key: str, include_hash: bool = False,
+                    fields: Iterable[str] = ("email", "id", "empCode")) -> Tuple[Optional[dict], Optional[object]]:
+        """Return (user document, owning collection) in one round trip."""
+        found = await self.resolve(key, fields)
+        if not found:
+            return None, None
+        collection = self.db[found["collection"]]
+        projection = None if include_hash else {"password_hash": 0}
+        query = self._exact_query(found)
+        user = await collection.find_one(query, projection)
+        if user is None:
+            # Entry went stale (user deleted or key changed elsewhere).
+            self.discard(key)
+            doc, cname = await self._scan(key, fields)
+            if doc is None:
+                return None, None
+            self.put(doc, cname)
+            collection = self.db[cname]
+            user = doc if include_hash else {k: v for k, v in doc.items() if k != "password_hash"}
+        return user, collection
+
+    # --- writes ---
+
+    def put(self, doc: dict, collection_name: str, replacing: Optional[dict] = None) -> dict:
+        """Insert or replace the entry for a user document. `replacing` is the
+        previous entry when the user's keys may have changed."""
+        new = make_entry(doc, collection_name)
+        old = replacing
+        if old is None and new["email"]:
+            old = self.entry(new["email"], ("email",))
+        if old is None and new["id"]:
+            old = self.entry(new["id"], ("id",))
+        if old:
+            self._unlink(old)
+        if new["email"]:
+            self._by_email[_key(new["email"])] = new
+        if new["id"]:
+            self._by_id[_key(new["id"])] = new
+        if new["empCode"]:
+            self._by_code[_key(new["empCode"])] = new
+        self._notify(old, new)
+        return new
+
+    def discard(self, key: str):
+        old = self.entry(key)
+        if old:
+            self._unlink(old)
+            self._notify(old, None)
+
+    async def refresh(self, key: str, collection=None, previous_key: Optional[str] = None):
+        """Re-read one user after a write. `key` is the user's current email/id;
+        pass `previous_key` when the write changed it, and the owning
+        collection if it is already known."""
+        old = self.entry(previous_key or key)
+        if collection is None and old:
+            collection = self.db[old["collection"]]
+        if collection is None:
+            await self.resolve(key)
+            return
+        doc = await collection.find_one(self._key_query(key), _ENTRY_PROJECTION)
+        if doc is None:
+            if old:
+                self._unlink(old)
+                self._notify(old, None)
+            return
+        self.put(doc, collection.name, replacing=old)
+
+    # --- helpers ---
+
+    def _unlink(self, entry: dict):
+        for mapping, field in ((self._by_email, "email"), (self._by_id, "id"), (self._by_code, "empCode")):
+            k = _key(entry[field])
+            if k and mapping.get(k) is entry:
+                del mapping[k]
+
+    @staticmethod
+    def _exact_query(entry: dict) -> dict:
+        if entry["email"]:
+            return {"email": entry["email"]}
+        if entry["id"]:
+            return {"id": entry["id"]}
+        return {"$or": [{"empCode": entry["empCode"]}, {"Emp code": entry["empCode"]}]}
+
+    @staticmethod
+    def _key_query(key: str) -> dict:
+        rx = re.compile(f"^{re.escape(urllib.parse.unquote(key))}$", re.IGNORECASE)
+        return {"$or": [{"email": rx}, {"id": rx}, {"empCode": rx}, {"Emp code": rx}]}
+
+    async def _scan(self, key: str, fields: Iterable[str]):
+        """Legacy per-collection search, used only for keys the index does not know."""
+        if not _key(key):
+            return None, None
+        rx = re.compile(f"^{re.escape(urllib.parse.unquote(key or ''))}$", re.IGNORECASE)
+        field_names = {"email": ["email"], "id": ["id"], "empCode": ["empCode", "Emp code"]}
+        query = {"$or": [{f: rx} for field in fields for f in field_names[field]]}
+        for cname in await self.db.list_collection_names():
+            if not is_team_collection(cname):
+                continue
+            try:
+                doc = await self.db[cname].find_one(query)
+                if doc:
+                    return doc, cname
+            except Exception as e:
+                logger.warning("Could not search in collection %s: %s", cname, e)
+        return None, None
+
+
+employee_directory = EmployeeDirectory(stc_db)
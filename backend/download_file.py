@@ -1,16 +1,92 @@
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import StreamingResponse
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorGridFSBucket
 from bson import ObjectId
 
 # Import the dependency from the new central database module
-from database import get_grid_fs
+from database import get_grid_fs, chat_db
+from renditions import RENDITIONS, find_rendition
 
 router = APIRouter()
 
+# File ids never change content, so clients may cache downloads for a year.
+CACHE_CONTROL = "private, max-age=31536000, immutable"
+# A rendition requested before it exists is answered with the original; that
+# response must be revalidated so the real rendition replaces it once generated.
+FALLBACK_CACHE_CONTROL = "private, no-cache"
+
+
+def content_disposition(filename: str) -> str:
+    """Attachment header value for any filename: an ASCII fallback plus the
+    UTF-8 name (RFC 6266), with quotes and line breaks stripped."""
+    filename = "".join(ch for ch in filename if ch not in '"\\\r\n') or "download"
+    fallback = filename.encode("ascii", "replace").decode("ascii")
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def parse_range(range_header: Optional[str], length: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range `Range: bytes=...` header into an inclusive (start, end).
+    Returns None when there is no usable range (serve the whole file) and raises
+    416 for a range outside the file.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else length - 1
+        elif end_text:
+            # Suffix range: the last N bytes
+            start = max(0, length - int(end_text))
+            end = length - 1
+        else:
+            return None
+    except ValueError:
+        return None
+    end = min(end, length - 1)
+    if start > end or start >= length:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{length}"})
+    return start, end
+
+
+def not_modified(request: Request, etag: str, last_modified) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            return last_modified.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def stream_range(download_stream, start: int, end: int):
+    """Yield bytes start..end (inclusive), reading whole GridFS chunks where possible."""
+    download_stream.seek(start)
+    remaining = end - start + 1
+    chunk_size = download_stream.chunk_size or 255 * 1024
+    while remaining > 0:
+        data = await download_stream.read(min(chunk_size, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+
 @router.get("/files/download/{file_id}")
 async def download_file(
-    file_id: str, grid_fs: AsyncIOMotorGridFSBucket = Depends(get_grid_fs)
+    file_id: str, request: Request, size: str = Query("original"), name: Optional[str] = Query(None),
+    grid_fs: AsyncIOMotorGridFSBucket = Depends(get_grid_fs)
 ):
     try:
         # Convert string ID to BSON ObjectId
@@ -18,18 +94,56 @@ async def download_file(
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid file ID format.")
 
+    fallback = False
+    if size != "original":
+        if size not in RENDITIONS:
+            raise HTTPException(status_code=400, detail=f"Unknown size. Use one of: original, {', '.join(RENDITIONS)}")
+        # Serve the downscaled image if it has been generated; otherwise the original.
+        rendition_id = await find_rendition(chat_db, gridfs_id, size)
+        if rendition_id is not None:
+            gridfs_id, file_id = rendition_id, str(rendition_id)
+        else:
+            fallback = True
+
     try:
         # Open a download stream from GridFS
         download_stream = await grid_fs.open_download_stream(gridfs_id)
-
-        # Get metadata to set headers correctly
-        content_type = download_stream.metadata.get("contentType", "application/octet-stream")
-        filename = download_stream.filename
-
-        # Use StreamingResponse to send the file chunk by chunk
-        return StreamingResponse(download_stream, media_type=content_type, headers={
-            "Content-Disposition": f"attachment; filename=\"{filename}\""
-        })
     except Exception as e:
         # This will catch errors if the file_id is not found in GridFS
         raise HTTPException(status_code=404, detail=f"File not found: {e}")
+
+    # Get metadata to set headers correctly
+    metadata = download_stream.metadata or {}
+    content_type = metadata.get("contentType") or "application/octet-stream"
+    # Deduplicated uploads share one GridFS file; `name` is the name this upload was sent under.
+    filename = name or download_stream.filename or "download"
+    length = download_stream.length
+    last_modified = download_stream.upload_date
+    if last_modified is not None and last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    etag = metadata.get("sha256") or file_id
+    etag = f'"{etag}-original"' if fallback else f'"{etag}"'
+
+    headers = {
+        "Content-Disposition": content_disposition(filename),
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Cache-Control": FALLBACK_CACHE_CONTROL if fallback else CACHE_CONTROL,
+    }
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+
+    if not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = parse_range(request.headers.get("range"), length)
+    if byte_range is None:
+        headers["Content-Length"] = str(length)
+        # Use StreamingResponse to send the file chunk by chunk
+        return StreamingResponse(stream_range(download_stream, 0, length - 1), media_type=content_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(stream_range(download_stream, start, end), status_code=206,
+                             media_type=content_type, headers=headers)
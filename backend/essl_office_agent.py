@@ -18,63 +18,374 @@ Put an .env next to this file:
     ESSL_DEVICE_NAMES=CEXJ232860602=Inside,JNP2244500022=Door
     ESSL_POLL_SECONDS=120
 
+Optional (defaults shown):
+    ESSL_POLL_FAST_SECONDS=30             # inside ESSL_FAST_HOURS (shift starts)
+    ESSL_FAST_HOURS=08:30-10:00,11:00-12:30
+    ESSL_POLL_SLOW_SECONDS=900            # inside ESSL_SLOW_HOURS (night)
+    ESSL_SLOW_HOURS=21:00-07:00
+    ESSL_AGENT_LOOKBACK_HOURS=6           # first poll of a device with no cursor
+    ESSL_DELTA_OVERLAP_MINUTES=10         # re-read before the cursor for late uploads
+    ESSL_SPOOL_PATH=essl_agent_spool.sqlite3
+    ESSL_METRICS_PORT=                    # e.g. 9108 to serve /metrics
+
 Run:
     python essl_office_agent.py
 
 Keep it running via Windows Task Scheduler (at startup) or a Linux systemd
-service. It reuses essl_service.py, so keep that file alongside this one.
+service. It reuses essl_service.py and biometric_summary.py, so keep those
+files alongside this one. After each poll it also writes the per-(empCode,
+day) summaries (biometric_daily) for the days that got new punches.
+
+Each device has a cursor (the end of the last successful poll and the newest
+punch seen) kept in the local SQLite file, so a poll only asks a device for
+what came after it, like the portal's punch_store watermarks. Punches that
+cannot be written to Atlas are appended to the same file as a spooled batch
+and the cursor still moves on; spooled batches are replayed, oldest first,
+at the start of every poll until Atlas takes them. Stopping the agent loses
+nothing either: the next poll resumes from the cursors.
+
+With ESSL_METRICS_PORT set, GET /metrics serves poll latency, device lag and
+spool backlog in Prometheus text format; every poll also logs them.
 """
-import os, sys, time, logging
+import os, sys, time, json, sqlite3, logging, threading
 from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-from pymongo import MongoClient, UpdateOne
 from dotenv import load_dotenv
-from essl_service import get_all_punches, IST, ESSLConfigError, ESSLRequestError
+load_dotenv()  # before essl_service, which reads its settings at import
+
+from pymongo import MongoClient, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from essl_service import get_device_punches, list_devices, IST, ESSLConfigError, ESSLRequestError
+from biometric_summary import Directions, day_bounds_utc, day_key, summarize_punches
 
-load_dotenv()
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 log = logging.getLogger("essl-office-agent")
 
+HERE = os.path.dirname(os.path.abspath(__file__))
+
 POLL = int(os.environ.get("ESSL_POLL_SECONDS", "120"))
+POLL_FAST = int(os.environ.get("ESSL_POLL_FAST_SECONDS", "30"))
+POLL_SLOW = int(os.environ.get("ESSL_POLL_SLOW_SECONDS", "900"))
+FAST_HOURS = os.environ.get("ESSL_FAST_HOURS", "08:30-10:00,11:00-12:30")
+SLOW_HOURS = os.environ.get("ESSL_SLOW_HOURS", "21:00-07:00")
+LOOKBACK = timedelta(hours=float(os.environ.get("ESSL_AGENT_LOOKBACK_HOURS", "6")))
+OVERLAP = timedelta(minutes=float(os.environ.get("ESSL_DELTA_OVERLAP_MINUTES", "10")))
+MAX_RESUME_LOOKBACK = timedelta(days=1)
+SPOOL_PATH = os.environ.get("ESSL_SPOOL_PATH") or os.path.join(HERE, "essl_agent_spool.sqlite3")
+METRICS_PORT = os.environ.get("ESSL_METRICS_PORT", "").strip()
 MONGO_URL = os.environ.get("ATTENDANCE_MONGO_URL")
 if not MONGO_URL:
     log.error("ATTENDANCE_MONGO_URL not set"); sys.exit(1)
 
-client = MongoClient(MONGO_URL, tlsAllowInvalidCertificates=True)
+# Fail fast when Atlas is unreachable so the batch is spooled instead of hanging the loop.
+client = MongoClient(MONGO_URL, tlsAllowInvalidCertificates=True, serverSelectionTimeoutMS=10000)
 col = client["employee_attendance"]["biometric_punches"]
-try:
-    col.drop_index("uniq_punch")
-except Exception:
-    pass
-col.create_index([("user_id", 1), ("punch_time", 1), ("serial", 1)],
-                 unique=True, name="uniq_punch_dev")
+summaries = client["employee_attendance"]["biometric_daily"]
+directions = Directions.from_env()
+_indexes_ready = False
+
+def ensure_indexes():
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    try:
+        col.drop_index("uniq_punch")
+    except PyMongoError:
+        pass
+    col.create_index([("user_id", 1), ("punch_time", 1), ("serial", 1)],
+                     unique=True, name="uniq_punch_dev")
+    summaries.create_index([("emp_code", 1), ("day", 1)], unique=True)
+    _indexes_ready = True
+
+# ------------------------------------------------------------------ #
+# Adaptive polling
+# ------------------------------------------------------------------ #
+def _parse_hours(spec):
+    """'08:30-10:00,21:00-07:00' -> [(510, 600), (1260, 420)] minutes of the day."""
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            a, b = (datetime.strptime(x.strip(), "%H:%M") for x in part.split("-"))
+        except ValueError:
+            log.warning("Ignoring bad hour range %r (use HH:MM-HH:MM)", part); continue
+        ranges.append((a.hour * 60 + a.minute, b.hour * 60 + b.minute))
+    return ranges
+
+_FAST, _SLOW = _parse_hours(FAST_HOURS), _parse_hours(SLOW_HOURS)
+
+def _in_ranges(minute, ranges):
+    # a range whose end is before its start wraps past midnight
+    return any(a <= minute < b if a <= b else (minute >= a or minute < b) for a, b in ranges)
+
+def poll_interval(now):
+    """Seconds until the next poll: fast around shift starts, slow at night."""
+    minute = now.hour * 60 + now.minute
+    if _in_ranges(minute, _FAST):
+        return POLL_FAST
+    if _in_ranges(minute, _SLOW):
+        return POLL_SLOW
+    return POLL
+
+# ------------------------------------------------------------------ #
+# Local state: device cursors + spool of unsent batches (SQLite)
+# ------------------------------------------------------------------ #
+db = sqlite3.connect(SPOOL_PATH)
+db.executescript("""
+CREATE TABLE IF NOT EXISTS cursors (serial TEXT PRIMARY KEY, synced_to TEXT NOT NULL, last_punch TEXT);
+CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, created_at TEXT NOT NULL,
+                                  punches INTEGER NOT NULL, payload TEXT NOT NULL);
+""")
+
+def _dt(text):
+    return datetime.fromisoformat(text) if text else None
+
+def load_cursors():
+    return {serial: {"synced_to": _dt(to), "last_punch": _dt(last)}
+            for serial, to, last in db.execute("SELECT serial, synced_to, last_punch FROM cursors")}
+
+def save_cursor(serial, synced_to, last_punch):
+    with db:
+        db.execute("INSERT INTO cursors (serial, synced_to, last_punch) VALUES (?, ?, ?) "
+                   "ON CONFLICT(serial) DO UPDATE SET synced_to = excluded.synced_to, last_punch = excluded.last_punch",
+                   (serial, synced_to.isoformat(), last_punch.isoformat() if last_punch else None))
+
+def _encode(punches):
+    return json.dumps([{"user_id": p["user_id"], "punch_time": p["punch_time"].isoformat(),
+                        "serial": p["serial"], "device": p["device"], "extra": p["extra"]} for p in punches])
+
+def _decode(payload):
+    return [dict(p, punch_time=datetime.fromisoformat(p["punch_time"])) for p in json.loads(payload)]
+
+def spool(punches):
+    with db:
+        db.execute("INSERT INTO spool (created_at, punches, payload) VALUES (?, ?, ?)",
+                   (datetime.now(IST).isoformat(), len(punches), _encode(punches)))
+
+def spool_backlog():
+    """(batches, punches, oldest created_at) still waiting for Atlas."""
+    batches, punches, oldest = db.execute("SELECT COUNT(*), COALESCE(SUM(punches), 0), MIN(created_at) FROM spool").fetchone()
+    return batches, punches, _dt(oldest)
+
+# ------------------------------------------------------------------ #
+# Metrics
+# ------------------------------------------------------------------ #
+class Metrics:
+    """Counters and gauges for /metrics; written by the poll loop, read by the HTTP thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {"essl_agent_polls_total": 0, "essl_agent_poll_failures_total": 0,
+                         "essl_agent_punches_fetched_total": 0, "essl_agent_punches_stored_total": 0,
+                         "essl_agent_punches_spooled_total": 0, "essl_agent_punches_replayed_total": 0,
+                         "essl_agent_loop_errors_total": 0}
+        self.gauges = {}
+        self.devices = {}   # serial -> {"up": 0/1, "lag": seconds behind now}
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def set(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def device(self, serial, up, lag):
+        with self.lock:
+            self.devices[serial] = {"up": up, "lag": lag}
+
+    def render(self):
+        with self.lock:
+            lines = [f"{k} {v}" for k, v in self.counters.items()]
+            lines += [f"{k} {v}" for k, v in self.gauges.items()]
+            for serial, d in sorted(self.devices.items()):
+                lines.append(f'essl_agent_device_up{{serial="{serial}"}} {d["up"]}')
+                lines.append(f'essl_agent_device_lag_seconds{{serial="{serial}"}} {d["lag"]:.0f}')
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404); return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass   # scrapes would flood the agent log
+
+def start_metrics_server(port):
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log.info("metrics on http://0.0.0.0:%d/metrics", port)
+
+def _update_backlog_metrics():
+    batches, punches, oldest = spool_backlog()
+    metrics.set("essl_agent_spool_batches", batches)
+    metrics.set("essl_agent_spool_punches", punches)
+    metrics.set("essl_agent_spool_oldest_age_seconds",
+                round((datetime.now(IST) - oldest).total_seconds()) if oldest else 0)
+    return batches, punches
+
+# ------------------------------------------------------------------ #
+# Shipping to Atlas
+# ------------------------------------------------------------------ #
+def materialize(new_punches):
+    """Rebuild the per-(empCode, day) summaries the portal reads for every
+    day that just received punches (from ALL of that day's stored punches)."""
+    keys = {(str(p["user_id"]), day_key(p["punch_time"])) for p in new_punches}
+    if not keys:
+        return 0
+    days = sorted({d for _, d in keys})
+    rows = list(col.find({"user_id": {"$in": sorted({c for c, _ in keys})},
+                          "punch_time": {"$gte": day_bounds_utc(days[0])[0], "$lte": day_bounds_utc(days[-1])[1]}},
+                         {"_id": 0, "user_id": 1, "punch_time": 1, "serial": 1, "device": 1}))
+    docs = {k: v for k, v in summarize_punches(rows, directions).items() if k in keys}
+    if docs:
+        summaries.bulk_write([ReplaceOne({"emp_code": c, "day": d}, doc, upsert=True)
+                              for (c, d), doc in docs.items()], ordered=False)
+    return len(docs)
+
+def ship(punches, replay=False):
+    """Write punches to Atlas and summarize their days. Returns (new, days).
+    Raises PyMongoError when Atlas cannot be reached."""
+    ensure_indexes()
+    ops = [UpdateOne(
+        {"user_id": p["user_id"], "punch_time": p["punch_time"], "serial": p["serial"]},
+        {"$setOnInsert": {"user_id": p["user_id"], "punch_time": p["punch_time"],
+                          "serial": p["serial"], "device": p["device"],
+                          "extra": p["extra"], "source": "essl"}},
+        upsert=True) for p in punches]
+    try:
+        inserted = list(col.bulk_write(ops, ordered=False).upserted_ids)
+    except BulkWriteError as e:
+        # duplicate-key race with the portal writing the same punch; the rest went in
+        inserted = [u["index"] for u in e.details.get("upserted", [])]
+    new = [punches[i] for i in inserted]
+    # A replayed batch may have been half-written before the link dropped, so
+    # summarize all of its days, not only the ones that got new rows now.
+    return len(new), materialize(punches if replay else new)
+
+def replay_spool():
+    """Send spooled batches oldest first; stop at the first failure.
+    Returns False if Atlas could not be reached."""
+    sent, reachable = 0, True
+    for batch_id, payload in db.execute("SELECT id, payload FROM spool ORDER BY id").fetchall():
+        punches = _decode(payload)
+        try:
+            ship(punches, replay=True)
+        except PyMongoError as e:
+            log.warning("Atlas still unreachable, %d spooled batches kept: %s", spool_backlog()[0], e)
+            reachable = False
+            break
+        with db:
+            db.execute("DELETE FROM spool WHERE id = ?", (batch_id,))
+        sent += len(punches)
+    if sent:
+        metrics.inc("essl_agent_punches_replayed_total", sent)
+        log.info("replayed %d spooled punches", sent)
+    return reachable
+
+# ------------------------------------------------------------------ #
+# Polling
+# ------------------------------------------------------------------ #
+def _window(cursor, now):
+    """Where to resume a device: just before its cursor (late uploads), but no
+    earlier than its newest punch unless that is over a day old."""
+    if not cursor:
+        return now - LOOKBACK
+    resume = cursor["synced_to"] - OVERLAP
+    if cursor["last_punch"]:
+        resume = max(min(resume, cursor["last_punch"]), cursor["synced_to"] - MAX_RESUME_LOOKBACK)
+    return resume
 
 def sync_once():
+    atlas_up = replay_spool()
     now = datetime.now(IST)
-    start = now - timedelta(hours=6)   # rolling window, catches late rows
+    cursors = load_cursors()
+    windows = {d["serial"]: [(_window(cursors.get(d["serial"]), now), now)] for d in list_devices()}
+    began = time.monotonic()
+    metrics.inc("essl_agent_polls_total")
     try:
-        punches, reports = get_all_punches(start, now)
+        punches, reports = get_device_punches(windows)
     except ESSLConfigError as e:
+        metrics.inc("essl_agent_poll_failures_total")
         log.error("Config error: %s", e); return
     except ESSLRequestError as e:
+        metrics.inc("essl_agent_poll_failures_total")
         log.warning("All devices unreachable: %s", e); return
+    finally:
+        latency = time.monotonic() - began
+        metrics.set("essl_agent_poll_duration_seconds", round(latency, 3))
+    metrics.inc("essl_agent_punches_fetched_total", len(punches))
+
+    new, days = 0, 0
+    if punches:
+        try:
+            if not atlas_up:
+                raise PyMongoError("spooled batches could not be replayed")
+            new, days = ship(punches)
+            metrics.inc("essl_agent_punches_stored_total", new)
+        except PyMongoError as e:
+            spool(punches)   # durable now, so the cursors may move on
+            metrics.inc("essl_agent_punches_spooled_total", len(punches))
+            log.warning("Atlas unreachable, spooled %d punches: %s", len(punches), e)
+
+    newest = {}
+    for p in punches:
+        if p["serial"] not in newest or p["punch_time"] > newest[p["serial"]]:
+            newest[p["serial"]] = p["punch_time"]
     for r in reports:
-        if not r.get("ok"):
+        serial = r["serial"]
+        cursor = cursors.get(serial) or {"synced_to": None, "last_punch": None}
+        if r.get("ok"):
+            last = max(filter(None, (cursor["last_punch"], newest.get(serial))), default=None)
+            save_cursor(serial, now, last)
+            cursor = {"synced_to": now, "last_punch": last}
+        else:
             log.warning("Device %s offline: %s", r.get("device"), r.get("error"))
-    if not punches:
-        log.info("No punches in window."); return
-    ops = [UpdateOne(
-        {"user_id": p["user_id"], "punch_time": p["punch_time"], "serial": p["serial"]},
-        {"$setOnInsert": {"user_id": p["user_id"], "punch_time": p["punch_time"],
-                          "serial": p["serial"], "device": p["device"],
-                          "extra": p["extra"], "source": "essl"}},
-        upsert=True) for p in punches]
-    res = col.bulk_write(ops, ordered=False)
-    log.info("window %s..%s fetched=%d new=%d",
-             start.strftime("%H:%M"), now.strftime("%H:%M"), len(punches), res.upserted_count)
+        lag = (now - (cursor["synced_to"] or windows[serial][0][0])).total_seconds()
+        metrics.device(serial, 1 if r.get("ok") else 0, lag)
+    metrics.set("essl_agent_last_poll_timestamp_seconds", round(time.time()))
+
+    batches, backlog = _update_backlog_metrics()
+    log.info("poll %.1fs devices=%d fetched=%d new=%d days_summarized=%d spool=%d batches/%d punches",
+             latency, sum(1 for r in reports if r.get("ok")), len(punches), new, days, batches, backlog)
+
+def poll_safely():
+    """sync_once that never raises: any failure (a locked spool, Atlas, a bug)
+    is logged and counted, and the loop tries again after the poll interval.
+    Cursors only move once punches are stored or spooled, so nothing is lost."""
+    try:
+        sync_once()
+        return True
+    except Exception:
+        metrics.inc("essl_agent_loop_errors_total")
+        log.exception("poll failed; retrying after the poll interval")
+        return False
 
 if __name__ == "__main__":
-    log.info("office agent started; polling every %ds", POLL)
+    if METRICS_PORT:
+        try:
+            start_metrics_server(int(METRICS_PORT))
+        except (OSError, ValueError) as e:
+            log.error("metrics server not started on %r, polling without it: %s", METRICS_PORT, e)
+    log.info("office agent started; polling every %ds (%ds in %s, %ds in %s), spool %s",
+             POLL, POLL_FAST, FAST_HOURS, POLL_SLOW, SLOW_HOURS, SPOOL_PATH)
+    try:
+        _update_backlog_metrics()
+    except sqlite3.Error as e:
+        log.error("could not read the spool backlog: %s", e)
     while True:
-        sync_once()
-        time.sleep(POLL)
+        poll_safely()
+        interval = poll_interval(datetime.now(IST))
+        metrics.set("essl_agent_poll_interval_seconds", interval)
+        time.sleep(interval)
@@ -21,16 +21,42 @@ Config (.env) — two ways:
     ESSL_PASSWORD=<rotated password>
 
 If ESSL_DEVICES is set it wins. Otherwise (B) is used. Username/password are
-shared across devices.
+shared across devices. An optional 4th field in (A) sets that device's
+timeout in seconds (default ESSL_TIMEOUT_SECONDS=30).
+
+The portal uses the async client (`get_all_punches_async`,
+`get_device_punches_async`): all devices are queried concurrently over one
+pooled keep-alive httpx client, each with its own timeout, so a slow device
+delays only its own report and never blocks the event loop. A per-device
+circuit breaker skips a device for ESSL_BREAKER_COOLDOWN_SECONDS=60 after
+ESSL_BREAKER_FAILURES=3 consecutive failures, then lets one trial call
+through while other callers keep skipping it. The blocking `get_all_punches` (requests) stays for
+essl_office_agent.py, which does not need httpx.
+
+Responses are streamed: `PunchStream` feeds the body to expat chunk by chunk
+and parses punch rows out of <strDataList> as each line completes, instead
+of regex-extracting and unescaping the whole (multi-MB for long ranges)
+payload first.
 """
-import os, re, html, logging
+import os, re, time, asyncio, logging
+from xml.parsers import expat
 from datetime import datetime, timezone, timedelta
 import requests
 
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
 logger = logging.getLogger(__name__)
 IST = timezone(timedelta(hours=5, minutes=30))
 ESSL_DT_FMT = "%d-%m-%Y %H:%M:%S"
 
+DEFAULT_TIMEOUT = float(os.environ.get("ESSL_TIMEOUT_SECONDS", "30"))
+BREAKER_FAILURES = int(os.environ.get("ESSL_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.environ.get("ESSL_BREAKER_COOLDOWN_SECONDS", "60"))
+STREAM_CHUNK = 64 * 1024
+
 class ESSLConfigError(RuntimeError): pass
 class ESSLRequestError(RuntimeError): pass
 
@@ -51,7 +77,7 @@ _SOAP_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
 </soap:Envelope>"""
 
 def _device_list():
-    """Return list of {serial, url, name}."""
+    """Return list of {serial, url, name, timeout}."""
     devices = []
     raw = os.environ.get("ESSL_DEVICES")
     if raw:
@@ -63,8 +89,12 @@ def _device_list():
             if len(parts) < 2:
                 continue
             serial, url = parts[0], parts[1]
-            name = parts[2] if len(parts) > 2 else serial
-            devices.append({"serial": serial, "url": url, "name": name})
+            name = parts[2] if len(parts) > 2 and parts[2] else serial
+            try:
+                timeout = float(parts[3]) if len(parts) > 3 and parts[3] else DEFAULT_TIMEOUT
+            except ValueError:
+                timeout = DEFAULT_TIMEOUT
+            devices.append({"serial": serial, "url": url, "name": name, "timeout": timeout})
         return devices
     # Fallback: shared URL + serial list
     url = os.environ.get("ESSL_API_URL")
@@ -78,7 +108,7 @@ def _device_list():
         for s in serials_raw.split(","):
             s = s.strip()
             if s:
-                devices.append({"serial": s, "url": url, "name": names.get(s, s)})
+                devices.append({"serial": s, "url": url, "name": names.get(s, s), "timeout": DEFAULT_TIMEOUT})
     return devices
 
 def _creds():
@@ -88,53 +118,178 @@ def _creds():
         raise ESSLConfigError("Missing ESSL_USERNAME / ESSL_PASSWORD")
     return user, pwd
 
-def _fetch_one(url, serial, user, pwd, from_dt, to_dt, timeout=30) -> str:
-    body = _SOAP_TEMPLATE.format(from_dt=from_dt.strftime(ESSL_DT_FMT),
-        to_dt=to_dt.strftime(ESSL_DT_FMT), serial=serial, username=user, password=pwd)
-    headers = {"Content-Type": "text/xml; charset=utf-8",
-               "SOAPAction": "http://tempuri.org/GetTransactionsLog"}
+_SOAP_HEADERS = {"Content-Type": "text/xml; charset=utf-8",
+                 "SOAPAction": "http://tempuri.org/GetTransactionsLog"}
+
+def _soap_body(serial, user, pwd, from_dt, to_dt) -> bytes:
+    return _SOAP_TEMPLATE.format(from_dt=from_dt.strftime(ESSL_DT_FMT),
+        to_dt=to_dt.strftime(ESSL_DT_FMT), serial=serial, username=user, password=pwd).encode("utf-8")
+
+def _parse_time(text):
+    """'YYYY-MM-DD HH:MM:SS' -> IST datetime; None if malformed. The zero-padded
+    form is sliced directly; anything else (e.g. '2024-1-5 9:03:00') goes
+    through strptime, which accepts it like the original parser did."""
+    if len(text) == 19 and text[4] == "-" and text[7] == "-" and text[10] == " " and text[13] == ":" and text[16] == ":":
+        try:
+            return datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                            int(text[11:13]), int(text[14:16]), int(text[17:19]), tzinfo=IST)
+        except ValueError:
+            pass
     try:
-        resp = requests.post(url, data=body.encode("utf-8"), headers=headers, timeout=timeout)
-    except requests.RequestException as e:
-        raise ESSLRequestError(f"Could not reach device {serial} at {url}: {e}") from e
-    if resp.status_code != 200:
-        raise ESSLRequestError(f"Device {serial} returned HTTP {resp.status_code}: {resp.text[:200]}")
-    m = re.search(r"<strDataList>(.*?)</strDataList>", resp.text, re.DOTALL)
-    if not m:
-        rm = re.search(r"<GetTransactionsLogResult>(.*?)</GetTransactionsLogResult>", resp.text, re.DOTALL)
-        detail = rm.group(1) if rm else resp.text[:200]
-        raise ESSLRequestError(f"Device {serial}: no <strDataList>. Result said: {detail}")
-    return html.unescape(m.group(1))
+        return datetime.strptime(text, "%Y-%m-%d %H:%M:%S").replace(tzinfo=IST)
+    except ValueError:
+        return None
 
-def parse_punches(raw: str, serial: str = "", device: str = ""):
-    punches = []
-    for line in raw.splitlines():
-        line = line.strip()
-        if not line: continue
-        parts = line.split("\t") if "\t" in line else re.split(r"\s{2,}", line)
-        if len(parts) < 2: continue
+def _parse_line(line, serial, device):
+    line = line.strip()
+    if not line:
+        return None
+    if "\t" in line:
+        # Fast path: the devices send tab-separated rows
+        parts = line.split("\t")
+        if len(parts) < 2:
+            return None
+        dt = _parse_time(parts[1].strip())
+    else:
+        parts = re.split(r"\s{2,}", line)
+        if len(parts) < 2:
+            return None
         try:
             dt = datetime.strptime(parts[1].strip(), "%Y-%m-%d %H:%M:%S").replace(tzinfo=IST)
         except ValueError:
-            continue
-        punches.append({"user_id": parts[0].strip(), "punch_time": dt,
-                        "serial": serial, "device": device or serial,
-                        "extra": parts[2:] if len(parts) > 2 else [], "raw": line})
+            dt = None
+    if dt is None:
+        return None
+    return {"user_id": parts[0].strip(), "punch_time": dt,
+            "serial": serial, "device": device or serial,
+            "extra": parts[2:] if len(parts) > 2 else [], "raw": line}
+
+def parse_punches(raw: str, serial: str = "", device: str = ""):
+    punches = []
+    for line in raw.splitlines():
+        punch = _parse_line(line, serial, device)
+        if punch is not None:
+            punches.append(punch)
     return punches
 
-def get_all_punches(from_dt: datetime, to_dt: datetime):
-    """Query every configured device (each at its own URL). Returns
-    (punches, reports). Resilient: one device failing doesn't stop the others;
-    raises ESSLRequestError only if ALL fail."""
+class PunchStream:
+    """Incremental parser for a GetTransactionsLog SOAP response.
+
+    Feed it the body in chunks; expat hands over the (already unescaped) text
+    of <strDataList> piece by piece and complete lines are parsed as they
+    arrive, so the payload never exists as one string. `feed` and `close`
+    return the punches parsed by that call."""
+
+    _RESULT_LIMIT = 500
+
+    def __init__(self, serial, device=""):
+        self.serial, self.device = serial, device
+        self.found = False
+        self._in_data = self._in_result = False
+        self._pending = ""
+        self._result = []
+        self._out = []
+        self._parser = expat.ParserCreate()
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._text
+
+    @staticmethod
+    def _local(name):
+        return name.rsplit(":", 1)[-1]
+
+    def _start(self, name, attrs):
+        local = self._local(name)
+        if local == "strDataList":
+            self.found = self._in_data = True
+        elif local == "GetTransactionsLogResult":
+            self._in_result = True
+
+    def _end(self, name):
+        local = self._local(name)
+        if local == "strDataList":
+            self._in_data = False
+            self._emit(self._pending)
+            self._pending = ""
+        elif local == "GetTransactionsLogResult":
+            self._in_result = False
+
+    def _text(self, data):
+        if self._in_data:
+            lines = (self._pending + data).split("\n")
+            self._pending = lines.pop()
+            for line in lines:
+                self._emit(line)
+        elif self._in_result and sum(map(len, self._result)) < self._RESULT_LIMIT:
+            self._result.append(data)
+
+    def _emit(self, line):
+        punch = _parse_line(line, self.serial, self.device)
+        if punch is not None:
+            self._out.append(punch)
+
+    def _take(self):
+        out, self._out = self._out, []
+        return out
+
+    def feed(self, chunk: bytes):
+        try:
+            self._parser.Parse(chunk, False)
+        except expat.ExpatError as e:
+            raise ESSLRequestError(f"Device {self.serial}: malformed SOAP response: {e}") from e
+        return self._take()
+
+    def close(self):
+        try:
+            self._parser.Parse(b"", True)
+        except expat.ExpatError as e:
+            raise ESSLRequestError(f"Device {self.serial}: malformed SOAP response: {e}") from e
+        if not self.found:
+            detail = "".join(self._result)[:200] or "no result"
+            raise ESSLRequestError(f"Device {self.serial}: no <strDataList>. Result said: {detail}")
+        return self._take()
+
+def iter_punches(chunks, serial, device=""):
+    """Yield punches from an iterable of SOAP response byte chunks as they are parsed."""
+    stream = PunchStream(serial, device)
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+    yield from stream.close()
+
+def _fetch_punches(d, user, pwd, from_dt, to_dt):
+    try:
+        with requests.post(d["url"], data=_soap_body(d["serial"], user, pwd, from_dt, to_dt),
+                           headers=_SOAP_HEADERS, timeout=d["timeout"], stream=True) as resp:
+            if resp.status_code != 200:
+                raise ESSLRequestError(f"Device {d['serial']} returned HTTP {resp.status_code}: {resp.text[:200]}")
+            return list(iter_punches(resp.iter_content(STREAM_CHUNK), d["serial"], d["name"]))
+    except requests.RequestException as e:
+        raise ESSLRequestError(f"Could not reach device {d['serial']} at {d['url']}: {e}") from e
+
+def list_devices():
+    """Configured devices as [{serial, url, name}]."""
+    return _device_list()
+
+def get_device_punches(windows):
+    """Query each device only for its own time windows:
+    windows = {serial: [(from_dt, to_dt), ...]}. Devices without windows are
+    not called. Returns (punches, reports); raises ESSLRequestError only if
+    every device that was called failed."""
     devices = _device_list()
     if not devices:
         raise ESSLConfigError("No devices configured. Set ESSL_DEVICES or ESSL_API_URL+ESSL_SERIALS.")
     user, pwd = _creds()
     all_punches, reports, errors = [], [], []
+    called = 0
     for d in devices:
+        device_windows = windows.get(d["serial"]) or []
+        if not device_windows:
+            continue
+        called += 1
         try:
-            raw = _fetch_one(d["url"], d["serial"], user, pwd, from_dt, to_dt)
-            p = parse_punches(raw, serial=d["serial"], device=d["name"])
+            p = []
+            for from_dt, to_dt in device_windows:
+                p.extend(_fetch_punches(d, user, pwd, from_dt, to_dt))
             all_punches.extend(p)
             reports.append({"serial": d["serial"], "device": d["name"], "ok": True, "count": len(p)})
         except ESSLRequestError as e:
@@ -142,10 +297,118 @@ def get_all_punches(from_dt: datetime, to_dt: datetime):
             reports.append({"serial": d["serial"], "device": d["name"], "ok": False,
                             "error": str(e), "count": 0})
             errors.append(str(e))
-    if errors and len(errors) == len(devices):
+    if errors and len(errors) == called:
         raise ESSLRequestError(" ; ".join(errors))
     return all_punches, reports
 
+def get_all_punches(from_dt: datetime, to_dt: datetime):
+    """Query every configured device (each at its own URL). Returns
+    (punches, reports). Resilient: one device failing doesn't stop the others;
+    raises ESSLRequestError only if ALL fail."""
+    return get_device_punches({d["serial"]: [(from_dt, to_dt)] for d in _device_list()})
+
+# ------------------------------------------------------------------ #
+# Async client (portal)
+# ------------------------------------------------------------------ #
+_client = None
+_breakers = {}   # serial -> {"failures": int, "open_until": monotonic seconds}
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            headers=_SOAP_HEADERS,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60))
+    return _client
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _breaker_open(serial) -> bool:
+    """True if the device should be skipped. Once the cooldown has passed the
+    first caller goes through as the trial call and the breaker is re-armed
+    for another cooldown, so concurrent callers keep skipping the device until
+    the trial reports back (or the trial itself is lost)."""
+    state = _breakers.get(serial)
+    if not state or state["failures"] < BREAKER_FAILURES:
+        return False
+    now = time.monotonic()
+    if now < state["open_until"]:
+        return True
+    state["open_until"] = now + BREAKER_COOLDOWN   # half-open: this caller is the trial
+    return False
+
+def _record_result(serial, ok):
+    if ok:
+        _breakers.pop(serial, None)
+        return
+    state = _breakers.setdefault(serial, {"failures": 0, "open_until": 0.0})
+    state["failures"] += 1
+    if state["failures"] >= BREAKER_FAILURES:
+        # (re)open; after the cooldown one trial call goes through
+        state["open_until"] = time.monotonic() + BREAKER_COOLDOWN
+        logger.warning("Device %s: circuit open for %.0fs after %d failures", serial, BREAKER_COOLDOWN, state["failures"])
+
+async def _fetch_punches_async(d, user, pwd, from_dt, to_dt):
+    punches = []
+    try:
+        async with _get_client().stream("POST", d["url"], content=_soap_body(d["serial"], user, pwd, from_dt, to_dt),
+                                        timeout=d["timeout"]) as resp:
+            if resp.status_code != 200:
+                body = (await resp.aread()).decode("utf-8", "replace")
+                raise ESSLRequestError(f"Device {d['serial']} returned HTTP {resp.status_code}: {body[:200]}")
+            stream = PunchStream(d["serial"], d["name"])
+            async for chunk in resp.aiter_bytes(STREAM_CHUNK):
+                punches.extend(stream.feed(chunk))
+            punches.extend(stream.close())
+    except httpx.HTTPError as e:
+        raise ESSLRequestError(f"Could not reach device {d['serial']} at {d['url']}: {e!r}") from e
+    return punches
+
+async def _poll_device(d, windows, user, pwd):
+    """(punches, report) for one device; never raises ESSLRequestError."""
+    if _breaker_open(d["serial"]):
+        return [], {"serial": d["serial"], "device": d["name"], "ok": False, "count": 0,
+                    "error": f"Device {d['serial']} skipped: circuit open after repeated failures"}
+    try:
+        p = []
+        for from_dt, to_dt in windows:
+            p.extend(await _fetch_punches_async(d, user, pwd, from_dt, to_dt))
+    except ESSLRequestError as e:
+        logger.warning("Device %s failed: %s", d["serial"], e)
+        _record_result(d["serial"], False)
+        return [], {"serial": d["serial"], "device": d["name"], "ok": False,
+                    "error": str(e), "count": 0}
+    _record_result(d["serial"], True)
+    return p, {"serial": d["serial"], "device": d["name"], "ok": True, "count": len(p)}
+
+async def get_device_punches_async(windows):
+    """Async `get_device_punches`: the devices are queried concurrently.
+    Same (punches, reports) contract and errors."""
+    if httpx is None:
+        return await asyncio.to_thread(get_device_punches, windows)
+    devices = _device_list()
+    if not devices:
+        raise ESSLConfigError("No devices configured. Set ESSL_DEVICES or ESSL_API_URL+ESSL_SERIALS.")
+    user, pwd = _creds()
+    called = [d for d in devices if windows.get(d["serial"])]
+    results = await asyncio.gather(*(_poll_device(d, windows[d["serial"]], user, pwd) for d in called))
+    all_punches, reports = [], []
+    for p, report in results:
+        all_punches.extend(p)
+        reports.append(report)
+    failed = [r["error"] for r in reports if not r["ok"]]
+    if called and len(failed) == len(called):
+        raise ESSLRequestError(" ; ".join(failed))
+    return all_punches, reports
+
+async def get_all_punches_async(from_dt: datetime, to_dt: datetime):
+    """Async `get_all_punches`: every device, concurrently."""
+    return await get_device_punches_async({d["serial"]: [(from_dt, to_dt)] for d in _device_list()})
+
 def get_punches(from_dt: datetime, to_dt: datetime):
     punches, _ = get_all_punches(from_dt, to_dt)
     return punches
@@ -0,0 +1,126 @@
+"""
+file_store.py
+-------------
+Streaming uploads of chat attachments into GridFS.
+
+Starlette parses the multipart body, spooling the file to a temporary file,
+before the upload handler runs, so the size limit is enforced while the body
+is received: `UploadLimitMiddleware` answers 413 up front when Content-Length
+is over MAX_UPLOAD_MB, and otherwise (chunked bodies, or a client that lies)
+counts the body bytes as they arrive and fails the request with 413 as soon
+as they cross it. Nothing over the limit is spooled beyond that point.
+
+The spooled `UploadFile` is then read in UPLOAD_CHUNK_SIZE pieces, so a worker
+never holds a whole attachment in memory, in up to two passes over the local
+temporary file: one to hash (SHA-256) and count it, which stops at the limit,
+and, only if no stored file has the same hash and length, one to copy it into
+GridFS. Identical content is therefore stored once (the hash is kept in
+`metadata.sha256`) and a duplicate never reaches GridFS; the existing file id
+is returned instead. GridFS keeps the first uploader's filename, so callers
+carry each upload's own name in the download URL (`?name=`, see
+download_file.py).
+
+Config (.env):
+    MAX_UPLOAD_MB=50
+"""
+import hashlib
+import logging
+import os
+from typing import Iterable, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+logger = logging.getLogger(__name__)
+
+MAX_UPLOAD_BYTES = int(float(os.environ.get("MAX_UPLOAD_MB", "50")) * 1024 * 1024)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Slack for multipart boundaries and headers when checking Content-Length.
+_MULTIPART_OVERHEAD = 64 * 1024
+
+
+_TOO_LARGE = f"File too large. Maximum size is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB."
+
+
+def check_declared_size(content_length: Optional[str]):
+    """Reject an upload before reading it when the request says it is too large."""
+    try:
+        declared = int(content_length) if content_length else None
+    except ValueError:
+        declared = None
+    if declared is not None and declared > MAX_UPLOAD_BYTES + _MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail=_TOO_LARGE)
+
+
+class UploadLimitMiddleware:
+    """Caps the request body of the upload routes while it is received."""
+
+    def __init__(self, app, paths: Iterable[str], max_bytes: int = MAX_UPLOAD_BYTES + _MULTIPART_OVERHEAD):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers") or ())
+        try:
+            check_declared_size((headers.get(b"content-length") or b"").decode("latin-1"))
+        except HTTPException as e:
+            return await JSONResponse({"detail": e.detail}, status_code=e.status_code)(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # FastAPI re-raises HTTPExceptions from body parsing as they are.
+                    raise HTTPException(status_code=413, detail=_TOO_LARGE)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def ensure_indexes(db):
+    await db["fs.files"].create_index("metadata.sha256")
+
+
+async def store_upload(file: UploadFile, grid_fs: AsyncIOMotorGridFSBucket, db) -> Tuple[str, int, str]:
+    """Store `file` in GridFS unless identical content already is: hash the
+    spooled upload, then copy it to GridFS only if it is new.
+    Returns (file id, size in bytes, sha256 hex)."""
+    hasher = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=_TOO_LARGE)
+        hasher.update(chunk)
+
+    digest = hasher.hexdigest()
+    existing = await db["fs.files"].find_one({"metadata.sha256": digest, "length": size}, {"_id": 1})
+    if existing:
+        logger.info("Upload %s duplicates stored file %s; reusing it", file.filename, existing["_id"])
+        return str(existing["_id"]), size, digest
+
+    await file.seek(0)
+    grid_in = grid_fs.open_upload_stream(file.filename, metadata={"contentType": file.content_type, "sha256": digest})
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            await grid_in.write(chunk)
+    except BaseException:
+        await grid_in.abort()
+        raise
+    await grid_in.close()
+    return str(grid_in._id), size, digest
@@ -0,0 +1,106 @@
+"""
+hidden.py
+---------
+Per-user message visibility ("delete for me" and "clear chat").
+
+Two compact representations replace the one-row-per-message DeletedMessages
+collection:
+
+* `hidden_for` - an array of user ids on the message itself. "Delete for me"
+  is a single $addToSet on the message.
+* ClearedConversations - one document per (user_id, conversation_id) holding a
+  `cleared_before` watermark. "Clear chat" is a single upsert, however long
+  the conversation is.
+
+A conversation id is the channel id for channel messages and
+"dm:<a>|<b>" (the two participants, sorted) for direct messages.
+
+History reads AND `visibility_filter(...)` into their query: a timestamp bound
+that rides on the (channel_id / sender_id, recipient_id, timestamp) indexes
+plus a `hidden_for` check, instead of a join against another collection.
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo import UpdateMany
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_BATCH_SIZE = 1000
+
+
+def dm_conversation_id(user_a: str, user_b: str) -> str:
+    a, b = sorted((user_a, user_b))
+    return f"dm:{a}|{b}"
+
+
+async def cleared_before(chat_db, user_id: str, conversation_id: str) -> Optional[datetime]:
+    row = await chat_db.ClearedConversations.find_one(
+        {"user_id": user_id, "conversation_id": conversation_id},
+        {"cleared_before": 1, "_id": 0}
+    )
+    return row.get("cleared_before") if row else None
+
+
+async def visibility_filter(chat_db, user_id: Optional[str], conversation_id: Optional[str] = None) -> dict:
+    """Query fragment matching the messages `user_id` has not hidden or cleared."""
+    if not user_id:
+        return {}
+    predicate = {"hidden_for": {"$ne": user_id}}
+    if conversation_id:
+        watermark = await cleared_before(chat_db, user_id, conversation_id)
+        if watermark:
+            predicate["timestamp"] = {"$gt": watermark}
+    return predicate
+
+
+async def hide_message(chat_db, user_id: str, message_id: str) -> bool:
+    """Hide one message for one user. Returns False if no such message exists."""
+    for collection in (chat_db.Channel_chat, chat_db.Direct_chat):
+        result = await collection.update_one({"id": message_id}, {"$addToSet": {"hidden_for": user_id}})
+        if result.matched_count:
+            return True
+    return False
+
+
+async def clear_conversation(chat_db, user_id: str, conversation_id: str) -> datetime:
+    """Hide everything in the conversation up to now for `user_id` (one write)."""
+    now = datetime.now(timezone.utc)
+    await chat_db.ClearedConversations.update_one(
+        {"user_id": user_id, "conversation_id": conversation_id},
+        {"$max": {"cleared_before": now}},
+        upsert=True
+    )
+    return now
+
+
+async def ensure_indexes(chat_db):
+    await chat_db.ClearedConversations.create_index(
+        [("user_id", 1), ("conversation_id", 1)], unique=True
+    )
+
+
+async def migrate_deleted_messages(chat_db) -> int:
+    """Fold legacy DeletedMessages rows into `hidden_for` and remove them.
+
+    Run once per database through migrations.run_once (see server.py).
+    Idempotent: $addToSet makes a re-run after a partial failure harmless."""
+    moved = 0
+    while True:
+        rows = await chat_db.DeletedMessages.find({}, {"user_id": 1, "message_id": 1}).limit(MIGRATION_BATCH_SIZE).to_list(length=MIGRATION_BATCH_SIZE)
+        if not rows:
+            break
+        by_user = {}
+        for row in rows:
+            if row.get("user_id") and row.get("message_id"):
+                by_user.setdefault(row["user_id"], []).append(row["message_id"])
+        ops = [UpdateMany({"id": {"$in": ids}}, {"$addToSet": {"hidden_for": user_id}}) for user_id, ids in by_user.items()]
+        if ops:
+            await chat_db.Channel_chat.bulk_write(ops, ordered=False)
+            await chat_db.Direct_chat.bulk_write(ops, ordered=False)
+        await chat_db.DeletedMessages.delete_many({"_id": {"$in": [row["_id"] for row in rows]}})
+        moved += len(rows)
+    if moved:
+        logger.info("Migrated %d DeletedMessages rows into hidden_for", moved)
+    return moved
@@ -0,0 +1,87 @@
+"""
+history.py
+----------
+Keyset pagination for chat history.
+
+A cursor is an opaque, URL-safe encoding of the (timestamp, id) of a message.
+`before=<cursor>` returns the page of messages immediately older than it,
+`after=<cursor>` the page immediately newer; with neither, the newest page.
+Each page is a range scan on the compound indexes created in
+`server.setup_chat_indexes`, so paging back through a long channel costs the
+same per page however far back it is.
+
+Callers AND the user's visibility predicate (see hidden.py) into `query`, so
+hidden and cleared messages are filtered inside the same range scan.
+"""
+import base64
+import binascii
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException, Response
+
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(message: dict) -> str:
+    ts = message.get("timestamp") or datetime.fromtimestamp(0, tz=timezone.utc)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    raw = f"{int(ts.timestamp() * 1000)}:{message.get('id', '')}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        millis, message_id = raw.split(":", 1)
+        return datetime.fromtimestamp(int(millis) / 1000, tz=timezone.utc), message_id
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _keyset(cursor: str, older: bool) -> dict:
+    ts, message_id = decode_cursor(cursor)
+    op = "$lt" if older else "$gt"
+    return {"$or": [
+        {"timestamp": {op: ts}},
+        {"timestamp": ts, "id": {op: message_id}},
+    ]}
+
+
+async def fetch_page(collection, query: dict, limit: int = 50, before: Optional[str] = None,
+                     after: Optional[str] = None) -> Tuple[List[dict], bool]:
+    """Return (messages oldest-first, has_more) for one page of `query`.
+
+    `has_more` means there are further messages in the paging direction
+    (older for the default/`before` pages, newer for `after` pages)."""
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'after', not both")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    older = not after
+    direction = -1 if older else 1
+    cursor = before or after
+
+    if cursor:
+        query = {"$and": [query, _keyset(cursor, older)]}
+    page = await collection.find(query, {"_id": 0}).sort(
+        [("timestamp", direction), ("id", direction)]
+    ).limit(limit + 1).to_list(length=limit + 1)
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    if older:
+        page.reverse()
+    return page, has_more
+
+
+def set_page_headers(response: Response, messages: List[dict], has_more: bool, newer_page: bool):
+    """Expose the cursors for the neighbouring pages without changing the list body."""
+    if not messages:
+        return
+    older_cursor, newer_cursor = encode_cursor(messages[0]), encode_cursor(messages[-1])
+    if has_more or newer_page:
+        response.headers["X-Next-Before"] = older_cursor
+    response.headers["X-Next-After"] = newer_cursor
+    response.headers["X-Has-More"] = "true" if has_more else "false"
+    response.headers["Access-Control-Expose-Headers"] = "X-Next-Before, X-Next-After, X-Has-More"
@@ -0,0 +1,106 @@
+"""
+membership.py
+-------------
+In-memory channel membership for chat fan-out.
+
+Keeps channel_id -> {member emails} and email -> (channel ids), derived from
+the employee directory: everyone active is in `general`, plus the department
+channel(s) and team channel for their team. The index is rebuilt whenever the
+directory reloads and patched per user on signup, team change, deactivation
+and deletion, so the send path never touches Mongo.
+"""
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from directory import EmployeeDirectory, employee_directory
+from models import DEPARTMENT_TEAMS, get_department_from_team
+
+logger = logging.getLogger(__name__)
+
+
+def dept_channel_id(dept: str) -> str:
+    return "dept-" + dept.lower().replace(' ', '-').replace('/', '-')
+
+
+def team_channel_id(team: str) -> str:
+    # Slashes are preserved: 'team-digital-marketing/networking'
+    return "team-" + team.lower().replace(' ', '-')
+
+
+def channel_ids_for(entry: Optional[dict]) -> List[str]:
+    """Channels a directory entry belongs to, in display order."""
+    channels = ["general"]
+    if not entry:
+        return channels
+    team = entry.get("team")
+    if team:
+        dept = get_department_from_team(team)
+        if dept:
+            channels.append(dept_channel_id(dept))
+    # Users whose stored department names a department directly also see it.
+    department = entry.get("department")
+    for dept in DEPARTMENT_TEAMS:
+        if department and dept.lower() == department.lower():
+            cid = dept_channel_id(dept)
+            if cid not in channels:
+                channels.append(cid)
+    if team:
+        channels.append(team_channel_id(team))
+    return channels
+
+
+def _canonical(channel_id: str) -> str:
+    """Accept 'team-digital-marketing-networking' for the slash-preserving id."""
+    return channel_id.replace('/', '-')
+
+
+class ChannelMembership:
+    def __init__(self, directory: EmployeeDirectory):
+        self.directory = directory
+        self._members: Dict[str, Set[str]] = {}
+        self._channels: Dict[str, Tuple[str, ...]] = {}
+        directory.subscribe(self._on_directory_change)
+
+    def rebuild(self):
+        members: Dict[str, Set[str]] = {}
+        channels: Dict[str, Tuple[str, ...]] = {}
+        for entry in self.directory.entries():
+            if not entry["email"] or not entry["active"]:
+                continue
+            ids = tuple(channel_ids_for(entry))
+            channels[entry["email"]] = ids
+            for cid in ids:
+                members.setdefault(_canonical(cid), set()).add(entry["email"])
+        self._members, self._channels = members, channels
+        logger.info("Channel membership index built: %d users, %d channels", len(channels), len(members))
+
+    def _on_directory_change(self, old: Optional[dict], new: Optional[dict]):
+        if old is None and new is None:
+            self.rebuild()
+            return
+        if old and old["email"]:
+            self._remove(old["email"])
+        if new and new["email"] and new["active"]:
+            self._add(new)
+
+    def _add(self, entry: dict):
+        ids = tuple(channel_ids_for(entry))
+        self._channels[entry["email"]] = ids
+        for cid in ids:
+            self._members.setdefault(_canonical(cid), set()).add(entry["email"])
+
+    def _remove(self, email: str):
+        for cid in self._channels.pop(email, ()):
+            members = self._members.get(_canonical(cid))
+            if members:
+                members.discard(email)
+
+    def members(self, channel_id: str) -> Set[str]:
+        """Member emails of a channel. The returned set must not be mutated."""
+        return self._members.get(_canonical(channel_id), set())
+
+    def channels(self, email: str) -> Optional[Tuple[str, ...]]:
+        return self._channels.get(email)
+
+
+channel_membership = ChannelMembership(employee_directory)
@@ -0,0 +1,40 @@
+"""
+migrate_attendance_daily.py
+---------------------------
+One-off migration of Attendance (one document per employee with a
+`dailyRecords` array) to AttendanceDaily (one document per employee-day).
+
+Idempotent: migrated source documents are flagged and skipped on the next
+run, and days already present in AttendanceDaily are never overwritten. The
+server also runs this once, at the first startup that finds no
+"attendance_daily" marker in the Migrations collection (see migrations.py);
+the script is for migrating ahead of a deploy or rebuilding the monthly
+rollups afterwards.
+
+    python migrate_attendance_daily.py            # migrate
+    python migrate_attendance_daily.py --rollups  # migrate, then rebuild every month's rollup
+"""
+import asyncio
+import logging
+import sys
+
+import attendance_rollup
+from attendance_store import DAILY, ensure_indexes
+
+
+async def main(rebuild_rollups: bool):
+    await ensure_indexes()
+    migrated = await attendance_rollup.migrate_legacy_attendance()
+    print(f"Migrated {migrated} employee documents; AttendanceDaily now holds {await DAILY.count_documents({})} days")
+    if rebuild_rollups:
+        months = await DAILY.aggregate([
+            {"$group": {"_id": {"year": {"$year": "$date"}, "month": {"$month": "$date"}}}}
+        ]).to_list(length=None)
+        for row in sorted(months, key=lambda r: (r["_id"]["year"], r["_id"]["month"])):
+            count = await attendance_rollup.rebuild_month(row["_id"]["year"], row["_id"]["month"])
+            print(f"Rebuilt {row['_id']['year']:04d}-{row['_id']['month']:02d}: {count} employees")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main("--rollups" in sys.argv[1:]))
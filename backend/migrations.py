@@ -0,0 +1,86 @@
+"""
+migrations.py
+-------------
+Run-once data migrations started from the server's startup hook.
+
+Every worker runs the startup hook, so each migration is claimed through a
+marker document in the `Migrations` collection of the database it migrates:
+
+    {_id: <name>, state: "running" | "done", owner, started_at, finished_at, result}
+
+The worker that inserts the marker runs the migration; every other worker,
+and every later startup, sees the marker and skips it. A failed run is
+logged and its marker removed, so the next startup retries. A marker left in
+"running" by a worker that died is taken over after MIGRATION_LOCK_MINUTES.
+
+`start` runs a migration in the background and keeps a reference to the task
+until it finishes.
+
+Config (.env):
+    MIGRATION_LOCK_MINUTES=30
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Set
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+LOCK_TIMEOUT = timedelta(minutes=float(os.environ.get("MIGRATION_LOCK_MINUTES", "30")))
+
+_tasks: Set[asyncio.Task] = set()
+
+
+async def _claim(db, name: str, owner: str) -> bool:
+    now = datetime.now(timezone.utc)
+    try:
+        await db.Migrations.insert_one({"_id": name, "state": "running", "owner": owner, "started_at": now})
+        return True
+    except DuplicateKeyError:
+        pass
+    result = await db.Migrations.update_one(
+        {"_id": name, "state": "running", "started_at": {"$lt": now - LOCK_TIMEOUT}},
+        {"$set": {"owner": owner, "started_at": now}}
+    )
+    if result.modified_count:
+        logger.warning("Migration %s: taking over a run that never finished", name)
+    return bool(result.modified_count)
+
+
+async def run_once(db, name: str, migrate: Callable[[], Awaitable]) -> bool:
+    """Run `migrate` unless it already ran, or is running, against `db`.
+    Returns True if this call ran it successfully. Failures are logged."""
+    owner = uuid.uuid4().hex
+    if not await _claim(db, name, owner):
+        return False
+    try:
+        result = await migrate()
+    except Exception as e:
+        logger.error("Migration %s failed; it will be retried on the next startup: %s", name, e)
+        await db.Migrations.delete_one({"_id": name, "owner": owner})
+        return False
+    await db.Migrations.update_one(
+        {"_id": name, "owner": owner},
+        {"$set": {"state": "done", "finished_at": datetime.now(timezone.utc),
+                  "result": result if isinstance(result, (int, str)) else None}}
+    )
+    logger.info("Migration %s done: %s", name, result)
+    return True
+
+
+def _finished(task: asyncio.Task):
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Migration task %s crashed: %r", task.get_name(), task.exception())
+
+
+def start(db, name: str, migrate: Callable[[], Awaitable]) -> asyncio.Task:
+    """`run_once` in the background."""
+    task = asyncio.create_task(run_once(db, name, migrate), name=f"migration:{name}")
+    _tasks.add(task)
+    task.add_done_callback(_finished)
+    return task
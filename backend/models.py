@@ -12,6 +12,8 @@ from fastapi import Header, HTTPException
 from pydantic import BaseModel, Field, field_validator
 
 from database import stc_db
+from directory import employee_directory
+from auth import bearer_claims, load_principal
 
 ist_tz = timezone(timedelta(hours=5, minutes=30))
 
@@ -56,21 +58,12 @@ def serialize_document(obj):
         return obj
 
 async def get_user_info_with_collection(stc_db, user_id: str, include_hash: bool = False) -> tuple[Optional[dict], Optional[any]]:
-    all_collection_names = await stc_db.list_collection_names()
-    team_collection_names = [name for name in all_collection_names if not name.startswith('system.')]
-    projection = None if include_hash else {"password_hash": 0}
-    decoded_user_id = urllib.parse.unquote(user_id)
-    search_regex = re.compile(f"^{re.escape(decoded_user_id)}$", re.IGNORECASE)
-
-    for collection_name in team_collection_names:
-        try:
-            collection = stc_db[collection_name]
-            user = await collection.find_one({"email": search_regex}, projection)
-            if user:
-                return user, collection
-        except Exception as e:
-            logging.warning(f"Could not search in collection {collection_name}: {e}")
-    return None, None
+    """Return (user, team collection) for an email or id via the employee directory."""
+    try:
+        return await employee_directory.fetch(user_id, include_hash=include_hash, fields=("email", "id"))
+    except Exception as e:
+        logging.warning(f"Directory lookup failed for {user_id}: {e}")
+        return None, None
 
 async def get_user_info(stc_db, user_id: str) -> Optional[dict]:
     user, _ = await get_user_info_with_collection(stc_db, user_id)
@@ -80,26 +73,9 @@ async def get_current_admin_user(authorization: Optional[str] = Header(None, ali
     if not authorization:
         raise HTTPException(status_code=403, detail="Not an administrator")
 
-    if not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token_str = authorization.split(" ")[1]
-    try:
-        decoded_token = base64.b64decode(token_str).decode('utf-8')
-        user_data_from_token = json.loads(decoded_token)
-        user_email_from_token = user_data_from_token.get("email")
-    except Exception:
-        raise HTTPException(status_code=401, detail="Invalid token format.")
-
-    if not user_email_from_token:
-        raise HTTPException(status_code=401, detail="Invalid token: email missing.")
-
-    user, _ = await get_user_info_with_collection(stc_db, user_email_from_token)
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found or token is invalid")
-
-    designation = user.get("designation", "").lower().strip()
-    if user.get("isAdmin") or "admin" in designation or "director" in designation:
+    claims = bearer_claims(authorization)
+    user, is_admin = await load_principal(claims)
+    if is_admin:
         return user
 
     raise HTTPException(status_code=403, detail="User is not an administrator")
@@ -118,23 +94,8 @@ async def get_current_user(
     if not authorization: 
         raise HTTPException(status_code=401, detail="Authorization header missing")
 
-    if not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token_str = authorization.split(" ")[1]
-    try:
-        decoded_token = base64.b64decode(token_str).decode('utf-8')
-        user_data_from_token = json.loads(decoded_token)
-        user_email_from_token = user_data_from_token.get("email")
-    except Exception:
-        raise HTTPException(status_code=401, detail="Invalid token format.")
-
-    if not user_email_from_token:
-        raise HTTPException(status_code=401, detail="Invalid token: email missing.")
-
-    user, _ = await get_user_info_with_collection(stc_db, user_email_from_token)
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found or token is invalid")
+    claims = bearer_claims(authorization)
+    user, _ = await load_principal(claims)
     return user
 # --- Pydantic Models ---
 
@@ -0,0 +1,216 @@
+"""
+presence.py
+-----------
+Coalesced presence (online / busy / offline) for the chat.
+
+Status changes are recorded immediately but published in batches: at most
+once per FLUSH_INTERVAL the pending changes are folded into the published
+state, the presence version is bumped, and one `presence_diff` frame
+
+    {"type": "presence_diff", "version": "3f9c2a1b:42", "changes": {"a@x": "online", ...}}
+
+goes to every socket. A 9:30 a.m. login wave therefore costs a handful of
+frames per client instead of one frame per login per client.
+
+The published state is versioned: `snapshot()` returns it with its version,
+and `changes_since(version)` returns only what changed after that, from a
+bounded log of recent diffs. A version is "<epoch>:<n>": the counter n is
+local to one worker process, so it is qualified by that process's epoch (its
+worker id). changes_since returns None, meaning the client should re-fetch
+the snapshot, for a version from another worker or an earlier process, and
+once the log no longer reaches back that far.
+
+Whether a user is connected comes from the workers holding their sockets
+(the "sources"). Each worker re-announces its full set of connected users
+every HEARTBEAT_INTERVAL (`sync_source`); a worker not heard from for
+SOURCE_TTL (it crashed or was killed) is dropped by `expire`, so its users
+go offline instead of staying online forever. Busy is the user's own choice,
+not a worker's: it is an override kept per user, shown while they have any
+connection and cleared when the last one goes.
+
+Config (.env):
+    PRESENCE_HEARTBEAT_SECONDS=15
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.25
+DIFF_LOG_SIZE = 500
+OFFLINE = "offline"
+HEARTBEAT_INTERVAL = float(os.environ.get("PRESENCE_HEARTBEAT_SECONDS", "15"))
+SOURCE_TTL = 3 * HEARTBEAT_INTERVAL
+
+
+class PresenceService:
+    def __init__(self, broadcast: Callable[[str], None], epoch: Optional[str] = None,
+                 flush_interval: float = FLUSH_INTERVAL, log_size: int = DIFF_LOG_SIZE):
+        self._broadcast = broadcast
+        self.flush_interval = flush_interval
+        self.epoch = epoch or uuid.uuid4().hex[:12]
+        self.version = 0
+        # Latest known status per user (offline users are absent).
+        self.statuses: Dict[str, str] = {}
+        # Workers holding a connection for each user, and the reverse index.
+        self._sources: Dict[str, Set[str]] = {}
+        self._by_source: Dict[str, Set[str]] = {}
+        self._seen: Dict[str, float] = {}     # source -> monotonic time last heard from
+        self._overrides: Dict[str, str] = {}  # user -> "busy"
+        # Status per user as of `version`.
+        self._published: Dict[str, str] = {}
+        self._pending: Dict[str, str] = {}
+        self._log: Deque[Tuple[int, Dict[str, str]]] = deque(maxlen=log_size)
+        self._flush_task: Optional[asyncio.Task] = None
+        self._snapshot_cache: Optional[Tuple[tuple, List[Dict]]] = None
+
+    def get(self, user_id: str) -> str:
+        return self.statuses.get(user_id, OFFLINE)
+
+    def set(self, user_id: str, status: str, source: str = "local"):
+        """Record that `source` (a worker id) has the user connected
+        (any status but offline) or no longer has them."""
+        self._seen[source] = time.monotonic()
+        if status == OFFLINE:
+            self._detach(user_id, source)
+        else:
+            self._sources.setdefault(user_id, set()).add(source)
+            self._by_source.setdefault(source, set()).add(user_id)
+        self._recompute(user_id)
+
+    def set_override(self, user_id: str, status: Optional[str]):
+        """The user's own choice: "busy", or None to go back to online."""
+        if status == "busy":
+            self._overrides[user_id] = status
+        else:
+            self._overrides.pop(user_id, None)
+        self._recompute(user_id)
+
+    def sync_source(self, source: str, user_ids: Iterable[str], overrides: Optional[Dict[str, str]] = None):
+        """Heartbeat: `source` holds connections for exactly `user_ids` now.
+        `overrides` lets a freshly started worker learn who is busy."""
+        self._seen[source] = time.monotonic()
+        current = set(user_ids)
+        previous = self._by_source.get(source, set())
+        for user_id in previous - current:
+            self._detach(user_id, source)
+            self._recompute(user_id)
+        for user_id in current - previous:
+            self._sources.setdefault(user_id, set()).add(source)
+            self._by_source.setdefault(source, set()).add(user_id)
+            self._recompute(user_id)
+        for user_id in overrides or {}:
+            if user_id in current and user_id not in self._overrides:
+                self._overrides[user_id] = "busy"
+                self._recompute(user_id)
+        if not current:
+            self._seen.pop(source, None)
+
+    def expire(self, ttl: float = SOURCE_TTL) -> List[str]:
+        """Drop sources not heard from within `ttl` seconds. Returns them."""
+        cutoff = time.monotonic() - ttl
+        stale = [source for source, seen in self._seen.items() if seen < cutoff]
+        for source in stale:
+            del self._seen[source]
+            for user_id in list(self._by_source.get(source, ())):
+                self._detach(user_id, source)
+                self._recompute(user_id)
+            logger.warning("Presence source %s timed out; its users are now offline", source)
+        return stale
+
+    def _detach(self, user_id: str, source: str):
+        sources = self._sources.get(user_id)
+        if sources is not None:
+            sources.discard(source)
+            if not sources:
+                del self._sources[user_id]
+        users = self._by_source.get(source)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self._by_source[source]
+
+    def overrides_for(self, user_ids: Iterable[str]) -> Dict[str, str]:
+        return {user_id: self._overrides[user_id] for user_id in user_ids if user_id in self._overrides}
+
+    def _recompute(self, user_id: str):
+        if user_id not in self._sources:
+            self._overrides.pop(user_id, None)   # busy lasts as long as a connection
+            status = OFFLINE
+        else:
+            status = self._overrides.get(user_id, "online")
+        if self.statuses.get(user_id, OFFLINE) == status and user_id not in self._pending:
+            return
+        if status == OFFLINE:
+            self.statuses.pop(user_id, None)
+        else:
+            self.statuses[user_id] = status
+        self._pending[user_id] = status
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self.flush()
+
+    def flush(self):
+        pending, self._pending = self._pending, {}
+        changes = {user_id: status for user_id, status in pending.items()
+                   if self._published.get(user_id, OFFLINE) != status}
+        if not changes:
+            return
+        for user_id, status in changes.items():
+            if status == OFFLINE:
+                self._published.pop(user_id, None)
+            else:
+                self._published[user_id] = status
+        self.version += 1
+        self._log.append((self.version, changes))
+        frame = json.dumps({"type": "presence_diff", "version": self.version_tag, "changes": changes})
+        try:
+            self._broadcast(frame)
+        except Exception as e:
+            logger.error("Presence broadcast failed: %s", e)
+
+    # --- reads ---
+
+    @property
+    def version_tag(self) -> str:
+        """The current version as handed to clients: "<epoch>:<n>"."""
+        return f"{self.epoch}:{self.version}"
+
+    def snapshot(self, user_ids: Iterable[str], cache_key=None) -> Tuple[str, List[Dict]]:
+        """Published status of every user in `user_ids` (offline by default).
+
+        The list is rebuilt only when the presence version or `cache_key`
+        (e.g. the directory version) changes."""
+        key = (self.version, cache_key)
+        if self._snapshot_cache is None or self._snapshot_cache[0] != key:
+            statuses = [{"user_id": user_id, "status": self._published.get(user_id, OFFLINE)} for user_id in user_ids]
+            self._snapshot_cache = (key, statuses)
+        return self.version_tag, self._snapshot_cache[1]
+
+    def changes_since(self, version_tag: str) -> Optional[Dict[str, str]]:
+        """Merged changes after `version_tag`, or None if it is not one of this
+        process's versions or the log does not go back that far."""
+        epoch, _, counter = (version_tag or "").rpartition(":")
+        if epoch != self.epoch or not counter.isdigit():
+            return None
+        version = int(counter)
+        if version == self.version:
+            return {}
+        if version > self.version:
+            return None
+        if not self._log or self._log[0][0] > version + 1:
+            return None
+        merged: Dict[str, str] = {}
+        for entry_version, changes in self._log:
+            if entry_version > version:
+                merged.update(changes)
+        return merged
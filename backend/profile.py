@@ -16,25 +16,16 @@ from models import (
     AdminPasswordReset, Employee, EmployeeCreate, get_user_info_with_collection, get_current_admin_user,
     serialize_document, TEAMS
 ) 
+from directory import employee_directory
+from auth import bearer_claims, issue_token, principal_cache, revoke_sessions_update
 from chat import manager
 
 router = APIRouter()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 @router.post("/login")
 async def login(request: LoginRequest):
-    # Search across all team collections by id or email
-    collection_names = await stc_db.list_collection_names()
-    team_collections = [stc_db[name] for name in collection_names]
-    user = None
-    for collection in team_collections:
-        # Try by id first
-        user = await collection.find_one({"id": request.identifier})
-        if user:
-            break
-        # Then by email
-        user = await collection.find_one({"email": request.identifier})
-        if user:
-            break
+    # Resolve by id first, then by email, through the employee directory
+    user, _ = await employee_directory.fetch(request.identifier, include_hash=True, fields=("id", "email"))
 
     if not user:
         raise HTTPException(status_code=400, detail="Invalid credentials")
@@ -53,8 +44,11 @@ async def login(request: LoginRequest):
     user_id = user.get("email") or user.get("id")
     await manager.broadcast_status(user_id, "online")
 
-    user_data = {k: v for k, v in user.items() if k != "password_hash"}    
+    user_data = {k: v for k, v in user.items() if k not in ("password_hash", "tokens_valid_after")}
     user_data = serialize_document(user_data)
+    # Signed session token; the client sends it back (directly or inside the stored user object).
+    user_data["access_token"] = issue_token(user)
+    user_data["token_type"] = "bearer"
     
     # Ensure profilePicture is included, even if it's null
     if 'profilePicture' not in user_data:
@@ -76,13 +70,7 @@ async def signup(request: SignupRequest):
         raise HTTPException(status_code=400, detail=f"Invalid team. Must be one of: {', '.join(TEAMS)}")
 
     # Check existence across all team collections
-    collection_names = await stc_db.list_collection_names()
-    team_collections = [stc_db[name] for name in collection_names]
-    existing = None
-    for collection in team_collections:
-        existing = await collection.find_one({"email": request.email})
-        if existing:
-            break
+    existing = await employee_directory.resolve(request.email, fields=("email",))
 
     if existing:
         raise HTTPException(status_code=400, detail="User already exists")
@@ -111,16 +99,10 @@ async def signup(request: SignupRequest):
 
         # 2. Find the reporting manager for the new user's team
         team_reporting_manager = None
-        all_collections = await stc_db.list_collection_names()
-        for name in all_collections:
-            collection = stc_db[name]
+        for entry in employee_directory.entries():
             # Find a user in the same team with the designation of "reporting manager"
-            manager = await collection.find_one({
-                "team": request.team,
-                "designation": {"$regex": "reporting manager", "$options": "i"}
-            })
-            if manager:
-                team_reporting_manager = manager.get("name")
+            if entry["team"] == request.team and "reporting manager" in entry["designation"].lower():
+                team_reporting_manager = entry["name"]
                 break
         
         # 3. Assign reviewer based on designation
@@ -166,7 +148,9 @@ async def signup(request: SignupRequest):
     
     # Insert into team-specific collection (auto-creates if missing)
     team_collection = stc_db[sanitize_team(request.team)]
-    await team_collection.insert_one(employee_data.model_dump())
+    employee_doc = employee_data.model_dump()
+    await team_collection.insert_one(employee_doc)
+    employee_directory.put(employee_doc, team_collection.name)
 
     return {"message": "User created successfully"}
 
@@ -206,6 +190,8 @@ async def update_user_profile(email: str, profile_data: UserProfileUpdate):
         )
 
     final_email_to_find = new_email or email
+    await employee_directory.refresh(final_email_to_find, collection, previous_key=email)
+    principal_cache.invalidate(email)
     updated_user = await collection.find_one(
         {"email": re.compile(f"^{re.escape(final_email_to_find)}$", re.IGNORECASE)},
         {"_id": 0, "password_hash": 0}
@@ -214,29 +200,8 @@ async def update_user_profile(email: str, profile_data: UserProfileUpdate):
 
 @router.put("/users/me/reset-password")
 async def user_reset_password(request: PasswordChangeRequest = Body(...), authorization: str = Header(..., alias="Authorization")):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-
-    token_str = authorization.split(" ")[1]
-    try:
-        decoded_token_bytes = base64.b64decode(token_str)
-        decoded_token = decoded_token_bytes.decode('utf-8')
-        user_data = json.loads(decoded_token)
-        user_email = user_data.get("email")
-        logging.info(f"Successfully decoded token for user: {user_email}")
-    except (base64.binascii.Error, UnicodeDecodeError) as e:
-        logging.error(f"Token decoding failed (Base64 or UTF-8 issue) for token: {token_str[:50]}... Error: {e}")
-        raise HTTPException(status_code=400, detail="Invalid token format (decoding failed).")
-    except json.JSONDecodeError as e:
-        logging.error(f"Token JSON parsing failed for token: {decoded_token[:50]}... Error: {e}")
-        raise HTTPException(status_code=400, detail="Invalid token format (JSON parsing failed).")
-    except Exception as e: # Catch any other unexpected errors during token processing
-        logging.error(f"Unexpected error during token processing: {e}", exc_info=True)
-        raise HTTPException(status_code=400, detail="Invalid token.")
-
-    if not user_email:
-        logging.warning(f"Invalid token: 'email' field missing from decoded user data: {user_data}")
-        raise HTTPException(status_code=400, detail="Invalid token: no email found")
+    claims = bearer_claims(authorization)
+    user_email = claims["sub"]
 
     user, collection = await get_user_info_with_collection(stc_db, user_email, include_hash=True)
     if not user or collection is None:
@@ -251,9 +216,11 @@ async def user_reset_password(request: PasswordChangeRequest = Body(...), author
     new_hash = pwd_context.hash(request.new_password)
     await collection.update_one(
         {"email": re.compile(f"^{re.escape(user_email)}$", re.IGNORECASE)},
-        {"$set": {"password_hash": new_hash}}
+        {"$set": {"password_hash": new_hash, **revoke_sessions_update()}}
     )
-    return {"message": "Password reset successful"}
+    principal_cache.invalidate(user_email)
+    # Every other session is now revoked; hand this one a fresh token.
+    return {"message": "Password reset successful", "access_token": issue_token(user)}
 
 @router.get("/employees")
 async def get_all_employees():
@@ -545,13 +512,8 @@ async def deactivate_self( authorization: str = Header(..., alias="Authorization
     The user is identified via their Authorization token.
     """
     try:
-        if not authorization or not authorization.startswith("Bearer "):
-            raise HTTPException(status_code=401, detail="Not authenticated")
-        
-        token_str = authorization.split(" ")[1]
-        decoded_token = base64.b64decode(token_str).decode('utf-8')
-        user_data_from_token = json.loads(decoded_token)
-        user_email = user_data_from_token.get("email")
+        claims = bearer_claims(authorization)
+        user_email = claims.get("sub")
 
         if not user_email:
             raise HTTPException(status_code=401, detail="Invalid token: user email missing.")
@@ -565,10 +527,12 @@ async def deactivate_self( authorization: str = Header(..., alias="Authorization
         # Soft delete: Mark the user as inactive instead of deleting them.
         result = await collection.update_one(
             {"email": re.compile(f"^{re.escape(user_email)}$", re.IGNORECASE)},
-            {"$set": {"active": False}}
+            {"$set": {"active": False, **revoke_sessions_update()}}
         )
 
         if result.modified_count > 0:
+            await employee_directory.refresh(user_email, collection)
+            principal_cache.invalidate(user_email)
             logging.info(f"User {user_email} has deactivated their own account.")
             return {"message": "Your account has been successfully deactivated."}
         
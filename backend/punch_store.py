@@ -0,0 +1,260 @@
+"""
+punch_store.py
+--------------
+Incremental ingest of eSSL punches into `biometric_punches`.
+
+Every dashboard refresh used to re-pull the whole requested range (a day,
+or up to 92 days for the attendance views) from every device and re-upsert
+each punch with its own round trip. Now each device has a document in
+`biometric_device_watermarks`:
+
+    {serial, synced_from, synced_to, last_punch}
+
+[synced_from, synced_to] is the contiguous span already pulled from that
+device and `last_punch` the newest punch seen. `pull_delta(start, end)` only
+asks a device for what is missing: anything before synced_from, and anything
+after its high-water mark (the earlier of last_punch and synced_to less
+ESSL_DELTA_OVERLAP_MINUTES, for punches a device uploads late). A past range
+that is already covered costs no device call at all; refreshing today's view
+costs one short call per device. Callers then read the range from Mongo.
+Only one pull runs at a time. A refresh that arrives meanwhile and needs
+nothing beyond the windows that pull is fetching returns at once with the
+devices' last known reports and reads what is already stored; one that needs
+more waits for the pull and then works out its own windows.
+
+New punches are written with a single unordered bulk_write of
+$setOnInsert upserts on (user_id, punch_time, serial), so nothing already
+stored is rewritten.
+
+Per-(empCode, day) summaries (see biometric_summary.py) are materialized into
+`biometric_daily` for the days that received new punches, here and in the
+office agent. `daily_summaries` serves the attendance views from them: one
+aggregation gives each employee-day's punch signature, and only days whose
+stored signature differs (or is missing) are rebuilt from raw punches.
+
+Config (.env):
+    ESSL_DELTA_OVERLAP_MINUTES=10
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from database import attendance_db
+from biometric_summary import Directions, day_bounds_utc, day_key, punch_signature, summarize_punches
+from essl_service import ESSLConfigError, get_device_punches_async, list_devices
+
+logger = logging.getLogger(__name__)
+
+PUNCHES = attendance_db["biometric_punches"]
+WATERMARKS = attendance_db["biometric_device_watermarks"]
+SUMMARIES = attendance_db["biometric_daily"]
+
+DELTA_OVERLAP = timedelta(minutes=float(os.environ.get("ESSL_DELTA_OVERLAP_MINUTES", "10")))
+MAX_RESUME_LOOKBACK = timedelta(days=1)
+
+# One pull at a time; `_inflight` holds the windows the running pull fetches
+# per device. Windows ending up to INFLIGHT_SLACK after a running pull's count
+# as covered (they differ only by when "now" was read).
+_pull_lock = asyncio.Lock()
+_inflight: Dict[str, list] = {}
+_last_reports: Dict[str, dict] = {}
+INFLIGHT_SLACK = timedelta(minutes=1)
+
+
+def _utc(dt: Optional[datetime]) -> Optional[datetime]:
+    if dt is not None and dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)  # Mongo returns naive UTC
+    return dt
+
+
+async def ensure_indexes():
+    await WATERMARKS.create_index("serial", unique=True)
+    await SUMMARIES.create_index([("emp_code", 1), ("day", 1)], unique=True)
+    await SUMMARIES.create_index([("day", 1), ("emp_code", 1)])
+
+
+async def store_punches(punches: List[dict]) -> List[dict]:
+    """Insert punches not stored yet. Returns the ones that were new."""
+    ops = [UpdateOne(
+        {"user_id": p["user_id"], "punch_time": p["punch_time"], "serial": p.get("serial", "")},
+        {"$setOnInsert": {"user_id": p["user_id"], "punch_time": p["punch_time"],
+                          "serial": p.get("serial", ""), "device": p.get("device", ""),
+                          "extra": p.get("extra", []), "source": "essl"}},
+        upsert=True) for p in punches]
+    if not ops:
+        return []
+    try:
+        result = await PUNCHES.bulk_write(ops, ordered=False)
+        inserted = result.upserted_ids.keys()
+    except BulkWriteError as e:
+        # Duplicate-key races with a concurrent writer (e.g. the office agent)
+        inserted = [u["index"] for u in e.details.get("upserted", [])]
+    return [punches[i] for i in inserted]
+
+
+async def _load_watermarks() -> Dict[str, dict]:
+    rows = await WATERMARKS.find({}, {"_id": 0}).to_list(length=None)
+    for row in rows:
+        for key in ("synced_from", "synced_to", "last_punch"):
+            row[key] = _utc(row.get(key))
+    return {row["serial"]: row for row in rows}
+
+
+def _windows(mark: Optional[dict], start: datetime, end: datetime) -> list:
+    """Time windows still to pull from one device for [start, end]. Windows
+    reach back to the covered span so it stays contiguous."""
+    if not mark or not mark.get("synced_from") or not mark.get("synced_to"):
+        return [(start, end)]
+    windows = []
+    if start < mark["synced_from"]:
+        windows.append((start, mark["synced_from"]))
+    if end > mark["synced_to"]:
+        # Resume at the high-water mark: the newest punch seen, or a little
+        # before synced_to for punches the device uploaded late.
+        resume = mark["synced_to"] - DELTA_OVERLAP
+        if mark.get("last_punch"):
+            resume = max(min(resume, mark["last_punch"]), mark["synced_to"] - MAX_RESUME_LOOKBACK)
+        windows.append((resume, end))
+    return windows
+
+
+async def pull_delta(start: datetime, end: datetime) -> List[dict]:
+    """Bring the stored punches for [start, end] up to date from the devices.
+    Returns the device reports; raises ESSLConfigError / ESSLRequestError like
+    essl_service.get_all_punches."""
+    end = min(end, datetime.now(timezone.utc))
+    if end <= start:
+        return []
+    devices = list_devices()
+    if not devices:
+        raise ESSLConfigError("No devices configured. Set ESSL_DEVICES or ESSL_API_URL+ESSL_SERIALS.")
+    if _pull_lock.locked():
+        marks = await _load_watermarks()
+        windows = {d["serial"]: _windows(marks.get(d["serial"]), start, end) for d in devices}
+        if _covered(windows, _inflight):
+            return [_in_progress_report(d) for d in devices]
+    async with _pull_lock:
+        marks = await _load_watermarks()
+        windows = {d["serial"]: _windows(marks.get(d["serial"]), start, end) for d in devices}
+        cached = [{"serial": d["serial"], "device": d["name"], "ok": True, "count": 0, "cached": True}
+                  for d in devices if not windows[d["serial"]]]
+        if not any(windows.values()):
+            return cached
+        _inflight.update(windows)
+        try:
+            reports = await _pull(windows, marks, start, end)
+        finally:
+            _inflight.clear()
+        return reports + cached
+
+
+async def _pull(windows: Dict[str, list], marks: Dict[str, dict], start: datetime, end: datetime) -> List[dict]:
+    """Fetch `windows` from the devices, store and materialize what is new,
+    and advance the watermarks of the devices that answered."""
+    punches, reports = await get_device_punches_async(windows)
+    new = await store_punches(punches)
+    await materialize(summary_keys(new))
+
+    newest: Dict[str, datetime] = {}
+    for p in punches:
+        serial = p.get("serial", "")
+        if serial not in newest or p["punch_time"] > newest[serial]:
+            newest[serial] = p["punch_time"]
+    for report in reports:
+        _last_reports[report["serial"]] = report
+        if not report.get("ok"):
+            continue  # leave the watermark so the next pull retries this device
+        serial = report["serial"]
+        mark = marks.get(serial) or {}
+        synced_from = min(start, mark["synced_from"]) if mark.get("synced_from") else start
+        synced_to = max(end, mark["synced_to"]) if mark.get("synced_to") else end
+        update = {"$set": {"synced_from": synced_from, "synced_to": synced_to}}
+        if serial in newest:
+            update["$max"] = {"last_punch": newest[serial]}
+        await WATERMARKS.update_one({"serial": serial}, update, upsert=True)
+    logger.info("eSSL delta pull: %d punches, %d new, windows %s", len(punches), len(new),
+                {s: len(w) for s, w in windows.items() if w})
+    return reports
+
+
+def _covered(windows: Dict[str, list], inflight: Dict[str, list]) -> bool:
+    """True if every window is inside one the running pull is fetching."""
+    return all(any(lo <= start and end <= hi + INFLIGHT_SLACK for lo, hi in inflight.get(serial, ()))
+               for serial, wanted in windows.items() for start, end in wanted)
+
+
+def _in_progress_report(device: dict) -> dict:
+    """Report for a device another request is pulling right now: its last
+    known state, with nothing fetched by this request."""
+    last = _last_reports.get(device["serial"]) or {"ok": True}
+    report = {"serial": device["serial"], "device": device["name"], "ok": last["ok"], "count": 0,
+              "cached": True, "in_progress": True}
+    if not last["ok"]:
+        report["error"] = last.get("error", "")
+    return report
+
+
+_directions = Directions.from_env()
+
+
+def summary_keys(punches: Iterable[dict]) -> Set[Tuple[str, str]]:
+    return {(str(p["user_id"]), day_key(p["punch_time"])) for p in punches}
+
+
+async def _rebuild(keys: Set[Tuple[str, str]]) -> Dict[Tuple[str, str], dict]:
+    """Recompute and store the summaries of the given (emp_code, day) pairs."""
+    if not keys:
+        return {}
+    days = sorted({day for _, day in keys})
+    start, end = day_bounds_utc(days[0])[0], day_bounds_utc(days[-1])[1]
+    rows = await PUNCHES.find(
+        {"user_id": {"$in": sorted({code for code, _ in keys})}, "punch_time": {"$gte": start, "$lte": end}},
+        {"_id": 0, "user_id": 1, "punch_time": 1, "serial": 1, "device": 1}
+    ).to_list(length=None)
+    summaries = {k: v for k, v in summarize_punches(rows, _directions).items() if k in keys}
+    if summaries:
+        await SUMMARIES.bulk_write([ReplaceOne({"emp_code": code, "day": day}, doc, upsert=True)
+                                    for (code, day), doc in summaries.items()], ordered=False)
+    return summaries
+
+
+async def materialize(keys: Set[Tuple[str, str]]) -> int:
+    """Rebuild the summaries for days whose punches just changed."""
+    return len(await _rebuild(set(keys)))
+
+
+async def _punch_signatures(start: datetime, end: datetime, codes: Optional[List[str]]) -> Dict[Tuple[str, str], str]:
+    match = {"punch_time": {"$gte": start, "$lte": end}}
+    if codes is not None:
+        match["user_id"] = {"$in": codes}
+    rows = await PUNCHES.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {"u": "$user_id", "d": {"$dateToString": {"format": "%Y-%m-%d", "date": "$punch_time", "timezone": "+05:30"}}},
+            "n": {"$sum": 1}, "first": {"$min": "$punch_time"}, "last": {"$max": "$punch_time"},
+        }},
+    ]).to_list(length=None)
+    return {(str(r["_id"]["u"]), r["_id"]["d"]): punch_signature(r["n"], r["first"], r["last"]) for r in rows}
+
+
+async def daily_summaries(start: datetime, end: datetime,
+                          codes: Optional[List[str]] = None) -> Dict[Tuple[str, str], dict]:
+    """{(emp_code, day): summary} for every employee-day with punches in
+    [start, end] (IST day bounds), rebuilding only stale days."""
+    current = await _punch_signatures(start, end, codes)
+    query = {"day": {"$gte": day_key(start), "$lte": day_key(end)}}
+    if codes is not None:
+        query["emp_code"] = {"$in": codes}
+    stored = {(doc["emp_code"], doc["day"]): doc
+              async for doc in SUMMARIES.find(query, {"_id": 0})}
+    stale = {key for key, signature in current.items()
+             if stored.get(key, {}).get("signature") != signature}
+    if stale:
+        stored.update(await _rebuild(stale))
+        logger.info("Rebuilt %d of %d biometric day summaries", len(stale), len(current))
+    return {key: stored[key] for key in current if key in stored}
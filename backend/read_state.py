@@ -0,0 +1,117 @@
+"""
+read_state.py
+-------------
+Per-user read watermarks for channels and batching of read events.
+
+Marking a channel read used to `$addToSet read_by` on every message in the
+channel's history. Channel read state is now one document per
+(user_id, conversation_id) in ReadWatermarks holding `read_until`; a channel
+message is unread for a user when it is newer than their watermark (and, for
+messages from before watermarks existed, not in its legacy `read_by`).
+Direct messages keep `read_by`, which only ever touches the ids the client
+names and drives the sender's "read" ticks.
+
+Clients emit `mark_messages_read` on every scroll and focus change, so the
+websocket handler feeds them to a `ReadBatcher`: events for the same
+(user, conversation) arriving within FLUSH_DELAY seconds are merged and
+written once.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+FLUSH_DELAY = 0.3
+
+
+async def ensure_indexes(chat_db):
+    await chat_db.ReadWatermarks.create_index([("user_id", 1), ("conversation_id", 1)], unique=True)
+
+
+async def load_read_watermarks(chat_db, user_id: str, conversation_ids: List[str]) -> Dict[str, datetime]:
+    rows = await chat_db.ReadWatermarks.find(
+        {"user_id": user_id, "conversation_id": {"$in": conversation_ids}},
+        {"conversation_id": 1, "read_until": 1, "_id": 0}
+    ).to_list(length=None)
+    return {row["conversation_id"]: row["read_until"] for row in rows if row.get("read_until")}
+
+
+async def advance_read_watermark(chat_db, user_id: str, conversation_id: str, until: datetime):
+    await chat_db.ReadWatermarks.update_one(
+        {"user_id": user_id, "conversation_id": conversation_id},
+        {"$max": {"read_until": until}},
+        upsert=True
+    )
+
+
+def unread_channel_match(user_id: str, channel_ids: List[str], watermarks: Dict[str, datetime]) -> dict:
+    """$match for the channel messages `user_id` has not read."""
+    per_channel = []
+    for channel_id in channel_ids:
+        clause = {"channel_id": channel_id}
+        if channel_id in watermarks:
+            clause["timestamp"] = {"$gt": watermarks[channel_id]}
+        per_channel.append(clause)
+    return {
+        "$or": per_channel or [{"channel_id": {"$in": []}}],
+        "sender_id": {"$ne": user_id},
+        "read_by": {"$nin": [user_id]},
+    }
+
+
+async def count_unread_in_channel(chat_db, user_id: str, channel_id: str) -> int:
+    watermarks = await load_read_watermarks(chat_db, user_id, [channel_id])
+    return await chat_db.Channel_chat.count_documents(unread_channel_match(user_id, [channel_id], watermarks))
+
+
+class _PendingRead:
+    __slots__ = ("message_ids", "whole_conversation")
+
+    def __init__(self):
+        self.message_ids: Set[str] = set()
+        self.whole_conversation = False
+
+
+class ReadBatcher:
+    """Merges mark-as-read events per (user, kind, conversation) and hands
+    each merged batch to `apply(user_id, kind, conversation_id, message_ids,
+    whole_conversation)` once the burst settles."""
+
+    def __init__(self, apply: Callable[[str, str, str, List[str], bool], Awaitable[None]],
+                 flush_delay: float = FLUSH_DELAY):
+        self._apply = apply
+        self.flush_delay = flush_delay
+        self._pending: Dict[Tuple[str, str, str], _PendingRead] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def add(self, user_id: str, kind: str, conversation_id: str,
+            message_ids: Optional[List[str]] = None, whole_conversation: bool = False):
+        pending = self._pending.setdefault((user_id, kind, conversation_id), _PendingRead())
+        pending.message_ids.update(message_ids or ())
+        pending.whole_conversation = pending.whole_conversation or whole_conversation
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # add() during the flush's awaits sees this task still running and does
+        # not schedule another, so keep going until nothing is pending.
+        while True:
+            await asyncio.sleep(self.flush_delay)
+            await self.flush()
+            if not self._pending:
+                return
+
+    async def flush(self):
+        batch, self._pending = self._pending, {}
+        for (user_id, kind, conversation_id), pending in batch.items():
+            try:
+                await self._apply(user_id, kind, conversation_id,
+                                  sorted(pending.message_ids), pending.whole_conversation)
+            except Exception as e:
+                logger.error("Error processing read receipts for user %s in %s: %s", user_id, conversation_id, e)
+
+
+def now_utc() -> datetime:
+    return datetime.now(timezone.utc)
@@ -0,0 +1,126 @@
+"""
+renditions.py
+-------------
+Downscaled renditions of chat image attachments.
+
+After an image upload the original is read back from GridFS in a background
+task and resized (off the event loop) into the variants in RENDITIONS. Each
+variant is stored as its own GridFS file with
+
+    metadata: {"rendition_of": <original ObjectId>, "variant": "thumb", "contentType": ...}
+
+and `/files/download/{id}?size=thumb` serves it, falling back to the original
+while it is not there yet (or when Pillow is not installed, in which case no
+renditions are generated at all).
+
+The original is copied in chunks to a temporary file that Pillow decodes
+from, never held in memory whole. Originals over RENDITION_MAX_SOURCE_MB, or
+with more than RENDITION_MAX_MEGAPIXELS pixels, get no renditions and are
+always served as uploaded.
+
+Config (.env):
+    RENDITION_MAX_SOURCE_MB=25
+    RENDITION_MAX_MEGAPIXELS=50
+"""
+import asyncio
+import io
+import logging
+import os
+import tempfile
+from typing import BinaryIO, Optional, Set
+
+from bson import ObjectId
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# variant -> longest edge in pixels
+RENDITIONS = {"thumb": 256, "preview": 1024}
+
+MAX_SOURCE_BYTES = int(float(os.environ.get("RENDITION_MAX_SOURCE_MB", "25")) * 1024 * 1024)
+MAX_SOURCE_PIXELS = int(float(os.environ.get("RENDITION_MAX_MEGAPIXELS", "50")) * 1_000_000)
+READ_CHUNK = 256 * 1024
+
+# Running generate_renditions tasks, kept referenced until they finish.
+_tasks: Set[asyncio.Task] = set()
+
+# Formats Pillow can decode that are worth downscaling (GIFs keep their animation).
+_IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp", "image/bmp", "image/tiff"}
+
+
+def is_image(content_type: Optional[str]) -> bool:
+    return Image is not None and (content_type or "").lower() in _IMAGE_TYPES
+
+
+async def ensure_indexes(db):
+    await db["fs.files"].create_index([("metadata.rendition_of", 1), ("metadata.variant", 1)])
+
+
+async def find_rendition(db, file_id: ObjectId, variant: str) -> Optional[ObjectId]:
+    doc = await db["fs.files"].find_one(
+        {"metadata.rendition_of": file_id, "metadata.variant": variant}, {"_id": 1}
+    )
+    return doc["_id"] if doc else None
+
+
+def _render(source: BinaryIO, max_edge: int) -> Optional[tuple]:
+    """Resize to fit max_edge. Returns (bytes, content type), or None if the
+    image is already that small or too large to decode."""
+    source.seek(0)
+    with Image.open(source) as image:
+        # Image.open only reads the header, so this is checked before decoding.
+        if image.size[0] * image.size[1] > MAX_SOURCE_PIXELS:
+            return None
+        image = ImageOps.exif_transpose(image)
+        if max(image.size) <= max_edge:
+            return None
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        out = io.BytesIO()
+        if image.mode in ("RGBA", "LA", "P"):
+            image.save(out, format="PNG", optimize=True)
+            return out.getvalue(), "image/png"
+        image.convert("RGB").save(out, format="JPEG", quality=82, optimize=True, progressive=True)
+        return out.getvalue(), "image/jpeg"
+
+
+async def generate_renditions(grid_fs, db, file_id: str, filename: str):
+    """Create any missing renditions for an uploaded image."""
+    original_id = ObjectId(file_id)
+    try:
+        missing = [v for v in RENDITIONS if not await find_rendition(db, original_id, v)]
+        if not missing:
+            return
+        stream = await grid_fs.open_download_stream(original_id)
+        if stream.length > MAX_SOURCE_BYTES:
+            logger.info("Skipping renditions for %s: original is %d bytes", file_id, stream.length)
+            return
+        with tempfile.TemporaryFile() as source:
+            while True:
+                chunk = await stream.read(READ_CHUNK)
+                if not chunk:
+                    break
+                source.write(chunk)
+            for variant in missing:
+                rendered = await asyncio.to_thread(_render, source, RENDITIONS[variant])
+                if rendered is None:
+                    continue  # small (or oversize) image: the original serves this size
+                content, content_type = rendered
+                await grid_fs.upload_from_stream(
+                    f"{variant}-{filename}",
+                    content,
+                    metadata={"contentType": content_type, "rendition_of": original_id, "variant": variant}
+                )
+        logger.info("Generated renditions %s for %s", missing, file_id)
+    except Exception as e:
+        logger.error("Rendition generation failed for %s: %s", file_id, e)
+
+
+def schedule_renditions(grid_fs, db, file_id: str, filename: str, content_type: Optional[str]):
+    if is_image(content_type):
+        task = asyncio.create_task(generate_renditions(grid_fs, db, file_id, filename))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
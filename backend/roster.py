@@ -0,0 +1,73 @@
+"""
+roster.py
+---------
+empCode-keyed views of the employee directory for the attendance modules.
+
+Biometric summaries, attendance views and manager lookups used to list every
+STC_Employees collection and stream every employee document, up to three
+times per request (names, shifts, reviewer teams). The roster derives what
+they need from `directory.employee_directory`, which already holds every
+employee in memory, reloads on its TTL and bumps `version` whenever a writer
+(signup, profile, admin, sheet sync) changes a user:
+
+    roster.names()           {empCode: name}
+    roster.shift(code)       the 'shift' column value
+    roster.entry(code)       the directory entry
+    roster.reports_to(name)  entries whose reviewer is `name`
+
+The views are rebuilt only when the directory version moves; `roster.version`
+is that stamp.
+"""
+import logging
+from typing import Dict, List, Optional
+
+from directory import EmployeeDirectory, employee_directory
+
+logger = logging.getLogger(__name__)
+
+
+def _key(value) -> str:
+    return str(value or "").strip().lower()
+
+
+class Roster:
+    def __init__(self, directory: EmployeeDirectory):
+        self.directory = directory
+        self.version = -1
+        self._by_code: Dict[str, dict] = {}
+        self._names: Dict[str, str] = {}
+        self._by_reviewer: Dict[str, List[dict]] = {}
+
+    async def ensure_fresh(self):
+        await self.directory.ensure_fresh()
+        if self.directory.version != self.version:
+            self._rebuild()
+
+    def _rebuild(self):
+        version = self.directory.version
+        by_code, names, by_reviewer = {}, {}, {}
+        for entry in self.directory.entries_by_code():
+            code = entry["empCode"]
+            by_code[_key(code)] = entry
+            names[code] = entry["name"] or "—"
+            if entry["reviewer"]:
+                by_reviewer.setdefault(_key(entry["reviewer"]), []).append(entry)
+        self._by_code, self._names, self._by_reviewer = by_code, names, by_reviewer
+        self.version = version
+        logger.debug("Roster rebuilt at directory version %d: %d employees", version, len(names))
+
+    def names(self) -> Dict[str, str]:
+        return self._names
+
+    def entry(self, code: str) -> Optional[dict]:
+        return self._by_code.get(_key(code))
+
+    def shift(self, code: str) -> str:
+        entry = self.entry(code)
+        return entry["shift"] if entry else ""
+
+    def reports_to(self, manager_name: str) -> List[dict]:
+        return self._by_reviewer.get(_key(manager_name), [])
+
+
+roster = Roster(employee_directory)
@@ -13,11 +13,17 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Import all database objects and dependencies from the central database module
-from database import get_grid_fs, main_client, attendance_client, chat_db, stc_db
+from database import get_grid_fs, main_client, attendance_client, attendance_db, chat_db, stc_db
 from announcements import check_scheduled_announcements
+from directory import employee_directory
+from hidden import ensure_indexes as ensure_hidden_indexes, migrate_deleted_messages
+from delivery import ensure_indexes as ensure_delivery_indexes
+from read_state import ensure_indexes as ensure_read_indexes
+from file_store import UploadLimitMiddleware, ensure_indexes as ensure_file_indexes
+from renditions import ensure_indexes as ensure_rendition_indexes
 
 # Import new routers
-from chat import router as chat_router
+from chat import router as chat_router, manager as chat_manager
 from attendance import router as attendance_router
 from profile import router as profile_router
 from admin import router as admin_router
@@ -29,6 +35,10 @@ from download_file import router as download_router
 from youtube import router as youtube_api_router
 from facebook import router as facebook_router
 from biometric import router as biometric_router, ensure_indexes as ensure_biometric_indexes
+from attendance_rollup import ensure_indexes as ensure_rollup_indexes, migrate_legacy_attendance
+from attendance_store import ensure_indexes as ensure_attendance_indexes
+from essl_service import close_client as close_essl_client
+from migrations import start as start_migration
 
 # --- Allowed Origins for CORS ---
 ALLOWED_ORIGINS = [
@@ -92,6 +102,8 @@ async def generic_exception_handler(request: Request, exc: Exception):
 
 # Create the main app and register exception handlers
 app = FastAPI()
+# Added before CORS so its 413 responses still carry the CORS headers.
+app.add_middleware(UploadLimitMiddleware, paths=["/api/files/upload"])
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
@@ -142,12 +154,6 @@ app.include_router(api_router)
 
 async def setup_chat_indexes():
     try:
-        # DeletedMessages auto-expire after 30 days
-        await chat_db.DeletedMessages.create_index(
-            "created_at",
-            expireAfterSeconds=60 * 60 * 24 * 30  # 30 days
-        )
-
         # Channel & Direct chat: auto-remove globally deleted messages after 90 days
         await chat_db.Channel_chat.create_index(
             "deleted_at",
@@ -160,10 +166,31 @@ async def setup_chat_indexes():
             partialFilterExpression={"deleted_at": {"$exists": True}}
         )
 
-        logging.info("TTL indexes created for DeletedMessages (30d) and deleted messages (90d)")
+        logging.info("TTL indexes created for deleted messages (90d)")
     except Exception as e:
         logging.error(f"Failed to create TTL indexes: {e}")
 
+    try:
+        # Keyset pagination of chat history (see history.py)
+        await chat_db.Channel_chat.create_index([("channel_id", 1), ("timestamp", 1), ("id", 1)])
+        await chat_db.Direct_chat.create_index([("sender_id", 1), ("recipient_id", 1), ("timestamp", 1)])
+        await chat_db.Channel_chat.create_index("id")
+        await chat_db.Direct_chat.create_index("id")
+        # Per-user "clear chat" watermarks (see hidden.py)
+        await ensure_hidden_indexes(chat_db)
+        # Per-user delivery watermarks for missed-message sync (see delivery.py)
+        await ensure_delivery_indexes(chat_db)
+        # Per-user channel read watermarks (see read_state.py)
+        await ensure_read_indexes(chat_db)
+        # Content-hash lookups for upload dedupe (see file_store.py)
+        await ensure_file_indexes(chat_db)
+        await ensure_rendition_indexes(chat_db)
+        logging.info("Chat history indexes created")
+    except Exception as e:
+        logging.error(f"Failed to create chat history indexes: {e}")
+
+    start_migration(chat_db, "deleted_messages_hidden_for", lambda: migrate_deleted_messages(chat_db))
+
 async def setup_ap_mapping_indexes():
     """Creates indexes on the ap_mapping collection to speed up queries."""
     try:
@@ -192,15 +219,26 @@ async def setup_ap_mapping_indexes():
 
 @app.on_event("startup")
 async def startup_event():
+    try:
+        await chat_manager.backplane.start()
+    except Exception as e:
+        logger.error(f"Chat backplane failed to start, delivering within this worker only: {e}")
+    chat_manager.start_heartbeat()
+
     try:
         await main_client.admin.command('ping')
         await attendance_client.admin.command('ping')
         logger.info("MongoDB connections successful.")
 
         # Setup background tasks and indexes
+        await employee_directory.load()
+        await employee_directory.ensure_indexes()
         await setup_chat_indexes()
         await setup_ap_mapping_indexes()
         await ensure_biometric_indexes()
+        await ensure_attendance_indexes()
+        await ensure_rollup_indexes()
+        start_migration(attendance_db, "attendance_daily", migrate_legacy_attendance)
 
         asyncio.create_task(check_scheduled_announcements())
         await populate_chat_employees() # Run the script on startup
@@ -208,4 +246,10 @@ async def startup_event():
         logger.error(f"MongoDB connection failed: {e}")
         logger.info("Continuing without MongoDB - WebSocket functionality will work without database persistence")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await chat_manager.stop_heartbeat()
+    await chat_manager.backplane.stop()
+    await close_essl_client()
+
 # logger already initialized above
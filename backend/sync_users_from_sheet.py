@@ -25,6 +25,7 @@ from dotenv import load_dotenv
 from sheets import get_data_from_sheet
 from models import SignupRequest, TEAMS
 from database import stc_db
+from directory import employee_directory
 import profile as profile_mod
 
 load_dotenv()
@@ -108,17 +109,20 @@ def resolve_team(raw_team):
 
 
 async def set_shift(email, shift):
-    for cname in await stc_db.list_collection_names():
-        if cname.startswith("system."):
-            continue
-        res = await stc_db[cname].update_one({"email": email}, {"$set": {"shift": shift}})
-        if res.matched_count:
-            return True
+    entry = await employee_directory.resolve(email, fields=("email",))
+    if not entry:
+        return False
+    collection = stc_db[entry["collection"]]
+    res = await collection.update_one({"email": entry["email"]}, {"$set": {"shift": shift}})
+    if res.matched_count:
+        await employee_directory.refresh(email, collection)
+        return True
     return False
 
 
 async def main():
     rows = get_data_from_sheet(SHEET_URL)
+    await employee_directory.load()
     log.info("Read %d rows from the sheet.%s", len(rows), "  [DRY RUN - nothing will be written]" if DRY_RUN else "")
 
     created = skipped = failed = shift_set = 0
@@ -0,0 +1,157 @@
+"""
+unread.py
+---------
+Incremental unread-message counters for connected chat users.
+
+Holds {user_id: {conversation: count}} where conversation is the sender's id
+for direct messages and the channel id for channel messages (the shape the
+`unread_count_update` frame and /messages/unread-count already use).
+
+A user's counters are computed once from the database (the rebuild path) when
+they connect or are first asked for, then bumped on every new message and
+lowered on `mark_messages_read`. Changes are coalesced: every touched user is
+marked dirty and a single flush, FLUSH_DELAY seconds later, pushes one
+`unread_count_update` per online user.
+"""
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+FLUSH_DELAY = 0.1
+
+
+class UnreadCounters:
+    def __init__(self,
+                 compute: Callable[[str], Awaitable[Dict[str, int]]],
+                 push: Callable[[str, str], Awaitable[None]],
+                 is_online: Callable[[str], bool],
+                 flush_delay: float = FLUSH_DELAY):
+        self._compute = compute
+        self._push = push
+        self._is_online = is_online
+        self.flush_delay = flush_delay
+        self._table: Dict[str, Dict[str, int]] = {}
+        self._loading: Dict[str, asyncio.Task] = {}
+        # Bumped per user while a load is in flight, so a load that raced with
+        # a new message can tell it must recompute.
+        self._generation: Dict[str, int] = {}
+        self._dirty: Set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    # --- loading / rebuild ---
+
+    def loaded(self, user_id: str) -> bool:
+        return user_id in self._table
+
+    async def load(self, user_id: str) -> Dict[str, int]:
+        if user_id in self._table:
+            return self._table[user_id]
+        task = self._loading.get(user_id)
+        if task is None:
+            task = asyncio.create_task(self._load(user_id))
+            self._loading[user_id] = task
+        return await task
+
+    async def _load(self, user_id: str) -> Dict[str, int]:
+        try:
+            for _ in range(3):
+                generation = self._generation.get(user_id, 0)
+                counts = await self._compute(user_id)
+                if self._generation.get(user_id, 0) == generation:
+                    break
+            self._table[user_id] = {k: v for k, v in counts.items() if v}
+            return self._table[user_id]
+        finally:
+            self._loading.pop(user_id, None)
+            self._generation.pop(user_id, None)
+
+    async def counts(self, user_id: str) -> Dict[str, int]:
+        """Current counts. Offline users are computed but not kept."""
+        if user_id in self._table or self._is_online(user_id):
+            return dict(await self.load(user_id))
+        return await self._compute(user_id)
+
+    def evict(self, user_id: str):
+        self._table.pop(user_id, None)
+        self._dirty.discard(user_id)
+
+    async def rebuild(self, user_ids: Optional[Iterable[str]] = None) -> int:
+        """Recompute counters from scratch (all loaded users by default)."""
+        targets = list(self._table) if user_ids is None else list(user_ids)
+        for user_id in targets:
+            self._table.pop(user_id, None)
+        for user_id in targets:
+            if self._is_online(user_id):
+                try:
+                    await self.load(user_id)
+                    self._mark(user_id)
+                except Exception as e:
+                    logger.error("Unread rebuild failed for %s: %s", user_id, e)
+        return len(targets)
+
+    # --- updates ---
+
+    def bump(self, user_ids: Iterable[str], conversation: str, n: int = 1):
+        for user_id in user_ids:
+            if user_id in self._loading:
+                self._generation[user_id] = self._generation.get(user_id, 0) + 1
+                self._mark(user_id)
+            elif user_id in self._table:
+                row = self._table[user_id]
+                row[conversation] = row.get(conversation, 0) + n
+                self._mark(user_id)
+            elif self._is_online(user_id):
+                # Connected but never loaded: the load includes this message.
+                self._loading[user_id] = asyncio.create_task(self._load(user_id))
+                self._mark(user_id)
+
+    def lower(self, user_id: str, conversation: str, n: Optional[int] = None):
+        """Subtract `n` read messages, or clear the conversation if n is None."""
+        row = self._table.get(user_id)
+        if row is None:
+            return
+        remaining = 0 if n is None else max(0, row.get(conversation, 0) - n)
+        if remaining:
+            row[conversation] = remaining
+        else:
+            row.pop(conversation, None)
+        self._mark(user_id)
+
+    def set(self, user_id: str, conversation: str, count: int):
+        """Overwrite one conversation's count with a freshly computed value."""
+        row = self._table.get(user_id)
+        if row is None:
+            return
+        if count:
+            row[conversation] = count
+        else:
+            row.pop(conversation, None)
+        self._mark(user_id)
+
+    # --- coalesced push ---
+
+    def _mark(self, user_id: str):
+        self._dirty.add(user_id)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # Marks made while this task awaits land in the fresh `_dirty` without
+        # scheduling a flush (this task is not done yet), so loop until it is empty.
+        while True:
+            await asyncio.sleep(self.flush_delay)
+            dirty, self._dirty = self._dirty, set()
+            for user_id in dirty:
+                if not self._is_online(user_id):
+                    continue
+                try:
+                    counts = await self.load(user_id)
+                    payload = json.dumps({"type": "unread_count_update", "counts": counts})
+                    await self._push(payload, user_id)
+                except Exception as e:
+                    logger.error("Failed to push unread counts to %s: %s", user_id, e)
+            if not self._dirty:
+                return
@@ -10,6 +10,8 @@ import { API_BASE_URL } from '../config/api';
 import { fetchWithRetry } from '../utils/fetchRetry';
 import { humanBreak, breakMinutes } from './BiometricLiveLogs';
 
+const COMPANY_PAGE_SIZE = 50;
+
 function firstOfMonth() {
   const d = new Date();
   return new Date(d.getFullYear(), d.getMonth(), 1).toISOString().slice(0, 10);
@@ -24,6 +26,9 @@ export default function BiometricMyTeam({ endpoint = 'team' }) {
   const [data, setData] = useState(null);
   const [error, setError] = useState('');
   const [loading, setLoading] = useState(false);
+  const [page, setPage] = useState(1);            // company view only
+  const [team, setTeam] = useState('');
+  const [exporting, setExporting] = useState('');
 
   const authHeader = useCallback(() => ({
     'Authorization': `Bearer ${btoa(JSON.stringify(user))}`,
@@ -36,7 +41,8 @@ export default function BiometricMyTeam({ endpoint = 'team' }) {
     try {
       // Full company day-wise view (admin / pardhasaradhi)
       if (endpoint === 'company') {
-        const res = await fetchWithRetry(`${API_BASE_URL}/api/biometric/company?${qs}`, { headers: authHeader() });
+        const pq = `${qs}&page=${page}&page_size=${COMPANY_PAGE_SIZE}${team ? `&team=${encodeURIComponent(team)}` : ''}`;
+        const res = await fetchWithRetry(`${API_BASE_URL}/api/biometric/company?${pq}`, { headers: authHeader() });
         if (!res.ok) {
           const e = await res.json().catch(() => ({}));
           throw new Error(e.detail || `Request failed (${res.status})`);
@@ -64,10 +70,32 @@ export default function BiometricMyTeam({ endpoint = 'team' }) {
     } finally {
       setLoading(false);
     }
-  }, [user, from, to, authHeader, endpoint]);
+  }, [user, from, to, authHeader, endpoint, page, team]);
 
   useEffect(() => { load(); }, [load]);
 
+  // Company spreadsheet: streamed by the backend, saved from a blob here.
+  const exportSheet = async (format) => {
+    setExporting(format); setError('');
+    try {
+      const qs = `from_date=${from}&to_date=${to}&format=${format}${team ? `&team=${encodeURIComponent(team)}` : ''}`;
+      const res = await fetch(`${API_BASE_URL}/api/biometric/company/export?${qs}`, { headers: authHeader() });
+      if (!res.ok) {
+        const e = await res.json().catch(() => ({}));
+        throw new Error(e.detail || `Export failed (${res.status})`);
+      }
+      const url = URL.createObjectURL(await res.blob());
+      const a = document.createElement('a');
+      a.href = url; a.download = `attendance_${from}_${to}.${format}`;
+      a.click();
+      URL.revokeObjectURL(url);
+    } catch (e) {
+      setError(e.message);
+    } finally {
+      setExporting('');
+    }
+  };
+
   const heading = endpoint === 'company'
     ? 'Company Attendance — day-wise'
     : (mode === 'team' ? 'Team Attendance' : 'My Attendance');
@@ -77,17 +105,33 @@ export default function BiometricMyTeam({ endpoint = 'team' }) {
       <h2 style={{ margin: '0 0 4px' }}>{heading} (eSSL)</h2>
       <div style={{ display: 'flex', gap: 10, alignItems: 'center', margin: '14px 0', flexWrap: 'wrap' }}>
         <label style={lbl}>From <input type="date" value={from} max={to}
-          onChange={(e) => setFrom(e.target.value)} style={inp} /></label>
+          onChange={(e) => { setFrom(e.target.value); setPage(1); }} style={inp} /></label>
         <label style={lbl}>To <input type="date" value={to} max={today}
-          onChange={(e) => setTo(e.target.value)} style={inp} /></label>
+          onChange={(e) => { setTo(e.target.value); setPage(1); }} style={inp} /></label>
+        {endpoint === 'company' && (
+          <label style={lbl}>Team <input type="text" value={team} placeholder="All"
+            onChange={(e) => { setTeam(e.target.value); setPage(1); }} style={inp} /></label>
+        )}
         <button onClick={load} disabled={loading} style={btn}>
           {loading ? 'Loading…' : 'Refresh'}
         </button>
+        {endpoint === 'company' && ['csv', 'xlsx'].map((f) => (
+          <button key={f} onClick={() => exportSheet(f)} disabled={!!exporting} style={btnAlt}>
+            {exporting === f ? 'Exporting…' : `Export ${f.toUpperCase()}`}
+          </button>
+        ))}
       </div>
 
       {error && <div style={errBox}>{error}</div>}
 
       {mode === 'team' && data && <TeamView data={data} />}
+      {mode === 'team' && data && data.pages > 1 && (
+        <div style={{ display: 'flex', gap: 10, alignItems: 'center', justifyContent: 'flex-end', marginTop: 12 }}>
+          <button onClick={() => setPage(page - 1)} disabled={loading || page <= 1} style={btnAlt}>‹ Prev</button>
+          <span style={{ fontSize: 13, color: '#555' }}>Page {data.page} of {data.pages} · {data.total} employees</span>
+          <button onClick={() => setPage(page + 1)} disabled={loading || page >= data.pages} style={btnAlt}>Next ›</button>
+        </div>
+      )}
       {mode === 'self' && data && <SelfView data={data} />}
     </div>
   );
@@ -217,6 +261,7 @@ function Stat({ label, value, color }) {
 const lbl = { fontSize: 13, color: '#555', display: 'flex', gap: 6, alignItems: 'center' };
 const inp = { padding: 8, borderRadius: 6, border: '1px solid #ccc' };
 const btn = { padding: '8px 14px', borderRadius: 6, border: 'none', background: '#2e7d32', color: '#fff', cursor: 'pointer' };
+const btnAlt = { padding: '8px 14px', borderRadius: 6, border: '1px solid #2e7d32', background: '#fff', color: '#2e7d32', cursor: 'pointer' };
 const errBox = { background: '#fdecea', color: '#b71c1c', padding: 12, borderRadius: 6, marginBottom: 12 };
 const cardRow = { display: 'flex', gap: 14, flexWrap: 'wrap', marginBottom: 16 };
 const statCard = { flex: '1 1 160px', minWidth: 150, background: '#fff', border: '1px solid #eef0f2',
@@ -273,7 +273,7 @@ export const FileMessage = ({ message }) => {
             <div className="flex items-center space-x-3 p-2 rounded-lg bg-blue-50">
               <div className="flex-shrink-0">
                 <img
-                  src={message.file_url}
+                  src={message.file_url ? `${message.file_url}${message.file_url.includes('?') ? '&' : '?'}size=thumb` : message.file_url}
                   alt={message.file_name}
                   className="w-12 h-12 object-cover rounded-md cursor-pointer hover:opacity-90 transition-opacity"
                   onClick={handleDownload}
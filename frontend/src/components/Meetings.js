@@ -60,7 +60,7 @@ const MeetingsContent = () => {
         attendees: attendeeEmails,
       }
     };
-    const token = btoa(JSON.stringify({ email: user.email }));
+    const token = btoa(JSON.stringify(user));
     try {
       const response = await fetch(`${API_BASE_URL}/api/meetings/schedule`, {
         method: 'POST',
@@ -154,7 +154,7 @@ const UserProfile = () => {
   }
 
   try {
-  const token = btoa(JSON.stringify({ email: user.email }));
+  const token = btoa(JSON.stringify(user));
 
 const response = await fetch("http://localhost:8000/api/users/me/reset-password", {
   method: "PUT",
@@ -174,6 +174,8 @@ const response = await fetch("http://localhost:8000/api/users/me/reset-password"
     if (!response.ok) {
       throw new Error(data.detail || "Failed to reset password.");
     }
+    // Other sessions were signed out; keep this one with the fresh token.
+    if (data.access_token) updateProfile({ access_token: data.access_token });
 
     toast({
       title: "Success",
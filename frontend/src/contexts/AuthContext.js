@@ -178,6 +178,10 @@ export const AuthProvider = ({ children }) => {
             [message.user_id]: message.status,
           }));
           messageHandled = true;
+        } else if (message.type === "presence_diff") {
+          // Batched status changes: { user_id: status, ... }
+          setUserStatuses((prev) => ({ ...prev, ...(message.changes || {}) }));
+          messageHandled = true;
         } else if (message.type === "all_statuses") {
           setUserStatuses(message.statuses || {});
           messageHandled = true;
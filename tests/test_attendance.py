@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime, timezone
+
+import attendance
+import attendance_rollup
+import attendance_store
+
+RECORDS = [
+    {"status": "P", "lateBy": "00:10"},
+    {"status": "P", "lateBy": "00:00"},
+    {"status": "P", "lateBy": None},
+    {"status": "A", "lateBy": "00:05"},
+    {"status": "H", "lateBy": ""},
+]
+
+
+def test_month_view_counts_late_present_days_only():
+    assert attendance_rollup.summarize(RECORDS) == {"P": 3, "A": 1, "H": 1, "L": 1}
+
+
+def test_month_bounds_roll_over_the_year():
+    assert attendance_rollup.month_bounds(2024, 12) == (
+        datetime(2024, 12, 1, tzinfo=timezone.utc), datetime(2025, 1, 1, tzinfo=timezone.utc))
+    assert attendance_rollup.month_bounds(2024, 2)[1] == datetime(2024, 3, 1, tzinfo=timezone.utc)
+
+
+def test_rollup_doc_keeps_the_latest_record_per_day():
+    records = [
+        {"date": datetime(2024, 3, 2), "status": "A"},
+        {"date": datetime(2024, 3, 1), "status": "P", "lateBy": "00:10"},
+        {"date": datetime(2024, 3, 2), "status": "P"},
+    ]
+    doc = attendance_rollup._rollup_doc("E1", "Ann", 2024, 3, records)
+    assert [r["date"].day for r in doc["dailyRecords"]] == [1, 2]
+    assert doc["dailyRecords"][1]["status"] == "P"
+    assert {k: doc[k] for k in ("P", "A", "H", "L")} == {"P": 2, "A": 0, "H": 0, "L": 1}
+    assert (doc["empCode"], doc["year"], doc["month"]) == ("E1", 2024, 3)
+
+
+def test_manager_report_keeps_its_late_rule():
+    # Baseline: lateBy > "00:00" for any status.
+    assert attendance_rollup.manager_late_count(RECORDS) == 2
+
+
+def test_report_without_view_is_paged_by_employee(monkeypatch):
+    codes = [f"E{i}" for i in range(5)]
+    asked = []
+
+    async def employee_codes():
+        return codes
+
+    async def find_days(start=None, end=None, emp_codes=None, end_inclusive=False):
+        asked.append(emp_codes)
+        return [{"empCode": code, "date": datetime(2024, 3, 1), "status": "P"} for code in emp_codes]
+
+    monkeypatch.setattr(attendance_store, "employee_codes", employee_codes)
+    monkeypatch.setattr(attendance_store, "find_days", find_days)
+
+    result = asyncio.run(attendance.get_attendance_report(page=2, page_size=2))
+    assert asked == [["E2", "E3"]]
+    assert [emp["empCode"] for emp in result["data"]] == ["E2", "E3"]
+    assert (result["total"], result["pages"]) == (5, 3)
+
+    result = asyncio.run(attendance.get_attendance_report(page=9, page_size=2))
+    assert result["data"] == [] and len(asked) == 1
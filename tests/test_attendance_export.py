@@ -0,0 +1,42 @@
+import asyncio
+import csv
+import io
+
+import pytest
+
+import attendance_export
+
+DAY = {"date": "2024-03-01", "weekday": "Fri", "status": "Present", "first_in": "09:05",
+       "first_in_device": "In", "late": True, "late_by": "00:05:00", "last_out": "18:00",
+       "last_out_device": "Out", "breaks": [{"time": "13:00", "device": "Out"}, {"time": "13:45", "device": ""}],
+       "break_time": "00:45", "working_hours": "08:10", "punch_count": 4}
+
+
+async def employees():
+    yield {"emp_code": "E1", "emp_name": "Zoë", "days": [DAY]}
+    yield {"emp_code": "E2", "emp_name": "Bob", "days": [{**DAY, "late": False, "breaks": []}]}
+
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_csv_streams_one_chunk_per_employee():
+    chunks = asyncio.run(collect(attendance_export.stream_csv(employees())))
+    assert len(chunks) == 2
+    assert chunks[0].startswith("\ufeff")
+    rows = list(csv.reader(io.StringIO("".join(chunks).lstrip("\ufeff"))))
+    assert rows[0] == attendance_export.COLUMNS
+    assert rows[1][:3] == ["E1", "Zoë", "2024-03-01"]
+    assert rows[1][7] == "Yes" and rows[1][11] == "13:00 (Out), 13:45"
+    assert rows[2][7] == "" and rows[2][11] == ""
+
+
+def test_xlsx_holds_the_same_rows():
+    openpyxl = pytest.importorskip("openpyxl")
+    body = b"".join(asyncio.run(collect(attendance_export.stream_xlsx(employees()))))
+    sheet = openpyxl.load_workbook(io.BytesIO(body))["Attendance"]
+    rows = [list(row) for row in sheet.iter_rows(values_only=True)]
+    assert rows[0] == attendance_export.COLUMNS
+    assert [row[0] for row in rows[1:]] == ["E1", "E2"]
+    assert rows[1][-1] == 4
@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+from pymongo.errors import BulkWriteError
+
+import attendance_store
+
+
+class FakeDaily:
+    """Applies UpdateOne upserts to a dict keyed by (empCode, date)."""
+
+    def __init__(self, fail_codes=()):
+        self.docs = {}
+        self.batches = []
+        self.fail_codes = set(fail_codes)
+
+    async def bulk_write(self, ops, ordered=True):
+        self.batches.append(len(ops))
+        upserted = modified = 0
+        errors = []
+        for i, op in enumerate(ops):
+            key = (op._filter["empCode"], op._filter["date"])
+            if key[0] in self.fail_codes:
+                errors.append({"index": i, "errmsg": "boom"})
+                continue
+            doc = self.docs.get(key)
+            if doc is None:
+                self.docs[key] = {**op._doc.get("$setOnInsert", {}), **op._doc.get("$set", {})}
+                upserted += 1
+            else:
+                updated = {**doc, **op._doc.get("$set", {})}
+                if updated != doc:
+                    self.docs[key] = updated
+                    modified += 1
+        if errors:
+            raise BulkWriteError({"nUpserted": upserted, "nModified": modified, "writeErrors": errors})
+        return SimpleNamespace(upserted_count=upserted, modified_count=modified)
+
+
+def employee(code, *days, status="P"):
+    return {"empCode": code, "empName": f"Name {code}",
+            "dailyRecords": [{"date": datetime(2024, 3, d), "status": status} for d in days]}
+
+
+def ingest(monkeypatch, daily, employees, batch_size=1000):
+    monkeypatch.setattr(attendance_store, "DAILY", daily)
+    monkeypatch.setattr(attendance_store, "INGEST_BATCH_SIZE", batch_size)
+    return asyncio.run(attendance_store.ingest_days(employees))
+
+
+def test_ingest_counts_inserted_updated_and_skipped(monkeypatch):
+    daily = FakeDaily()
+    assert ingest(monkeypatch, daily, [employee("E1", 1, 2), employee("E2", 1)]) == \
+        {"inserted": 3, "updated": 0, "skipped": 0}
+    # Re-ingesting the same data changes nothing.
+    assert ingest(monkeypatch, daily, [employee("E1", 1, 2), employee("E2", 1)]) == \
+        {"inserted": 0, "updated": 0, "skipped": 3}
+    assert ingest(monkeypatch, daily, [employee("E1", 2, 3, status="A")]) == \
+        {"inserted": 1, "updated": 1, "skipped": 0}
+    assert daily.docs[("E1", datetime(2024, 3, 2))]["status"] == "A"
+
+
+def test_ingest_writes_a_repeated_day_once_and_skips_invalid_records(monkeypatch):
+    daily = FakeDaily()
+    bad = {"empCode": "", "dailyRecords": [{"date": datetime(2024, 3, 1)}]}
+    no_date = {"empCode": "E3", "dailyRecords": [{"date": "2024-03-01"}]}
+    counts = ingest(monkeypatch, daily, [employee("E1", 1), employee("E1", 1, status="A"), bad, no_date])
+    assert counts == {"inserted": 1, "updated": 0, "skipped": 2}
+    assert daily.docs[("E1", datetime(2024, 3, 1))]["status"] == "A"   # last wins
+
+
+def test_ingest_flushes_in_batches_and_counts_failed_writes_as_skipped(monkeypatch):
+    daily = FakeDaily(fail_codes={"E2"})
+    counts = ingest(monkeypatch, daily, [employee("E1", 1, 2, 3), employee("E2", 1, 2)], batch_size=2)
+    assert daily.batches == [2, 2, 1]
+    assert counts == {"inserted": 3, "updated": 0, "skipped": 2}
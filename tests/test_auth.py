@@ -0,0 +1,112 @@
+import asyncio
+import base64
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import auth
+
+USER = {"email": "a@x.com", "empCode": "E1", "team": "Data", "designation": "Analyst"}
+
+
+def b64_user(user: dict) -> str:
+    return base64.b64encode(json.dumps(user).encode("utf-8")).decode("ascii")
+
+
+def bearer(token: str) -> str:
+    return f"Bearer {token}"
+
+
+def test_verify_token_round_trip():
+    claims = auth.verify_token(auth.issue_token(USER))
+    assert (claims["sub"], claims["emp"], claims["adm"]) == ("a@x.com", "E1", False)
+
+
+def test_verify_token_rejects_bad_signature():
+    prefix, payload, signature = auth.issue_token(USER).split(".")
+    forged = auth._b64encode(json.dumps({"sub": "boss@x.com", "adm": True, "exp": time.time() + 60}).encode())
+    with pytest.raises(auth.TokenError, match="signature"):
+        auth.verify_token(f"{prefix}.{forged}.{signature}")
+
+
+def test_verify_token_rejects_wrong_prefix():
+    _, payload, signature = auth.issue_token(USER).split(".")
+    with pytest.raises(auth.TokenError, match="type"):
+        auth.verify_token(f"stc0.{payload}.{signature}")
+
+
+def test_verify_token_rejects_expired():
+    with pytest.raises(auth.TokenError, match="expired"):
+        auth.verify_token(auth.issue_token(USER, ttl=-1))
+
+
+def test_bearer_claims_bare_and_embedded_tokens():
+    token = auth.issue_token(USER)
+    assert auth.bearer_claims(bearer(token))["sub"] == "a@x.com"
+    embedded = b64_user({**USER, "access_token": token})
+    assert auth.bearer_claims(bearer(embedded))["sub"] == "a@x.com"
+
+
+def test_bearer_claims_rejects_missing_or_garbage_headers():
+    for header in (None, "Basic abc", bearer("not base64 json!")):
+        with pytest.raises(HTTPException) as e:
+            auth.bearer_claims(header)
+        assert e.value.status_code == 401
+
+
+def test_legacy_token_rejected_by_default(monkeypatch):
+    monkeypatch.setattr(auth, "ALLOW_LEGACY_TOKENS", False)
+    with pytest.raises(HTTPException) as e:
+        auth.bearer_claims(bearer(b64_user({"email": "a@x.com"})))
+    assert e.value.status_code == 401
+
+
+def test_legacy_token_allowed_only_with_flag_and_before_deadline(monkeypatch):
+    legacy = bearer(b64_user({"email": "a@x.com"}))
+    monkeypatch.setattr(auth, "ALLOW_LEGACY_TOKENS", True)
+    monkeypatch.setattr(auth, "LEGACY_TOKENS_UNTIL", None)
+    assert auth.bearer_claims(legacy) == {"sub": "a@x.com", "legacy": True}
+
+    monkeypatch.setattr(auth, "LEGACY_TOKENS_UNTIL", time.time() + 3600)
+    assert auth.bearer_claims(legacy)["legacy"] is True
+
+    monkeypatch.setattr(auth, "LEGACY_TOKENS_UNTIL", time.time() - 1)
+    with pytest.raises(HTTPException):
+        auth.bearer_claims(legacy)
+
+
+def test_legacy_deadline_parsing():
+    assert auth._legacy_deadline("") is None
+    assert auth._legacy_deadline("2030-01-01") == datetime(2030, 1, 1, tzinfo=timezone.utc).timestamp()
+    assert auth._legacy_deadline("soon") == 0.0   # invalid: disabled
+
+
+def test_issued_before_handles_naive_stamps():
+    claims = auth.verify_token(auth.issue_token(USER))
+    issued = datetime.fromtimestamp(claims["iat"], timezone.utc).replace(tzinfo=None)   # Mongo returns naive UTC
+    assert auth._issued_before(claims, {"tokens_valid_after": issued + timedelta(seconds=5)})
+    assert not auth._issued_before(claims, {"tokens_valid_after": issued - timedelta(seconds=5)})
+    assert not auth._issued_before(claims, {})
+
+
+def test_issued_before_always_rejects_legacy_claims_after_a_stamp():
+    stamp = datetime(2000, 1, 1)
+    assert auth._issued_before({"sub": "a@x.com", "legacy": True}, {"tokens_valid_after": stamp})
+
+
+def test_legacy_principal_never_admin(monkeypatch):
+    admin_user = {**USER, "isAdmin": True}
+
+    async def fetch(email, fields=()):
+        return admin_user, None
+
+    auth.principal_cache.clear()
+    monkeypatch.setattr(auth.employee_directory, "fetch", fetch)
+    user, admin = asyncio.run(auth.load_principal({"sub": "a@x.com", "legacy": True}))
+    assert user["email"] == "a@x.com" and admin is False
+    user, admin = asyncio.run(auth.load_principal(auth.verify_token(auth.issue_token(admin_user))))
+    assert admin is True
+    auth.principal_cache.clear()
@@ -0,0 +1,58 @@
+import asyncio
+from datetime import date, datetime, timezone
+
+import biometric
+
+FROM, TO = date(2024, 3, 4), date(2024, 3, 8)   # Monday..Friday
+
+
+def test_company_page_builds_day_lists_for_its_own_employees_only(monkeypatch):
+    codes = [f"E{i}" for i in range(7)]
+    built = []
+
+    async def company_codes(team=None):
+        return codes
+
+    async def refreshed_range(from_date, to_date):
+        start = datetime(2024, 3, 4, tzinfo=timezone.utc)
+        return FROM, TO, start, datetime(2024, 3, 9, tzinfo=timezone.utc)
+
+    async def daily_summaries(start, end, batch):
+        return {}
+
+    async def all_employees():
+        return {code: f"Name {code}" for code in codes}
+
+    async def shift_map():
+        return {}
+
+    employee_attendance = biometric._employee_attendance
+
+    def recording(code, *args):
+        built.append((code, args[-1]))
+        return employee_attendance(code, *args)
+
+    monkeypatch.setattr(biometric, "_company_codes", company_codes)
+    monkeypatch.setattr(biometric, "_refreshed_range", refreshed_range)
+    monkeypatch.setattr(biometric, "daily_summaries", daily_summaries)
+    monkeypatch.setattr(biometric, "_all_employees", all_employees)
+    monkeypatch.setattr(biometric, "_shift_map", shift_map)
+    monkeypatch.setattr(biometric, "_employee_attendance", recording)
+
+    result = asyncio.run(biometric.company_attendance(page=2, page_size=3, team=None, admin={}))
+
+    assert [emp["emp_code"] for emp in result["employees"]] == ["E3", "E4", "E5"]
+    assert all(len(emp["days"]) == 5 for emp in result["employees"])
+    assert {code for code, want_days in built if want_days} == {"E3", "E4", "E5"}
+    assert result["team_totals"]["members"] == 7
+    assert result["team_totals"]["absent_days"] == 7 * 5
+    assert result["pages"] == 3
+
+
+def test_counters_do_not_depend_on_want_days():
+    args = ("E1", "Name", {}, (9, 0), FROM, TO, date(2024, 3, 6), 5)
+    full = biometric._employee_attendance(*args, want_days=True)
+    counters = biometric._employee_attendance(*args, want_days=False)
+    assert counters["days"] == []
+    assert {k: v for k, v in full.items() if k != "days"} == {k: v for k, v in counters.items() if k != "days"}
+    assert [d["status"] for d in full["days"]] == ["Absent", "Absent", "Absent", "", ""]
@@ -0,0 +1,88 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import biometric_summary
+from biometric_summary import (Directions, IST, day_record, summarize_day, summarize_punches_columnar,
+                               summarize_punches_python)
+
+DIRECTIONS = Directions(in_serials={"IN"}, out_serials={"OUT"})
+
+
+def ist(day, hh, mm, ss=0):
+    return datetime(2024, 3, day, hh, mm, ss, tzinfo=IST)
+
+
+def punch(code, t, serial, device=""):
+    return {"user_id": code, "punch_time": t.astimezone(timezone.utc).replace(tzinfo=None),
+            "serial": serial, "device": device}
+
+
+def test_directions_prefer_serial_over_name():
+    assert DIRECTIONS("IN", "Back door out") == "In"
+    assert DIRECTIONS("X", "Back door out") == "Out"
+    assert DIRECTIONS("X", "Lobby In") == "In"
+    assert DIRECTIONS("X", "Lobby") == "Lobby"
+
+
+def test_summarize_day_breaks_and_working_hours():
+    items = [{"t": ist(1, 18, 0), "dir": "Out"}, {"t": ist(1, 9, 5), "dir": "In"},
+             {"t": ist(1, 13, 0), "dir": "Out"}, {"t": ist(1, 13, 45), "dir": "In"}]
+    summary = summarize_day("E1", "2024-03-01", items)
+    assert (summary["first_in"], summary["last_out"]) == ("09:05", "18:00")
+    assert summary["breaks"] == [{"time": "13:00", "device": "Out"}, {"time": "13:45", "device": "In"}]
+    assert summary["break_time"] == "00:45"
+    assert summary["working_hours"] == "08:10"
+    assert summary["punch_count"] == 4
+    assert summary["signature"] == biometric_summary.punch_signature(4, ist(1, 9, 5), ist(1, 18, 0))
+
+
+def test_single_punch_day_has_no_last_out():
+    summary = summarize_day("E1", "2024-03-01", [{"t": ist(1, 9, 0), "dir": "In"}])
+    assert (summary["last_out"], summary["last_out_device"], summary["working_hours"]) == ("", "", "")
+    assert summary["break_time"] == "00:00"
+
+
+def test_punches_are_grouped_by_ist_day():
+    rows = [punch("E1", ist(1, 23, 50), "IN"), punch("E1", ist(2, 0, 10), "OUT"), punch(7, ist(2, 9, 0), "IN")]
+    summaries = summarize_punches_python(rows, DIRECTIONS)
+    assert sorted(summaries) == [("7", "2024-03-02"), ("E1", "2024-03-01"), ("E1", "2024-03-02")]
+    assert summaries[("E1", "2024-03-01")]["punch_count"] == 1
+
+
+def test_day_record_works_out_lateness_at_read_time():
+    summary = summarize_day("E1", "2024-03-01", [{"t": ist(1, 9, 35, 20), "dir": "In"}])
+    on_time = day_record(summary, (10, 0))
+    assert (on_time["late"], on_time["late_by"], on_time["weekday"]) == (False, "00:00:00", "Fri")
+    late = day_record(summary, (9, 30))
+    assert (late["late"], late["late_by"]) == (True, "00:05:20")
+
+
+def comparable(summaries):
+    return {key: {k: v for k, v in doc.items() if k != "updated_at"} for key, doc in summaries.items()}
+
+
+def test_columnar_path_matches_python_path():
+    pytest.importorskip("numpy")
+    from bench_biometric_summary import synthetic_punches
+    rows = synthetic_punches(employees=20, days=10)
+    expected = summarize_punches_python(rows, DIRECTIONS)
+    assert comparable(summarize_punches_columnar(rows, DIRECTIONS)) == comparable(expected)
+
+
+def test_columnar_path_matches_python_path_on_edge_cases():
+    pytest.importorskip("numpy")
+    rows = [
+        punch("E1", ist(1, 9, 0), "IN"),
+        punch("E1", ist(1, 9, 0), "OUT"),                 # same instant: input order breaks the tie
+        punch("E1", ist(1, 12, 0), "X", "Lobby"),         # neither In nor Out
+        punch("E1", ist(1, 12, 30), "OUT"),
+        punch("E1", ist(1, 12, 40), "OUT"),               # repeated Out: break starts at the first
+        punch("E1", ist(1, 13, 0), "IN"),
+        punch("E2", ist(1, 23, 59, 59), "OUT"),           # IST midnight boundary
+        punch("E2", ist(2, 0, 0), "IN"),
+        {"user_id": 42, "punch_time": ist(2, 8, 0).isoformat(), "serial": "IN"},   # ISO string, int code
+    ]
+    expected = summarize_punches_python(rows, DIRECTIONS)
+    assert comparable(summarize_punches_columnar(rows, DIRECTIONS)) == comparable(expected)
+    assert summarize_punches_columnar([], DIRECTIONS) == {}
@@ -0,0 +1,54 @@
+import asyncio
+
+import chat
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, frame):
+        self.sent.append(frame)
+
+    async def close(self, code=1000):
+        pass
+
+
+def test_backlog_goes_only_to_the_first_socket(monkeypatch):
+    synced = []
+
+    async def stream_missed_messages(chat_db, user_id, channel_ids, send, serialize):
+        synced.append(user_id)
+        return 1 if await send("missed") else 0
+
+    async def no_channels(user_id, stc_db):
+        return []
+
+    async def no_user(stc_db, user_id):
+        return None, None
+
+    async def load(user_id):
+        return {}
+
+    monkeypatch.setattr(chat, "stream_missed_messages", stream_missed_messages)
+    monkeypatch.setattr(chat, "get_user_info_with_collection", no_user)
+    monkeypatch.setattr(chat.unread_counters, "load", load)
+
+    async def run():
+        manager = chat.ConnectionManager()
+        monkeypatch.setattr(manager, "get_user_channels", no_channels)
+        first, second = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(first, "a@x")
+        await manager.connect(second, "a@x")
+        await asyncio.sleep(0.01)
+        for websocket in (first, second):
+            manager._outbound[websocket].stop()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert synced == ["a@x"]
+    assert "missed" in first.sent
+    assert "missed" not in second.sent
@@ -0,0 +1,110 @@
+import asyncio
+
+from connections import SLOW_CONSUMER_CLOSE_CODE, OutboundConnection
+
+
+class SlowWebSocket:
+    """Holds every send until `release` is set; fails sends once `broken`."""
+
+    def __init__(self, released=True):
+        self.sent = []
+        self.closed_with = None
+        self.broken = False
+        self.release = asyncio.Event()
+        if released:
+            self.release.set()
+
+    async def send_text(self, frame):
+        await self.release.wait()
+        if self.broken:
+            raise RuntimeError("socket closed")
+        self.sent.append(frame)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_frames_are_written_in_order():
+    async def run():
+        ws = SlowWebSocket()
+        conn = OutboundConnection(ws, "a@x.com")
+        conn.start()
+        assert conn.send("1") and conn.send("2")
+        assert await conn.send_and_wait("3") is True
+        await conn.close()
+        return ws, conn
+
+    ws, conn = asyncio.run(run())
+    assert ws.sent == ["1", "2", "3"]
+    assert not conn.lossy and ws.closed_with == 1000
+    assert conn.send("late") is False
+
+
+def test_drop_policy_discards_frames_for_a_full_queue():
+    async def run():
+        ws = SlowWebSocket(released=False)
+        conn = OutboundConnection(ws, "a@x.com", queue_size=1, policy="drop")
+        conn.start()
+        conn.send("1")
+        await settle()            # the writer holds "1"; the queue is empty again
+        assert conn.send("2") is True
+        assert conn.send("3") is False
+        ws.release.set()
+        await settle()
+        return ws, conn
+
+    ws, conn = asyncio.run(run())
+    assert ws.sent == ["1", "2"]
+    assert conn.dropped == 1 and conn.lossy and not conn.closed
+
+
+def test_disconnect_policy_evicts_a_slow_consumer():
+    async def run():
+        ws = SlowWebSocket(released=False)
+        conn = OutboundConnection(ws, "a@x.com", queue_size=1, policy="disconnect")
+        conn.start()
+        conn.send("1")
+        await settle()
+        conn.send("2")
+        assert conn.send("3") is False
+        await settle()
+        return ws, conn
+
+    ws, conn = asyncio.run(run())
+    assert conn.closed and ws.closed_with == SLOW_CONSUMER_CLOSE_CODE
+    assert ws.sent == [] and conn.lossy
+
+
+def test_send_and_wait_reports_frames_that_never_reached_the_socket():
+    async def run():
+        ws = SlowWebSocket(released=False)
+        conn = OutboundConnection(ws, "a@x.com")
+        conn.start()
+        first = asyncio.ensure_future(conn.send_and_wait("1"))
+        second = asyncio.ensure_future(conn.send_and_wait("2"))
+        await settle()
+        ws.broken = True
+        ws.release.set()
+        return await first, await second, conn
+
+    first, second, conn = asyncio.run(run())
+    assert (first, second) == (False, False)
+    assert conn.failed and conn.unsent == 1 and conn.lossy
+
+
+def test_send_and_wait_times_out():
+    async def run():
+        conn = OutboundConnection(SlowWebSocket(released=False), "a@x.com")
+        conn.start()
+        result = await conn.send_and_wait("1", timeout=0.01)
+        conn.stop()
+        await settle()
+        return result, conn
+
+    result, conn = asyncio.run(run())
+    assert result is False and conn.closed
@@ -0,0 +1,127 @@
+import asyncio
+import re
+
+import directory
+from directory import EmployeeDirectory
+
+
+def matches(doc, query):
+    for field, want in query.items():
+        if field == "$or":
+            if not any(matches(doc, q) for q in want):
+                return False
+        elif isinstance(want, re.Pattern):
+            if not want.match(str(doc.get(field, ""))):
+                return False
+        elif doc.get(field) != want:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = list(docs)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.docs:
+            raise StopAsyncIteration
+        return self.docs.pop(0)
+
+
+class FakeCollection:
+    def __init__(self, name, docs):
+        self.name = name
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        return FakeCursor(d for d in self.docs if matches(d, query))
+
+    async def find_one(self, query, projection=None):
+        doc = next((dict(d) for d in self.docs if matches(d, query)), None)
+        hidden = {k for k, v in (projection or {}).items() if v == 0}
+        return doc and {k: v for k, v in doc.items() if k not in hidden}
+
+
+class FakeDB:
+    def __init__(self, collections):
+        self.collections = {name: FakeCollection(name, docs) for name, docs in collections.items()}
+
+    async def list_collection_names(self):
+        return list(self.collections)
+
+    def __getitem__(self, name):
+        return self.collections[name]
+
+
+def make_directory():
+    db = FakeDB({
+        "Data": [{"email": "Ann@x.com", "id": "u1", "empCode": "E1", "name": "Ann", "team": "Data"}],
+        "Ops": [{"Email ID": "bob@x.com", "Emp code": " E2 ", "Name": "Bob", "active": False}],
+        "facebook_posts": [{"email": "post@x.com"}],
+    })
+    d = EmployeeDirectory(db)
+    asyncio.run(d.load())
+    return d, db
+
+
+def test_load_indexes_email_id_and_code_case_insensitively():
+    d, _ = make_directory()
+    assert d.entry("ANN@X.COM")["collection"] == "Data"
+    assert d.entry("u1")["email"] == "Ann@x.com"
+    assert d.entry("e1")["name"] == "Ann"
+    assert d.entry("Ann%40x.com")["id"] == "u1"          # URL-encoded keys
+    assert d.entry("e1", ("email",)) is None             # restricted to some fields
+    assert d.entry("") is None
+
+
+def test_legacy_field_names_and_non_team_collections():
+    d, _ = make_directory()
+    bob = d.entry("E2")
+    assert (bob["email"], bob["name"], bob["active"], bob["collection"]) == ("bob@x.com", "Bob", False, "Ops")
+    assert d.entry("post@x.com") is None
+    assert sorted(e["email"] for e in d.entries()) == ["Ann@x.com", "bob@x.com"]
+
+
+def test_put_replaces_changed_keys_and_notifies():
+    d, _ = make_directory()
+    seen = []
+    d.subscribe(lambda old, new: seen.append((old and old["email"], new and new["email"])))
+    version = d.version
+    old = d.entry("u1")
+    d.put({"email": "ann.new@x.com", "id": "u1", "empCode": "E1"}, "Data", replacing=old)
+    assert d.entry("Ann@x.com") is None
+    assert d.entry("u1")["email"] == d.entry("E1")["email"] == "ann.new@x.com"
+    d.discard("ann.new@x.com")
+    assert d.entry("u1") is None and d.entry("E1") is None
+    assert seen == [("Ann@x.com", "ann.new@x.com"), ("ann.new@x.com", None)]
+    assert d.version == version + 2
+
+
+def test_fetch_reads_the_owning_collection_and_scans_for_unknown_users():
+    d, db = make_directory()
+    user, collection = asyncio.run(d.fetch("ann@x.com"))
+    assert user["name"] == "Ann" and collection.name == "Data"
+
+    # Created by another process after the load: found by the scan, then cached.
+    db["Ops"].docs.append({"email": "cara@x.com", "empCode": "E3", "password_hash": "h"})
+    user, collection = asyncio.run(d.fetch("CARA@x.com"))
+    assert collection.name == "Ops" and "password_hash" not in user
+    assert d.entry("E3")["email"] == "cara@x.com"
+
+    assert asyncio.run(d.fetch("nobody@x.com")) == (None, None)
+
+
+def test_fetch_drops_a_stale_entry():
+    d, db = make_directory()
+    db["Data"].docs.clear()
+    assert asyncio.run(d.fetch("ann@x.com")) == (None, None)
+    assert d.entry("ann@x.com") is None
+
+
+def test_is_team_collection():
+    assert directory.is_team_collection("Data")
+    assert not directory.is_team_collection("system.views")
+    assert not directory.is_team_collection("ap_mapping")
@@ -0,0 +1,134 @@
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+
+import download_file
+from database import get_grid_fs
+
+
+class FakeDownloadStream:
+    def __init__(self, data: bytes, sha256: str):
+        self.data = data
+        self.metadata = {"contentType": "image/jpeg", "sha256": sha256}
+        self.filename = "photo.jpg"
+        self.length = len(data)
+        self.upload_date = datetime(2024, 1, 1)
+        self.chunk_size = 4
+        self.pos = 0
+
+    def seek(self, pos):
+        self.pos = pos
+
+    async def read(self, size):
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return chunk
+
+
+class FakeGridFS:
+    def __init__(self, files):
+        self.files = files
+
+    async def open_download_stream(self, file_id):
+        data, sha256 = self.files[file_id]
+        return FakeDownloadStream(data, sha256)
+
+
+def make_client(monkeypatch, files, renditions):
+    async def find_rendition(db, file_id, variant):
+        return renditions.get((file_id, variant))
+
+    monkeypatch.setattr(download_file, "find_rendition", find_rendition)
+    app = FastAPI()
+    app.include_router(download_file.router)
+    app.dependency_overrides[get_grid_fs] = lambda: FakeGridFS(files)
+    return TestClient(app)
+
+
+def test_missing_rendition_falls_back_without_immutable_caching(monkeypatch):
+    original = ObjectId()
+    client = make_client(monkeypatch, {original: (b"full-size-bytes", "abc")}, {})
+
+    response = client.get(f"/files/download/{original}?size=thumb")
+    assert response.status_code == 200
+    assert response.content == b"full-size-bytes"
+    assert response.headers["etag"] == '"abc-original"'
+    assert "immutable" not in response.headers["cache-control"]
+
+    response = client.get(f"/files/download/{original}")
+    assert response.headers["etag"] == '"abc"'
+    assert response.headers["cache-control"] == download_file.CACHE_CONTROL
+
+
+def test_generated_rendition_is_immutable(monkeypatch):
+    original, thumb = ObjectId(), ObjectId()
+    client = make_client(monkeypatch, {original: (b"full", "abc"), thumb: (b"small", "def")},
+                         {(original, "thumb"): thumb})
+
+    response = client.get(f"/files/download/{original}?size=thumb",
+                          headers={"If-None-Match": '"abc-original"'})
+    assert response.status_code == 200
+    assert response.content == b"small"
+    assert response.headers["etag"] == '"def"'
+    assert response.headers["cache-control"] == download_file.CACHE_CONTROL
+
+
+def request_with(headers: dict) -> Request:
+    return Request({"type": "http", "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]})
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-3", (0, 3)),
+    ("bytes=4-", (4, 9)),          # open-ended
+    ("bytes=-3", (7, 9)),          # suffix: last 3 bytes
+    ("bytes=-50", (0, 9)),         # suffix longer than the file
+    ("bytes=5-500", (5, 9)),       # end clamped to the file
+    ("bytes=0-1,4-5", None),       # multi-range: serve the whole file
+    ("items=0-3", None),
+    ("bytes=a-b", None),
+    ("bytes=-", None),
+])
+def test_parse_range(header, expected):
+    assert download_file.parse_range(header, 10) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=10-", "bytes=10-20", "bytes=6-2"])
+def test_unsatisfiable_range_is_a_416(header):
+    with pytest.raises(HTTPException) as e:
+        download_file.parse_range(header, 10)
+    assert e.value.status_code == 416
+    assert e.value.headers["Content-Range"] == "bytes */10"
+
+
+def test_not_modified_matches_if_none_match_lists():
+    modified = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    assert download_file.not_modified(request_with({"If-None-Match": '"x", "abc"'}), '"abc"', modified)
+    assert download_file.not_modified(request_with({"If-None-Match": "*"}), '"abc"', modified)
+    assert not download_file.not_modified(request_with({"If-None-Match": '"x", "y"'}), '"abc"', modified)
+    # If-None-Match wins over If-Modified-Since
+    assert not download_file.not_modified(
+        request_with({"If-None-Match": '"x"', "If-Modified-Since": "Tue, 02 Jan 2024 00:00:00 GMT"}), '"abc"', modified)
+
+
+def test_not_modified_since():
+    modified = datetime(2024, 1, 1, 12, 0, 0, 500000, tzinfo=timezone.utc)
+    assert download_file.not_modified(request_with({"If-Modified-Since": "Mon, 01 Jan 2024 12:00:00 GMT"}), '"a"', modified)
+    assert not download_file.not_modified(request_with({"If-Modified-Since": "Mon, 01 Jan 2024 11:59:59 GMT"}), '"a"', modified)
+    assert not download_file.not_modified(request_with({"If-Modified-Since": "yesterday"}), '"a"', modified)
+    assert not download_file.not_modified(request_with({}), '"a"', modified)
+
+
+def test_range_request_streams_partial_content(monkeypatch):
+    original = ObjectId()
+    client = make_client(monkeypatch, {original: (b"0123456789", "abc")}, {})
+
+    response = client.get(f"/files/download/{original}", headers={"Range": "bytes=3-8"})
+    assert response.status_code == 206
+    assert response.content == b"345678"
+    assert response.headers["content-range"] == "bytes 3-8/10"
+
+    assert client.get(f"/files/download/{original}", headers={"If-None-Match": '"abc"'}).status_code == 304
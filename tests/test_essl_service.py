@@ -0,0 +1,82 @@
+import html
+import re
+from datetime import datetime
+
+import pytest
+
+import essl_service
+from essl_service import IST, ESSLRequestError, PunchStream, iter_punches, parse_punches
+
+
+def test_parse_time_accepts_what_strptime_accepts():
+    expected = datetime(2024, 1, 5, 9, 3, tzinfo=IST)
+    assert essl_service._parse_time("2024-01-05 09:03:00") == expected
+    assert essl_service._parse_time("2024-1-5 9:03:00") == expected
+    assert essl_service._parse_time("2024-13-05 09:03:00") is None
+    assert essl_service._parse_time("2024-01-05 09:03") is None
+    assert essl_service._parse_time("") is None
+
+
+ROWS = "\n".join([
+    "101\t2024-01-05 09:03:00\t1\t0",
+    "  102\t2024-01-05 18:30:15  ",
+    "103    2024-01-05 10:00:00    extra",   # space-separated
+    "104\t2024-1-5 9:03:00",                 # not zero-padded
+    "105\t2024-13-05 09:03:00",              # invalid month: dropped
+    "106\tnot a time",
+    "lonely",
+    "",
+    "107\t2024-01-06 07:59:59\tA&B <door>",  # escaped in the XML
+])
+
+SOAP_BODY = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+    '<soap:Body><GetTransactionsLogResponse xmlns="http://tempuri.org/">'
+    '<GetTransactionsLogResult>true</GetTransactionsLogResult>'
+    f'<strDataList>{html.escape(ROWS, quote=False)}</strDataList>'
+    '</GetTransactionsLogResponse></soap:Body></soap:Envelope>'
+).encode("utf-8")
+
+
+def baseline_punches(body: str, serial="", device=""):
+    """The regex extraction and parser the streaming parser replaced."""
+    raw = html.unescape(re.search(r"<strDataList>(.*?)</strDataList>", body, re.DOTALL).group(1))
+    punches = []
+    for line in raw.splitlines():
+        line = line.strip()
+        if not line: continue
+        parts = line.split("\t") if "\t" in line else re.split(r"\s{2,}", line)
+        if len(parts) < 2: continue
+        try:
+            dt = datetime.strptime(parts[1].strip(), "%Y-%m-%d %H:%M:%S").replace(tzinfo=IST)
+        except ValueError:
+            continue
+        punches.append({"user_id": parts[0].strip(), "punch_time": dt,
+                        "serial": serial, "device": device or serial,
+                        "extra": parts[2:] if len(parts) > 2 else [], "raw": line})
+    return punches
+
+
+def test_parse_punches_matches_baseline():
+    expected = baseline_punches(SOAP_BODY.decode("utf-8"), "S1", "Door")
+    assert [p["user_id"] for p in expected] == ["101", "102", "103", "104", "107"]
+    assert parse_punches(ROWS, "S1", "Door") == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, len(SOAP_BODY)])
+def test_punch_stream_matches_baseline_for_any_chunking(chunk_size):
+    chunks = [SOAP_BODY[i:i + chunk_size] for i in range(0, len(SOAP_BODY), chunk_size)]
+    assert list(iter_punches(chunks, "S1")) == baseline_punches(SOAP_BODY.decode("utf-8"), "S1")
+
+
+def test_punch_stream_reports_result_without_data_list():
+    stream = PunchStream("S1")
+    stream.feed(b"<Envelope><GetTransactionsLogResult>Invalid serial</GetTransactionsLogResult></Envelope>")
+    with pytest.raises(ESSLRequestError, match="Invalid serial"):
+        stream.close()
+
+
+def test_punch_stream_rejects_malformed_xml():
+    with pytest.raises(ESSLRequestError, match="malformed"):
+        list(iter_punches([b"<Envelope><strDataList>101\t2024-01-05 09:03:00</Envel"], "S1"))
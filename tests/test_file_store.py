@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import io
+
+import pytest
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.testclient import TestClient
+from starlette.datastructures import Headers
+
+import file_store
+
+
+def make_client(max_bytes):
+    app = FastAPI()
+    handled = []
+
+    @app.post("/api/files/upload")
+    async def upload(file: UploadFile = File(...)):
+        handled.append(file.filename)
+        return {"ok": True}
+
+    app.add_middleware(file_store.UploadLimitMiddleware, paths=["/api/files/upload"], max_bytes=max_bytes)
+    return TestClient(app), handled
+
+
+def multipart(payload: bytes) -> bytes:
+    return (b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.bin\"\r\n"
+            b"Content-Type: application/octet-stream\r\n\r\n" + payload + b"\r\n--b--\r\n")
+
+
+def test_small_upload_passes():
+    client, handled = make_client(max_bytes=1000)
+    response = client.post("/api/files/upload", files={"file": ("a.bin", b"x" * 100)})
+    assert response.status_code == 200
+    assert handled == ["a.bin"]
+
+
+def test_declared_oversize_upload_is_rejected_before_reading(monkeypatch):
+    monkeypatch.setattr(file_store, "MAX_UPLOAD_BYTES", 0)
+    monkeypatch.setattr(file_store, "_MULTIPART_OVERHEAD", 100)
+    client, handled = make_client(max_bytes=10 ** 9)
+    response = client.post("/api/files/upload", files={"file": ("a.bin", b"x" * 500)})
+    assert response.status_code == 413
+    assert handled == []
+
+
+def test_chunked_oversize_upload_is_cut_off_while_received():
+    client, handled = make_client(max_bytes=1000)
+    body = multipart(b"x" * 5000)
+
+    def chunks():
+        for i in range(0, len(body), 256):
+            yield body[i:i + 256]
+
+    response = client.post("/api/files/upload", content=chunks(),
+                           headers={"Content-Type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+    assert handled == []
+
+
+class FakeGridIn:
+    _id = "new"
+
+    def __init__(self, stored):
+        self.stored = stored
+        self.data = b""
+
+    async def write(self, chunk):
+        self.data += chunk
+
+    async def close(self):
+        self.stored.append(self.data)
+
+    async def abort(self):
+        pass
+
+
+class FakeGridFS:
+    def __init__(self):
+        self.stored = []
+
+    def open_upload_stream(self, filename, metadata):
+        return FakeGridIn(self.stored)
+
+
+class FakeFiles:
+    def __init__(self, existing):
+        self.existing = existing
+
+    async def find_one(self, query, projection):
+        return self.existing
+
+
+def store(existing):
+    grid_fs = FakeGridFS()
+    upload = UploadFile(io.BytesIO(b"x" * 3000), filename="a.bin",
+                        headers=Headers({"content-type": "application/pdf"}))
+    result = asyncio.run(file_store.store_upload(upload, grid_fs, {"fs.files": FakeFiles(existing)}))
+    return result, grid_fs.stored
+
+
+def test_new_content_is_written_once():
+    (file_id, size, digest), stored = store(existing=None)
+    assert (file_id, size) == ("new", 3000)
+    assert digest == hashlib.sha256(b"x" * 3000).hexdigest()
+    assert [len(data) for data in stored] == [3000]
+
+
+def test_duplicate_never_reaches_gridfs():
+    (file_id, size, _), stored = store(existing={"_id": "old"})
+    assert (file_id, size) == ("old", 3000)
+    assert stored == []
+
+
+def test_oversize_spooled_upload_is_rejected_before_gridfs(monkeypatch):
+    monkeypatch.setattr(file_store, "MAX_UPLOAD_BYTES", 2000)
+    monkeypatch.setattr(file_store, "UPLOAD_CHUNK_SIZE", 512)
+    with pytest.raises(HTTPException) as e:
+        store(existing=None)
+    assert e.value.status_code == 413
+
+
+def test_oversize_content_length_is_checked_with_multipart_slack():
+    file_store.check_declared_size(None)
+    file_store.check_declared_size("not a number")
+    file_store.check_declared_size(str(file_store.MAX_UPLOAD_BYTES + file_store._MULTIPART_OVERHEAD))
+    with pytest.raises(HTTPException):
+        file_store.check_declared_size(str(file_store.MAX_UPLOAD_BYTES + file_store._MULTIPART_OVERHEAD + 1))
@@ -0,0 +1,51 @@
+import base64
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException, Response
+
+import history
+
+
+def test_cursor_round_trip():
+    ts = datetime(2024, 3, 1, 9, 30, 15, 123000, tzinfo=timezone.utc)
+    assert history.decode_cursor(history.encode_cursor({"timestamp": ts, "id": "m:1"})) == (ts, "m:1")
+
+
+def test_cursor_treats_naive_timestamps_as_utc():
+    naive = datetime(2024, 3, 1, 9, 30)
+    ts, message_id = history.decode_cursor(history.encode_cursor({"timestamp": naive, "id": "m1"}))
+    assert ts == naive.replace(tzinfo=timezone.utc) and message_id == "m1"
+
+
+def test_cursor_is_url_safe():
+    cursor = history.encode_cursor({"timestamp": datetime.now(timezone.utc), "id": "??>>"})
+    assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor!",
+    base64.urlsafe_b64encode(b"no-separator").decode(),
+    base64.urlsafe_b64encode(b"soon:m1").decode(),
+    base64.urlsafe_b64encode(b"\xff\xfe:m1").decode(),
+])
+def test_tampered_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as e:
+        history.decode_cursor(cursor)
+    assert e.value.status_code == 400
+
+
+def test_keyset_breaks_timestamp_ties_on_id():
+    ts = datetime(2024, 3, 1, tzinfo=timezone.utc)
+    keyset = history._keyset(history.encode_cursor({"timestamp": ts, "id": "m5"}), older=True)
+    assert keyset == {"$or": [{"timestamp": {"$lt": ts}}, {"timestamp": ts, "id": {"$lt": "m5"}}]}
+
+
+def test_page_headers():
+    older = {"timestamp": datetime(2024, 3, 1, tzinfo=timezone.utc), "id": "a"}
+    newer = {"timestamp": datetime(2024, 3, 2, tzinfo=timezone.utc), "id": "b"}
+    response = Response()
+    history.set_page_headers(response, [older, newer], has_more=False, newer_page=False)
+    assert "X-Next-Before" not in response.headers
+    assert history.decode_cursor(response.headers["X-Next-After"])[1] == "b"
+    assert response.headers["X-Has-More"] == "false"
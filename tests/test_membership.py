@@ -0,0 +1,55 @@
+from directory import EmployeeDirectory
+from membership import ChannelMembership, channel_ids_for
+
+
+def test_channel_ids_for():
+    assert channel_ids_for(None) == ["general"]
+    assert channel_ids_for({"team": "Propagation"}) == ["general", "dept-dmc", "team-propagation"]
+    assert channel_ids_for({"team": "Digital Marketing/Networking"}) == \
+        ["general", "dept-dmc", "team-digital-marketing/networking"]
+    # A department named directly is added once, even when the team implies it.
+    assert channel_ids_for({"team": "HR", "department": "hr"}) == ["general", "dept-hr", "team-hr"]
+    assert channel_ids_for({"team": "Unknown", "department": "Media"}) == \
+        ["general", "dept-media", "team-unknown"]
+
+
+def make_membership():
+    directory = EmployeeDirectory(db=None)
+    membership = ChannelMembership(directory)
+    directory.put({"email": "ann@x.com", "team": "Data"}, "Data")
+    directory.put({"email": "bob@x.com", "team": "HIVE"}, "HIVE")
+    directory.put({"email": "gone@x.com", "team": "Data", "active": False}, "Data")
+    return directory, membership
+
+
+def test_membership_follows_directory_changes():
+    directory, membership = make_membership()
+    assert membership.members("general") == {"ann@x.com", "bob@x.com"}
+    assert membership.members("team-data") == {"ann@x.com"}
+    assert membership.channels("gone@x.com") is None
+
+    # Team change moves the user between channels.
+    directory.put({"email": "ann@x.com", "team": "HIVE"}, "HIVE")
+    assert membership.members("team-data") == set()
+    assert membership.members("dept-dmc") == {"ann@x.com", "bob@x.com"}
+
+    # Deactivation and deletion drop the user everywhere.
+    directory.put({"email": "bob@x.com", "team": "HIVE", "active": False}, "HIVE")
+    directory.discard("ann@x.com")
+    assert membership.members("general") == set()
+    assert membership.channels("ann@x.com") is None
+
+
+def test_slash_and_dash_channel_ids_are_the_same_channel():
+    directory, membership = make_membership()
+    directory.put({"email": "cy@x.com", "team": "Digital Marketing/Networking"}, "DMN")
+    assert membership.members("team-digital-marketing/networking") == {"cy@x.com"}
+    assert membership.members("team-digital-marketing-networking") == {"cy@x.com"}
+
+
+def test_rebuild_matches_incremental_updates():
+    directory, membership = make_membership()
+    incremental = {cid: set(membership.members(cid)) for cid in ("general", "team-data", "dept-dmc", "team-hive")}
+    membership._members, membership._channels = {}, {}
+    membership._on_directory_change(None, None)
+    assert {cid: membership.members(cid) for cid in incremental} == incremental
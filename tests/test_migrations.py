@@ -0,0 +1,71 @@
+import asyncio
+from types import SimpleNamespace
+
+from pymongo.errors import DuplicateKeyError
+
+import migrations
+
+
+class FakeMigrations:
+    """The few Migrations collection calls run_once makes, over a dict."""
+
+    def __init__(self):
+        self.docs = {}
+
+    async def insert_one(self, doc):
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError("duplicate")
+        self.docs[doc["_id"]] = dict(doc)
+
+    async def update_one(self, query, update):
+        doc = self.docs.get(query["_id"])
+        matched = doc is not None and all(
+            doc.get(key) == value for key, value in query.items() if not isinstance(value, dict))
+        if matched and "started_at" in query:
+            matched = doc["started_at"] < query["started_at"]["$lt"]
+        if matched:
+            doc.update(update["$set"])
+        return SimpleNamespace(modified_count=int(matched))
+
+    async def delete_one(self, query):
+        if self.docs.get(query["_id"], {}).get("owner") == query["owner"]:
+            del self.docs[query["_id"]]
+
+
+def test_runs_once_across_concurrent_callers():
+    async def run():
+        db = SimpleNamespace(Migrations=FakeMigrations())
+        calls = []
+
+        async def migrate():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 3
+
+        ran = await asyncio.gather(*(migrations.run_once(db, "m", migrate) for _ in range(3)))
+        ran.append(await migrations.run_once(db, "m", migrate))
+        return ran, calls, db.Migrations.docs["m"]
+
+    ran, calls, marker = asyncio.run(run())
+    assert ran == [True, False, False, False]
+    assert len(calls) == 1
+    assert marker["state"] == "done" and marker["result"] == 3
+
+
+def test_failed_run_is_retried():
+    async def run():
+        db = SimpleNamespace(Migrations=FakeMigrations())
+
+        async def broken():
+            raise RuntimeError("boom")
+
+        async def fixed():
+            return 0
+
+        first = await migrations.start(db, "m", broken)
+        second = await migrations.run_once(db, "m", fixed)
+        return first, second, migrations._tasks
+
+    first, second, tasks = asyncio.run(run())
+    assert (first, second) == (False, True)
+    assert not tasks
@@ -0,0 +1,76 @@
+import importlib
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def agent(monkeypatch, tmp_path):
+    monkeypatch.setenv("ATTENDANCE_MONGO_URL", "mongodb://localhost:1")
+    monkeypatch.setenv("ESSL_SPOOL_PATH", str(tmp_path / "spool.sqlite3"))
+    for name in ("ESSL_POLL_SECONDS", "ESSL_POLL_FAST_SECONDS", "ESSL_POLL_SLOW_SECONDS",
+                 "ESSL_FAST_HOURS", "ESSL_SLOW_HOURS", "ESSL_AGENT_LOOKBACK_HOURS", "ESSL_DELTA_OVERLAP_MINUTES"):
+        monkeypatch.delenv(name, raising=False)
+    sys.modules.pop("essl_office_agent", None)
+    module = importlib.import_module("essl_office_agent")
+    yield module
+    sys.modules.pop("essl_office_agent", None)
+
+
+def test_poll_failure_is_counted_not_raised(agent, monkeypatch):
+    def broken():
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(agent, "sync_once", broken)
+    assert agent.poll_safely() is False
+    assert agent.poll_safely() is False
+    assert agent.metrics.counters["essl_agent_loop_errors_total"] == 2
+    assert "essl_agent_loop_errors_total 2" in agent.metrics.render()
+
+
+def test_successful_poll(agent, monkeypatch):
+    monkeypatch.setattr(agent, "sync_once", lambda: None)
+    assert agent.poll_safely() is True
+    assert agent.metrics.counters["essl_agent_loop_errors_total"] == 0
+
+
+def at(hh, mm):
+    return datetime(2024, 3, 1, hh, mm)
+
+
+def test_parse_hours_skips_bad_ranges(agent):
+    assert agent._parse_hours("08:30-10:00, bad ,21:00-07:00,") == [(510, 600), (1260, 420)]
+
+
+@pytest.mark.parametrize("hh, mm, expected", [
+    (8, 29, "POLL"),
+    (8, 30, "POLL_FAST"),
+    (9, 59, "POLL_FAST"),
+    (10, 0, "POLL"),
+    (12, 0, "POLL_FAST"),
+    (20, 59, "POLL"),
+    (21, 0, "POLL_SLOW"),      # the night range wraps past midnight
+    (0, 0, "POLL_SLOW"),
+    (6, 59, "POLL_SLOW"),
+    (7, 0, "POLL"),
+])
+def test_poll_interval(agent, hh, mm, expected):
+    assert agent.poll_interval(at(hh, mm)) == getattr(agent, expected)
+
+
+def test_window_for_a_new_device_looks_back(agent):
+    now = at(12, 0)
+    assert agent._window(None, now) == now - agent.LOOKBACK
+
+
+def test_window_resumes_before_the_cursor(agent):
+    synced_to = at(12, 0)
+    assert agent._window({"synced_to": synced_to, "last_punch": None}, at(13, 0)) == synced_to - agent.OVERLAP
+
+    last_punch = synced_to - timedelta(hours=2)
+    assert agent._window({"synced_to": synced_to, "last_punch": last_punch}, at(13, 0)) == last_punch
+
+    stale = synced_to - timedelta(days=3)
+    assert agent._window({"synced_to": synced_to, "last_punch": stale}, at(13, 0)) == \
+        synced_to - agent.MAX_RESUME_LOOKBACK
@@ -0,0 +1,34 @@
+import asyncio
+
+from presence import PresenceService
+
+
+def make_presence(epoch, users=("a", "b")):
+    async def run():
+        presence = PresenceService(lambda frame: None, epoch=epoch, flush_interval=0.01)
+        for user_id in users:
+            presence.set(user_id, "online")
+            presence.flush()
+        return presence
+
+    return asyncio.run(run())
+
+
+def test_changes_since():
+    presence = make_presence("w1")
+    assert presence.version_tag == "w1:2"
+    assert presence.changes_since("w1:2") == {}
+    assert presence.changes_since("w1:1") == {"b": "online"}
+    assert presence.changes_since("w1:0") == {"a": "online", "b": "online"}
+    # Ahead of this process's counter (e.g. from before a restart): snapshot.
+    assert presence.changes_since("w1:7") is None
+    assert presence.changes_since("") is None
+    assert presence.changes_since("garbage") is None
+
+
+def test_version_from_another_worker_forces_snapshot():
+    first, second = make_presence("w1"), make_presence("w2", users=("a", "b", "c"))
+    # "w1:2" is behind w2's counter, but counts nothing on w2.
+    assert second.version == 3
+    assert second.changes_since(first.version_tag) is None
+    assert second.changes_since("w2:2") == {"c": "online"}
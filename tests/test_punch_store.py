@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import punch_store
+
+T0 = datetime(2024, 3, 1, tzinfo=timezone.utc)
+DEVICES = [{"serial": "S1", "name": "Gate"}]
+
+
+def hours(n):
+    return T0 + timedelta(hours=n)
+
+
+def run_concurrent_pulls(monkeypatch, first, second):
+    """Start a pull for `first`, then request `second` while it is running.
+    Returns the ranges actually pulled, in order, and the second result."""
+    pulled = []
+    marks = {}
+
+    async def load_watermarks():
+        return dict(marks)
+
+    async def pull(windows, _marks, start, end):
+        pulled.append((start, end))
+        await asyncio.sleep(0.05)
+        marks["S1"] = {"serial": "S1", "synced_from": start, "synced_to": end, "last_punch": None}
+        return [{"serial": "S1", "device": "Gate", "ok": True, "count": 0}]
+
+    monkeypatch.setattr(punch_store, "list_devices", lambda: DEVICES)
+    monkeypatch.setattr(punch_store, "_load_watermarks", load_watermarks)
+    monkeypatch.setattr(punch_store, "_pull", pull)
+
+    async def run():
+        task = asyncio.create_task(punch_store.pull_delta(*first))
+        await asyncio.sleep(0.01)
+        result = await punch_store.pull_delta(*second)
+        await task
+        return result
+
+    return pulled, asyncio.run(run())
+
+
+def test_request_inside_running_pull_does_not_wait(monkeypatch):
+    pulled, reports = run_concurrent_pulls(monkeypatch, (hours(0), hours(10)), (hours(2), hours(5)))
+    assert pulled == [(hours(0), hours(10))]
+    assert reports[0]["in_progress"] is True
+
+
+def test_request_outside_running_pull_waits_and_pulls_the_rest(monkeypatch):
+    pulled, reports = run_concurrent_pulls(monkeypatch, (hours(0), hours(10)), (hours(-5), hours(5)))
+    assert pulled == [(hours(0), hours(10)), (hours(-5), hours(5))]
+    assert "in_progress" not in reports[0]
+
+
+def test_covered():
+    inflight = {"S1": [(hours(0), hours(10))]}
+    assert punch_store._covered({"S1": [(hours(1), hours(10))]}, inflight)
+    assert punch_store._covered({"S1": []}, inflight)
+    assert not punch_store._covered({"S1": [(hours(-1), hours(2))]}, inflight)
+    assert not punch_store._covered({"S2": [(hours(1), hours(2))]}, inflight)
+
+
+def test_windows_without_a_watermark_pull_everything():
+    assert punch_store._windows(None, hours(0), hours(10)) == [(hours(0), hours(10))]
+    assert punch_store._windows({"synced_from": hours(0)}, hours(0), hours(10)) == [(hours(0), hours(10))]
+
+
+def test_windows_skip_the_covered_span():
+    mark = {"synced_from": hours(2), "synced_to": hours(8), "last_punch": None}
+    assert punch_store._windows(mark, hours(3), hours(7)) == []
+    assert punch_store._windows(mark, hours(0), hours(5)) == [(hours(0), hours(2))]
+    assert punch_store._windows(mark, hours(0), hours(10)) == [
+        (hours(0), hours(2)), (hours(8) - punch_store.DELTA_OVERLAP, hours(10))]
+
+
+def test_windows_resume_at_the_last_punch_within_the_lookback():
+    recent = hours(8) - punch_store.DELTA_OVERLAP - timedelta(minutes=1)
+    mark = {"synced_from": hours(0), "synced_to": hours(8), "last_punch": recent}
+    assert punch_store._windows(mark, hours(0), hours(10)) == [(recent, hours(10))]
+
+    # A device that has been quiet for long: resume no further back than the lookback.
+    mark["last_punch"] = hours(8) - punch_store.MAX_RESUME_LOOKBACK - timedelta(hours=1)
+    assert punch_store._windows(mark, hours(0), hours(10)) == [
+        (hours(8) - punch_store.MAX_RESUME_LOOKBACK, hours(10))]
+
+    # A last punch after synced_to - overlap never shrinks the overlap.
+    mark["last_punch"] = hours(8)
+    assert punch_store._windows(mark, hours(0), hours(10)) == [(hours(8) - punch_store.DELTA_OVERLAP, hours(10))]
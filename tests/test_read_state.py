@@ -0,0 +1,23 @@
+import asyncio
+
+from read_state import ReadBatcher
+
+
+def test_add_during_flush_is_applied():
+    async def run():
+        applied = []
+
+        async def apply(user_id, kind, conversation_id, message_ids, whole_conversation):
+            await asyncio.sleep(0.05)
+            applied.append((user_id, conversation_id, message_ids, whole_conversation))
+
+        batcher = ReadBatcher(apply, flush_delay=0.01)
+        batcher.add("a", "direct", "b", ["m1"])
+        batcher.add("a", "direct", "b", ["m2"])
+        await asyncio.sleep(0.03)      # flush is awaiting apply() for the first batch
+        batcher.add("a", "channel", "c", whole_conversation=True)
+        await asyncio.sleep(0.2)
+        return applied
+
+    applied = asyncio.run(run())
+    assert applied == [("a", "b", ["m1", "m2"], False), ("a", "c", [], True)]
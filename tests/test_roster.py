@@ -0,0 +1,61 @@
+import asyncio
+
+import attendance
+from directory import EmployeeDirectory
+from roster import Roster
+
+EMPLOYEES = [
+    {"email": "mia@x.com", "empCode": "M1", "name": "Mia", "designation": "Team Manager", "shift": "10:00"},
+    {"email": "ann@x.com", "empCode": "E1", "name": "Ann", "designation": "Analyst", "Reviewer": "mia "},
+    {"email": "bob@x.com", "empCode": "E2", "name": "", "designation": "Analyst", "reviewer": "Mia"},
+    {"Emp code": "E3", "Name": "Cy", "Designation": "Director"},    # no email
+]
+
+
+def make_roster(monkeypatch):
+    directory = EmployeeDirectory(db=None)
+
+    async def ensure_fresh():
+        pass
+
+    monkeypatch.setattr(directory, "ensure_fresh", ensure_fresh)
+    for doc in EMPLOYEES:
+        directory.put(doc, "Team")
+    return directory, Roster(directory)
+
+
+def test_roster_views(monkeypatch):
+    _, roster = make_roster(monkeypatch)
+    asyncio.run(roster.ensure_fresh())
+    assert roster.names() == {"M1": "Mia", "E1": "Ann", "E2": "—", "E3": "Cy"}
+    assert roster.shift("m1") == "10:00" and roster.shift("nobody") == ""
+    assert roster.entry("e3")["designation"] == "Director"
+    assert sorted(e["empCode"] for e in roster.reports_to("MIA")) == ["E1", "E2"]
+
+
+def test_roster_rebuilds_only_when_the_directory_changes(monkeypatch):
+    directory, roster = make_roster(monkeypatch)
+    asyncio.run(roster.ensure_fresh())
+    names = roster.names()
+    asyncio.run(roster.ensure_fresh())
+    assert roster.names() is names
+
+    directory.put({"email": "ann@x.com", "empCode": "E1", "name": "Ann B", "reviewer": "Cy"}, "Team")
+    asyncio.run(roster.ensure_fresh())
+    assert roster.version == directory.version
+    assert roster.names()["E1"] == "Ann B"
+    assert [e["empCode"] for e in roster.reports_to("Mia")] == ["E2"]
+
+
+def test_manager_details_come_from_the_roster(monkeypatch):
+    _, roster = make_roster(monkeypatch)
+    monkeypatch.setattr(attendance, "roster", roster)
+
+    details = asyncio.run(attendance.find_manager_details_by_code("M1"))
+    assert (details["managerName"], details["managerId"]) == ("Mia", "M1")
+    assert [e["empCode"] for e in details["team"]] == ["M1", "E1", "E2"]
+
+    # A director with no reports still gets a (one-person) team; an analyst does not.
+    assert [e["empCode"] for e in asyncio.run(attendance.find_manager_details_by_code("E3"))["team"]] == ["E3"]
+    assert asyncio.run(attendance.find_manager_details_by_code("E1")) == \
+        {"managerName": None, "managerId": None, "team": []}
@@ -0,0 +1,49 @@
+import asyncio
+import json
+
+from unread import UnreadCounters
+
+
+def make_counters(db, pushed, push_delay=0.0):
+    async def compute(user_id):
+        return dict(db.get(user_id, {}))
+
+    async def push(payload, user_id):
+        await asyncio.sleep(push_delay)
+        pushed.append((user_id, json.loads(payload)["counts"]))
+
+    return UnreadCounters(compute, push, is_online=lambda user_id: True, flush_delay=0.01)
+
+
+def test_mark_during_flush_is_pushed():
+    async def run():
+        pushed = []
+        counters = make_counters({"a": {"x": 1}, "b": {}}, pushed, push_delay=0.05)
+        await counters.load("a")
+        await counters.load("b")
+        counters.bump(["a"], "x")
+        await asyncio.sleep(0.03)      # flush has started and is awaiting push("a")
+        counters.bump(["b"], "y")
+        await asyncio.sleep(0.2)
+        return pushed
+
+    pushed = asyncio.run(run())
+    assert ("a", {"x": 2}) in pushed
+    assert ("b", {"y": 1}) in pushed
+
+
+def test_rebuild_recomputes_from_source():
+    async def run():
+        db = {"a": {"x": 1}}
+        pushed = []
+        counters = make_counters(db, pushed)
+        await counters.load("a")
+        counters.bump(["a"], "x", 5)
+        db["a"] = {"x": 2, "y": 0}
+        assert await counters.rebuild() == 1
+        await asyncio.sleep(0.05)
+        return await counters.counts("a"), pushed
+
+    counts, pushed = asyncio.run(run())
+    assert counts == {"x": 2}
+    assert pushed[-1] == ("a", {"x": 2})